@@ -0,0 +1,151 @@
+import startup  # first, so that the imports below are timed
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# launch -> first decoded frame of the sample video, in milliseconds
+DEFAULT_THRESHOLD_MS = 3000
+DEFAULT_TRIALS = 5
+CHILD_TIMEOUT_S = 60
+
+_RESULT_PREFIX = 'BENCH_STARTUP '
+
+
+def _generate_sample_video(path, n_frames=300, size=(640, 360), fps=30.0):
+    import cv2
+    import numpy as np
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    try:
+        for i in range(n_frames):
+            img = np.full((size[1], size[0], 3), i % 256, dtype=np.uint8)
+            cv2.putText(img, str(i), (20, size[1] // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+            writer.write(img)
+    finally:
+        writer.release()
+
+
+def _prepare_project_root(path):
+    # a fresh copy of what the application reads, so that no trial finds the caches,
+    # sessions or markdata of the real project or of an earlier trial
+    import res
+
+    os.makedirs(os.path.join(path, 'appinfo'))
+    shutil.copy(res.resolve(res.Domain.APPINFO, 'appinfo.json'), os.path.join(path, 'appinfo'))
+    for domain in (res.Domain.RESOURCES, res.Domain.TEMPLATE):
+        shutil.copytree(res.resolve(domain), os.path.join(path, domain.dir_name))
+
+
+def _run_child(video_path, project_root):
+    # one cold launch of the application; prints the timings as a single line
+    sys.argv.append('disable_debug')
+
+    import res
+    res._PROJECT_ROOT = project_root
+
+    with startup.phase('import qt'):
+        from PyQt5.QtCore import QTimer
+        from PyQt5.QtWidgets import QApplication
+
+    with startup.phase('import main'):
+        from main import MainWindow
+
+    with startup.phase('create application'):
+        app = QApplication(sys.argv)
+    with startup.phase('create main window'):
+        w = MainWindow()
+    w.show()
+
+    QTimer.singleShot(0, lambda: w.centralWidget().update_path(video_path))
+
+    def poll():
+        marks = startup.summary()['marks']
+        if 'first frame presented' in marks:
+            print(_RESULT_PREFIX + json.dumps(startup.summary(n_imports=15)), flush=True)
+            app.quit()
+        elif startup.elapsed() > CHILD_TIMEOUT_S:
+            app.exit(2)
+
+    timer = QTimer()
+    # noinspection PyUnresolvedReferences
+    timer.timeout.connect(poll)
+    timer.start(1)
+
+    return app.exec_()
+
+
+def _launch(video_path, project_root, profile):
+    _prepare_project_root(project_root)
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    args = [sys.executable, os.path.abspath(__file__), '--child', video_path, '--project-root', project_root]
+    if profile:
+        args.append('profile_startup')
+    proc = subprocess.run(
+        args,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=CHILD_TIMEOUT_S + 10
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith(_RESULT_PREFIX):
+            return json.loads(line[len(_RESULT_PREFIX):])
+    raise RuntimeError('benchmark child failed', proc.returncode, proc.stderr[-2000:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures launch to the first decoded frame.')
+    parser.add_argument('--video', help='mp4 to open; a synthetic one is generated if omitted')
+    parser.add_argument('--trials', type=int, default=DEFAULT_TRIALS)
+    parser.add_argument('--threshold-ms', type=float, default=DEFAULT_THRESHOLD_MS)
+    parser.add_argument('--profile', action='store_true', help='also time every module import')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--project-root', help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.child:
+        return _run_child(args.child, args.project_root)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        video_path = args.video
+        if video_path is None:
+            video_path = os.path.join(temp_dir, 'bench_startup.mp4')
+            _generate_sample_video(video_path)
+
+        results = [
+            _launch(video_path, os.path.join(temp_dir, f'trial-{i}'), args.profile)
+            for i in range(args.trials)
+        ]
+
+    first_frame = [r['marks']['first frame presented'] for r in results]
+    window_shown = [r['marks']['window shown'] for r in results]
+    median = statistics.median(first_frame)
+
+    print(f'trials: {len(results)}')
+    print(f'window shown:          median {statistics.median(window_shown):8.1f} ms')
+    print(f'first frame presented: median {median:8.1f} ms  (min {min(first_frame):.1f}, max {max(first_frame):.1f})')
+    print('phases of the median trial (ms):')
+    median_result = sorted(results, key=lambda r: r['marks']['first frame presented'])[len(results) // 2]
+    for name, t in median_result['phases'].items():
+        print(f'  {t:9.1f}  {name}')
+    if args.profile:
+        print('slowest imports of the median trial (self / cumulative ms):')
+        for name, d in median_result['imports'].items():
+            print(f'  {d["self"]:8.1f} / {d["cumulative"]:8.1f}  {name}')
+
+    if median > args.threshold_ms:
+        print(f'REGRESSION: {median:.1f} ms > threshold {args.threshold_ms:.1f} ms')
+        return 1
+    print(f'OK: {median:.1f} ms <= threshold {args.threshold_ms:.1f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import threading
 import time
 from dataclasses import dataclass
 from typing import NamedTuple, Union
@@ -16,6 +17,7 @@ class CacheEntry:
     timestamp: float
     seek_amount: set[int]
     hits: int
+    nbytes: int = 0
 
     def _score_timestamp(self, now_):
         return (60 - min(60, now_ - self.timestamp)) / 60
@@ -67,13 +69,18 @@ class CacheKey(NamedTuple):
 
 
 class Cache:
-    def __init__(self, f, maxsize):
+    def __init__(self, f, maxsize=None, max_bytes=None, sizeof=None):
         self.__f = f
         self.__prev_i = -1
         self.__maxsize = maxsize
+        self.__max_bytes = max_bytes
+        self.__sizeof = sizeof
         self.__limit_factor = 1.1
         self.__reduction_factor = 0.8
         self.__entries: dict[CacheKey, CacheEntry] = {}
+        self.__nbytes = 0
+        # entries may be put from a background thread
+        self.__lock = threading.RLock()
 
     def set_previous_i(self, i):
         self.__prev_i = i
@@ -81,9 +88,25 @@ class Cache:
     def get_seek_amount(self, i):
         return i - self.__prev_i
 
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+    def __len__(self):
+        return len(self.__entries)
+
     def find(self, key):
         return self.__entries.get(key)
 
+    def __add(self, key, entry):
+        if self.__sizeof is not None:
+            entry.nbytes = self.__sizeof(entry.obj)
+        replaced = self.__entries.get(key)
+        if replaced is not None:
+            self.__nbytes -= replaced.nbytes
+        self.__entries[key] = entry
+        self.__nbytes += entry.nbytes
+
     def update_first(self, key, obj):
         entry = CacheEntry(
             obj=obj,
@@ -91,7 +114,7 @@ class Cache:
             seek_amount={self.get_seek_amount(key.i)},
             hits=0
         )
-        self.__entries[key] = entry
+        self.__add(key, entry)
         return entry.obj
 
     def update_hit(self, key, entry):
@@ -100,41 +123,94 @@ class Cache:
         entry.hits += 1
         return entry.obj
 
-    def pop(self, n):
+    def __eviction_order(self):
+        # least valuable first
         sorted_keys = sorted(self.__entries.keys())
         now_ = now()
         values = [self.__entries[k].value(now_) for k in sorted_keys]
-        args = np.argsort(values)
+        return [sorted_keys[i] for i in np.argsort(values, kind='stable')]
+
+    def __evict(self, key):
+        self.__nbytes -= self.__entries.pop(key).nbytes
 
-        for i in args[:n]:
-            self.__entries.pop(sorted_keys[i])
+    def pop(self, n):
+        for key in self.__eviction_order()[:n]:
+            self.__evict(key)
+
+    def pop_bytes(self, nbytes):
+        freed = 0
+        for key in self.__eviction_order():
+            if freed >= nbytes:
+                break
+            freed += self.__entries[key].nbytes
+            self.__evict(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__nbytes = 0
 
     def ensure_size(self):
-        if len(self.__entries) > int(self.__maxsize * self.__limit_factor):
+        if self.__maxsize is not None and len(self.__entries) > int(self.__maxsize * self.__limit_factor):
             self.pop(len(self.__entries) - int(self.__maxsize * self.__reduction_factor))
+        if self.__max_bytes is not None and self.__nbytes > int(self.__max_bytes * self.__limit_factor):
+            self.pop_bytes(self.__nbytes - int(self.__max_bytes * self.__reduction_factor))
 
     def __call__(self, *args, **kwargs):
         key = CacheKey.from_params(args=args, kwargs=kwargs)
-        entry = self.find(key)
+        with self.__lock:
+            entry = self.find(key)
+            if entry is not None:
+                result = self.update_hit(key, entry)
         if entry is None:
             obj = self.__f(*args, **kwargs)
-            result = self.update_first(key, obj)
-        else:
-            result = self.update_hit(key, entry)
-        self.set_previous_i(key.i)
-        self.ensure_size()
+        with self.__lock:
+            if entry is None:
+                # another thread may have put it while this one decoded
+                entry = self.find(key)
+                if entry is None:
+                    result = self.update_first(key, obj)
+                else:
+                    result = self.update_hit(key, entry)
+            self.set_previous_i(key.i)
+            self.ensure_size()
         return result
 
+    def contains(self, *args, **kwargs):
+        with self.__lock:
+            return CacheKey.from_params(args=args, kwargs=kwargs) in self.__entries
+
+    def put(self, obj, *args, **kwargs):
+        # stores what a call with these arguments would return, without calling
+        key = CacheKey.from_params(args=args, kwargs=kwargs)
+        with self.__lock:
+            if key in self.__entries:
+                return False
+            self.__add(key, CacheEntry(obj=obj, timestamp=now(), seek_amount={0}, hits=0))
+            self.ensure_size()
+            return True
 
-def lru_cache(maxsize):
-    print(maxsize)
 
+def lru_cache(maxsize=None, max_bytes=None, sizeof=None):
+    # one cache per instance, so that an instance and its cache are dropped together
     def decorator(f):
-        cache = Cache(f, maxsize)
+        attr_name = f'_cache_{f.__name__}'
+        create_lock = threading.Lock()
+
+        def cache_of(self_) -> Cache:
+            cache = self_.__dict__.get(attr_name)
+            if cache is None:
+                with create_lock:
+                    cache = self_.__dict__.get(attr_name)
+                    if cache is None:
+                        cache = Cache(f, maxsize, max_bytes, sizeof)
+                        setattr(self_, attr_name, cache)
+            return cache
 
         def wrapper(self_, i):
-            return cache(self_, i)
+            return cache_of(self_)(self_, i)
 
+        wrapper.cache_of = cache_of
         return wrapper
 
     return decorator
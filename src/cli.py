@@ -0,0 +1,431 @@
+import sys
+
+# the headless entry point never imports PyQt5 or cv2; debug output would mix
+# with machine-readable results, so it is off unless asked for
+if '--debug' not in sys.argv:
+    sys.argv.append('disable_debug')
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import labels.porting
+from labels import GlobalLabelIndex
+from label_template import LabelDataFormatError
+from labels import _backup as backup
+from labels import aggregate, agreement, batch, migration
+
+# files handed to a worker at once
+CHUNK_SIZE = 8
+
+
+def _map(fn, items, jobs, *args):
+    items = list(items)
+    if jobs == 1 or len(items) <= 1:
+        return [fn(item, *args) for item in items]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(fn, items, *([arg] * len(items) for arg in args), chunksize=CHUNK_SIZE))
+
+
+def _json_files(args):
+    if args.files:
+        return args.files
+    return batch.list_json_files(args.markdata)
+
+
+def command_export(args):
+    if args.incremental:
+        zip_path, json_names = labels.porting.export_incremental(
+            args.dst, markdata_dir=args.markdata, compression=args.compression
+        )
+        if zip_path is None:
+            print('nothing changed since the last export')
+        else:
+            print(f'exported {len(json_names)} changed files to {zip_path}')
+        return 0
+    if not labels.porting.export_all(
+            args.dst, exists_ok=args.overwrite, markdata_dir=args.markdata, compression=args.compression
+    ):
+        print(f'zip file already exists in {args.dst}; pass --overwrite to replace it', file=sys.stderr)
+        return 1
+    print(f'exported to {args.dst}')
+    return 0
+
+
+def command_import(args):
+    status = 0
+    for zip_path in args.zip:
+        try:
+            canceled = labels.porting.import_all(zip_path, markdata_dir=args.markdata, if_newer=args.if_newer)
+        except ValueError as e:
+            print(f'{zip_path}: {e}', file=sys.stderr)
+            return 1
+        if canceled is None:
+            print(f'{zip_path}: unexpected structure, not imported', file=sys.stderr)
+            status = 1
+            continue
+        reason = 'changed locally after the export' if args.if_newer else 'already exists'
+        for json_path in canceled:
+            print(f'{zip_path}: {json_path} {reason}, skipped', file=sys.stderr)
+    return status
+
+
+def command_migrate(args):
+    def progress(results):
+        for r in results:
+            if r.status != migration.MigrationStatus.SKIPPED or args.verbose:
+                where = r.path if r.member is None else f'{r.path}:{r.member}'
+                print(f'{r.status.value:>9s} {where} (json-version {r.version_from})')
+                for problem in r.problems:
+                    print(f'          {problem}')
+
+    report = migration.migrate_all(
+        json_paths=args.files or None,
+        zip_paths=args.zip,
+        markdata_dir=args.markdata,
+        jobs=args.jobs,
+        dry_run=args.dry_run,
+        journal_path=args.journal,
+        report_path=args.report,
+        restart=args.restart,
+        progress=progress
+    )
+    counts = report['counts']
+    print(
+        f'{"would convert" if args.dry_run else "converted"} {counts["converted"]}, '
+        f'skipped {counts["skipped"]}, failed {counts["failed"]}; '
+        f'report: {args.report or migration.default_report_path()}'
+    )
+    return 1 if counts['failed'] else 0
+
+
+def command_validate(args):
+    results = _map(batch.validate_file, _json_files(args), args.jobs)
+    n_invalid = 0
+    for json_path, problems in results:
+        if problems:
+            n_invalid += 1
+        for problem in problems:
+            print(f'{json_path}: {problem}')
+    print(f'{len(results) - n_invalid}/{len(results)} files valid')
+    return 1 if n_invalid else 0
+
+
+def command_stats(args):
+    results = _map(batch.stats_file, _json_files(args), args.jobs)
+    unreadable = [json_path for json_path, s in results if s is None]
+    per_file = {json_path: s for json_path, s in results if s is not None}
+    total = batch.merge_stats(per_file.values())
+
+    if args.json:
+        out = dict(total=total, unreadable=unreadable)
+        if args.per_file:
+            out['files'] = per_file
+        print(json.dumps(out, indent=2, ensure_ascii=False))
+    else:
+        if args.per_file:
+            for json_path, s in per_file.items():
+                print(f'{os.path.basename(json_path)}: {s["n_frames"]} frames {s["labels"]}')
+        print(f'files: {total["n_files"]}, labeled frames: {total["n_frames"]}')
+        for name, count in sorted(total['labels'].items(), key=lambda item: -item[1]):
+            print(f'  label {name}: {count}')
+        for name, count in sorted(total['tags'].items(), key=lambda item: -item[1]):
+            print(f'  tag {name}: {count}')
+        print(f'  authors: {len(total["authors"])}')
+        for json_path in unreadable:
+            print(f'{json_path}: unreadable', file=sys.stderr)
+    return 1 if unreadable else 0
+
+
+def _diff_pairs(a, b):
+    if os.path.isdir(a) and os.path.isdir(b):
+        names = sorted(
+            {name for name in os.listdir(a) if name.endswith('.json')}
+            | {name for name in os.listdir(b) if name.endswith('.json')}
+        )
+        return [(os.path.join(a, name), os.path.join(b, name)) for name in names]
+    return [(a, b)]
+
+
+def _diff_pair(pair):
+    # the changes, None if a side is missing, and the sides that cannot be read
+    path_a, path_b = pair
+    if not os.path.exists(path_a) or not os.path.exists(path_b):
+        return path_a, path_b, None, []
+    json_roots, unreadable = [], []
+    for json_path in pair:
+        try:
+            json_roots.append(batch.load_json_root(json_path))
+        except (OSError, ValueError, KeyError, TypeError, LabelDataFormatError):
+            unreadable.append(json_path)
+    if unreadable:
+        return path_a, path_b, None, unreadable
+    try:
+        return path_a, path_b, batch.diff_json_roots(*json_roots), []
+    except (ValueError, KeyError, TypeError, LabelDataFormatError):
+        return path_a, path_b, None, [path_a, path_b]
+
+
+def command_diff(args):
+    results = _map(_diff_pair, _diff_pairs(args.a, args.b), args.jobs)
+    n_changed = 0
+    n_unreadable = 0
+    for path_a, path_b, changes, unreadable in results:
+        if unreadable:
+            for json_path in unreadable:
+                print(f'{json_path}: unreadable', file=sys.stderr)
+            n_unreadable += 1
+            continue
+        if changes is None:
+            print(f'only in one side: {path_a if os.path.exists(path_a) else path_b}')
+            n_changed += 1
+            continue
+        if not changes:
+            continue
+        n_changed += 1
+        print(f'--- {path_a}')
+        print(f'+++ {path_b}')
+        for change in changes:
+            before = f'{change.prev_label}{list(change.prev_tags)}'
+            after = f'{change.label}{list(change.tags)}'
+            if change.kind == labels.LabelChangeKind.FRAME_ADDED:
+                print(f'+ {change.fi:>7d} {after}')
+            elif change.kind == labels.LabelChangeKind.FRAME_REMOVED:
+                print(f'- {change.fi:>7d} {before}')
+            else:
+                print(f'~ {change.fi:>7d} {before} -> {after}')
+    return 1 if n_changed or n_unreadable else 0
+
+
+def command_aggregate(args):
+    if os.path.isdir(args.out) and any(name.endswith('.json') for name in os.listdir(args.out)) \
+            and not args.overwrite:
+        print(f'{args.out} already contains json files; pass --overwrite to replace them', file=sys.stderr)
+        return 1
+    report = aggregate.aggregate(args.zip, args.out, jobs=args.jobs, report_path=args.report)
+    for problem in report['problems']:
+        print(problem, file=sys.stderr)
+    for video_name, v in report['videos'].items():
+        print(f'{video_name}: {v["n_frames"]} frames from {len(v["annotators"])} annotators, '
+              f'{v["n_conflicts"]} conflicts')
+    print(
+        f'merged {len(report["videos"])} videos from {len(report["annotators"])} annotators; '
+        f'{report["n_conflicts"]} conflicts ({report["n_ties"]} ties)'
+    )
+    return 1 if report['problems'] else 0
+
+
+def _format_ratio(value):
+    return '   -' if value is None else f'{value:.2f}'
+
+
+def command_agreement(args):
+    report = agreement.agreement(args.sources, tolerance=args.tolerance, jobs=args.jobs)
+    for problem in report['problems']:
+        print(problem, file=sys.stderr)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return 0
+
+    def print_labels(label_stats):
+        for label, s in label_stats.items():
+            print(
+                f'  {label:<16s} ref {s["n_reference"]:>6d} cand {s["n_candidate"]:>6d} '
+                f'P {_format_ratio(s["precision"])} R {_format_ratio(s["recall"])} '
+                f'F1 {_format_ratio(s["f1"])} offset {_format_ratio(s["mean_offset"])}'
+            )
+
+    print(f'{len(report["annotators"])} annotators, {report["n_videos"]} videos compared, '
+          f'tolerance {report["tolerance"]} frames')
+    for pair in report['pairs']:
+        print(f'{pair["reference"]} vs {pair["candidate"]} ({pair["n_videos"]} videos)')
+        print_labels(pair['labels'])
+    if report['pairs']:
+        print('all pairs')
+        print_labels(report['labels'])
+    return 0
+
+
+def command_backups(args):
+    if args.video is None:
+        for video_name in backup.list_videos():
+            print(f'{video_name}: {len(backup.read_refs(video_name))} backups')
+        return 0
+    refs = backup.read_refs(args.video)
+    if not refs:
+        print(f'no backups of {args.video}', file=sys.stderr)
+        return 1
+    if args.restore is None:
+        for i, ref in enumerate(refs):
+            print(f'{i:>3d} {ref.time.isoformat(sep=" ", timespec="seconds")} {ref.sha256[:12]}')
+        return 0
+    try:
+        ref = refs[args.restore]
+    except IndexError:
+        print(f'no backup #{args.restore} of {args.video}', file=sys.stderr)
+        return 1
+    out = args.out or f'{args.video}.json'
+    if os.path.exists(out) and not args.overwrite:
+        print(f'{out} already exists; pass --overwrite to replace it', file=sys.stderr)
+        return 1
+    with open(out, 'wb') as f:
+        f.write(backup.load(ref))
+    print(f'restored the backup of {ref.time.isoformat(sep=" ", timespec="seconds")} to {out}')
+    return 0
+
+
+def command_index(args):
+    index = GlobalLabelIndex(args.markdata)
+    index.load()
+    refreshed = index.refresh(jobs=args.jobs)
+    for json_path in refreshed['unreadable']:
+        print(f'{json_path}: unreadable', file=sys.stderr)
+
+    if args.query:
+        frames = index.query(
+            label=args.label,
+            tag=args.tag,
+            video_name=args.video,
+            fi_start=args.start,
+            fi_stop=args.stop
+        )
+        if args.json:
+            print(json.dumps([f._asdict() for f in frames], indent=2, ensure_ascii=False))
+        else:
+            for f in frames:
+                print(f'{f.video_name} {f.fi:>7d} {f.label} {list(f.tags)}')
+        return 0
+
+    if args.gaps is not None:
+        gaps = index.gaps(args.gaps, video_name=args.video)
+        if args.json:
+            print(json.dumps([dict(video=v, start=a, stop=b) for v, a, b in gaps], indent=2, ensure_ascii=False))
+        else:
+            for video_name, start, stop in gaps:
+                print(f'{video_name} {start:>7d} - {stop:>7d} ({stop - start} frames)')
+        return 0
+
+    if args.json:
+        out = dict(refresh=refreshed, labels=index.label_counts(args.video))
+        if args.coverage:
+            out['coverage'] = index.coverage()
+        print(json.dumps(out, indent=2, ensure_ascii=False))
+        return 0
+
+    print(
+        f'{refreshed["n_videos"]} videos indexed: {refreshed["added"]} added, {refreshed["updated"]} updated, '
+        f'{refreshed["removed"]} removed, {refreshed["unchanged"]} unchanged'
+    )
+    for label, count in index.label_counts(args.video).items():
+        print(f'  label {label}: {count}')
+    if args.coverage:
+        for video_name, c in index.coverage().items():
+            if c['n_frames']:
+                print(f'{video_name}: {c["n_frames"]} labeled frames in {c["fi_min"]}-{c["fi_max"]}, '
+                      f'largest gap {c["largest_gap"]}')
+            else:
+                print(f'{video_name}: no labeled frames')
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Headless markdata operations.')
+    parser.add_argument('--markdata', help='markdata directory (default: the application markdata)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--debug', action='store_true', help='keep debug output')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('export', help='write all markdata into a zip file')
+    p.add_argument('dst', help='folder to write the zip file into')
+    p.add_argument('--overwrite', action='store_true')
+    p.add_argument('--incremental', action='store_true', help='only files changed since the last export; import them with --if-newer')
+    p.add_argument(
+        '--compression',
+        choices=sorted(labels.porting.COMPRESSIONS),
+        default=labels.porting.DEFAULT_COMPRESSION
+    )
+    p.set_defaults(handler=command_export)
+
+    p = sub.add_parser('import', help='import exported zip files')
+    p.add_argument('zip', nargs='+')
+    p.add_argument(
+        '--if-newer',
+        action='store_true',
+        help='replace existing files changed before the export, e.g. to apply export --incremental zips (json backend only)'
+    )
+    p.set_defaults(handler=command_import)
+
+    p = sub.add_parser('aggregate', help='merge zip files of several annotators into one dataset')
+    p.add_argument('zip', nargs='+')
+    p.add_argument('--out', required=True, help='folder to write the merged json files into')
+    p.add_argument('--report', help='conflict report path (default: OUT/aggregate-report.json)')
+    p.add_argument('--overwrite', action='store_true')
+    p.set_defaults(handler=command_aggregate)
+
+    p = sub.add_parser('agreement', help='compare the labels of several annotators')
+    p.add_argument('sources', nargs='+', help='exported zip files, json files or markdata directories')
+    p.add_argument(
+        '--tolerance',
+        type=int,
+        default=agreement.DEFAULT_TOLERANCE,
+        help='frames two events may differ by and still match'
+    )
+    p.add_argument('--json', action='store_true', help='print machine-readable output with offset histograms')
+    p.set_defaults(handler=command_agreement)
+
+    p = sub.add_parser('migrate', help='upgrade files and zips to the latest json-version in place')
+    p.add_argument('files', nargs='*', help='json files (default: every file in the markdata directory)')
+    p.add_argument('--zip', nargs='*', default=[], help='exported zip files to migrate as well')
+    p.add_argument('--dry-run', action='store_true')
+    p.add_argument('--report', help='report path (default: appinfo/migration-report.json)')
+    p.add_argument('--journal', help='journal path (default: appinfo/migration-journal.jsonl)')
+    p.add_argument('--restart', action='store_true', help='ignore the journal of earlier runs')
+    p.add_argument('-v', '--verbose', action='store_true', help='also list skipped files')
+    p.set_defaults(handler=command_migrate)
+
+    p = sub.add_parser('index', help='refresh the label index of all markdata files and query it')
+    p.add_argument('--coverage', action='store_true', help='labeled range and largest gap of every video')
+    p.add_argument('--gaps', type=int, metavar='N', help='list unlabeled stretches of at least N frames')
+    p.add_argument('--query', action='store_true', help='list the frames matching the options below')
+    p.add_argument('--video', help='restrict to one video')
+    p.add_argument('--label')
+    p.add_argument('--tag')
+    p.add_argument('--start', type=int, help='first frame of the range')
+    p.add_argument('--stop', type=int, help='frame after the range')
+    p.add_argument('--json', action='store_true', help='print machine-readable output')
+    p.set_defaults(handler=command_index)
+
+    p = sub.add_parser('backups', help='list and restore backups')
+    p.add_argument('video', nargs='?', help='video name (default: list the videos with backups)')
+    p.add_argument('--restore', type=int, metavar='N', help='restore backup N; negative counts from the latest')
+    p.add_argument('--out', help='path to restore to (default: VIDEO.json in the current folder)')
+    p.add_argument('--overwrite', action='store_true')
+    p.set_defaults(handler=command_backups)
+
+    p = sub.add_parser('validate', help='check the structure of json files')
+    p.add_argument('files', nargs='*', help='json files (default: every file in the markdata directory)')
+    p.set_defaults(handler=command_validate)
+
+    p = sub.add_parser('stats', help='count labels and tags')
+    p.add_argument('files', nargs='*', help='json files (default: every file in the markdata directory)')
+    p.add_argument('--json', action='store_true', help='print machine-readable output')
+    p.add_argument('--per-file', action='store_true')
+    p.set_defaults(handler=command_stats)
+
+    p = sub.add_parser('diff', help='compare two json files or two markdata directories')
+    p.add_argument('a')
+    p.add_argument('b')
+    p.set_defaults(handler=command_diff)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.jobs = max(1, args.jobs)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main([arg for arg in sys.argv[1:] if arg != 'disable_debug']))
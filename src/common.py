@@ -2,8 +2,11 @@ import sys
 from enum import Enum
 
 DEBUG = False if 'disable_debug' in sys.argv else True
+MARKDATA_BACKEND = 'sqlite' if 'sqlite_markdata' in sys.argv else 'json'
 
-print(f'{DEBUG=}')
+if DEBUG:
+    print(f'{DEBUG=}')
+    print(f'{MARKDATA_BACKEND=}')
 
 
 class FrameAction(Enum):
@@ -0,0 +1,103 @@
+import time
+from typing import Callable, Optional
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+
+
+class FramePresenter(QObject):
+    # noinspection PyArgumentList
+    frame_presented = pyqtSignal(QImage, int, float)  # img, idx, ts; at most once per refresh interval
+    # noinspection PyArgumentList
+    frame_settled = pyqtSignal(QImage, int, float)  # img, idx, ts; once input has been idle
+
+    DEFAULT_REFRESH_RATE = 60.0
+    IDLE_INTERVAL_MS = 150
+
+    def __init__(self, parent: QObject = None):
+        super().__init__(parent)
+
+        self.__pending: Optional[tuple[QImage, int, float]] = None
+        self.__presented: Optional[tuple[QImage, int, float]] = None
+        self.__settled = True
+        self.__last_present = None
+        self.__deferred: dict[str, Callable[[], None]] = {}
+
+        self.__present_timer = QTimer(self)
+        self.__present_timer.setSingleShot(True)
+        self.__present_timer.setTimerType(Qt.PreciseTimer)
+        # noinspection PyUnresolvedReferences
+        self.__present_timer.timeout.connect(self.__present)
+
+        self.__idle_timer = QTimer(self)
+        self.__idle_timer.setSingleShot(True)
+        self.__idle_timer.setInterval(self.IDLE_INTERVAL_MS)
+        # noinspection PyUnresolvedReferences
+        self.__idle_timer.timeout.connect(self.__settle)
+
+    @property
+    def refresh_interval(self) -> float:
+        screen = QGuiApplication.primaryScreen()
+        rate = screen.refreshRate() if screen is not None else 0
+        return 1 / (rate if rate > 1 else self.DEFAULT_REFRESH_RATE)
+
+    # noinspection PyArgumentList
+    @pyqtSlot(QImage, int, float)
+    def submit(self, img, idx, ts):
+        # a frame still pending is replaced; it would never have been seen
+        self.__pending = img, idx, ts
+        self.input_received()
+
+        if self.__present_timer.isActive():
+            return
+        elapsed = None if self.__last_present is None else time.perf_counter() - self.__last_present
+        remaining = 0 if elapsed is None else self.refresh_interval - elapsed
+        if remaining <= 0:
+            self.__present()
+        else:
+            self.__present_timer.start(int(remaining * 1000) + 1)
+
+    def input_received(self):
+        self.__idle_timer.start()
+
+    def defer(self, key: str, callback: Callable[[], None]):
+        # runs `callback` once input settles; a later callback with the same key replaces it
+        self.__deferred[key] = callback
+        if not self.__idle_timer.isActive():
+            self.__idle_timer.start()
+
+    def reset(self):
+        self.__present_timer.stop()
+        self.__idle_timer.stop()
+        self.__pending = None
+        self.__presented = None
+        self.__settled = True
+        self.__last_present = None
+        self.__deferred.clear()
+
+    # noinspection PyArgumentList
+    @pyqtSlot()
+    def __present(self):
+        if self.__pending is None:
+            return
+        frame, self.__pending = self.__pending, None
+        self.__presented = frame
+        self.__settled = False
+        self.__last_present = time.perf_counter()
+        # noinspection PyUnresolvedReferences
+        self.frame_presented.emit(*frame)
+
+    # noinspection PyArgumentList
+    @pyqtSlot()
+    def __settle(self):
+        if self.__pending is not None:
+            # still throttled; settle right after it is presented
+            self.__idle_timer.start()
+            return
+        deferred, self.__deferred = self.__deferred, {}
+        for callback in deferred.values():
+            callback()
+        if not self.__settled:
+            self.__settled = True
+            # noinspection PyUnresolvedReferences
+            self.frame_settled.emit(*self.__presented)
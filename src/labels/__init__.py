@@ -1,2 +1,7 @@
 from . import _json_compat as compat
+from ._changes import LabelChange, LabelChangeKind
+from ._density import LabelDensityPyramid
+from ._filter import LabelFilter
+from ._global_index import GlobalLabelIndex
 from ._json_wrap import LabelDataJson
+from ._sqlite_store import MarkdataDatabase
@@ -1,21 +1,246 @@
-import codecs
+import atexit
 import datetime
+import gzip
+import hashlib
 import json
 import os
+import queue
+import re
+import threading
+import time
+from typing import NamedTuple, Optional
 
 from res import resolve, Domain
+from . import _file_lock as file_lock
 
+# every backup is a gzip object named by the sha256 of the file it copies; a ref file
+# per video lists which object was current when, so unchanged content adds nothing.
+# the work is done on a background thread, off the load path
 
-def take(src_json_path, src_json_root):
-    _, src_json_name = os.path.split(src_json_path)
-    now = datetime.datetime.now()
-    dst_json_name = f'{os.path.splitext(src_json_name)[0]} {now.strftime("%Y%m%d_%H%M%S_%f")}.json'
-    dst_json_path = resolve(
-        Domain.MARKDATA_BACKUP,
-        now.strftime('%Y%m%d'),
-        dst_json_name,
-        make_dirs='parent'
-    )
+# retention: the last KEEP_PER_DAY backups of each of the KEEP_DAYS most recent days with backups
+KEEP_PER_DAY = 5
+KEEP_DAYS = 30
 
-    with codecs.open(dst_json_path, 'w', encoding='utf-8') as f:
-        json.dump(src_json_root, f, indent=2, sort_keys=True, ensure_ascii=False)
+# unreferenced objects younger than this are kept; another process may be about to refer to them
+GC_GRACE_SECONDS = 60 * 60
+
+_LEGACY_DIR_PATTERN = re.compile(r'^\d{8}$')
+_LEGACY_FILE_PATTERN = re.compile(r'^(.*) (\d{8}_\d{6}_\d{6})\.json$')
+
+
+class BackupRef(NamedTuple):
+    time: datetime.datetime
+    sha256: str
+
+    def to_json(self):
+        return dict(time=self.time.isoformat(), sha256=self.sha256)
+
+    @classmethod
+    def from_json(cls, entry):
+        return cls(datetime.datetime.fromisoformat(entry['time']), entry['sha256'])
+
+
+def _object_path(sha256, make_dirs=None):
+    return resolve(Domain.MARKDATA_BACKUP, 'objects', sha256[:2], f'{sha256}.json.gz', make_dirs=make_dirs)
+
+
+def _ref_path(video_name, make_dirs=None):
+    return resolve(Domain.MARKDATA_BACKUP, 'refs', f'{video_name}.jsonl', make_dirs=make_dirs)
+
+
+def read_refs(video_name) -> list[BackupRef]:
+    path = _ref_path(video_name)
+    if not os.path.exists(path):
+        return []
+    refs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                refs.append(BackupRef.from_json(json.loads(line)))
+            except (ValueError, KeyError):
+                continue
+    return refs
+
+
+def _write_refs(video_name, refs: list[BackupRef]):
+    path = _ref_path(video_name, make_dirs='parent')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for ref in refs:
+            f.write(json.dumps(ref.to_json()) + '\n')
+    os.replace(tmp_path, path)
+
+
+def list_videos() -> list[str]:
+    refs_dir = resolve(Domain.MARKDATA_BACKUP, 'refs')
+    if not os.path.isdir(refs_dir):
+        return []
+    return sorted(name[:-len('.jsonl')] for name in os.listdir(refs_dir) if name.endswith('.jsonl'))
+
+
+def load(ref: BackupRef) -> bytes:
+    with gzip.open(_object_path(ref.sha256), 'rb') as f:
+        return f.read()
+
+
+def _store(data: bytes) -> str:
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = _object_path(sha256, make_dirs='parent')
+    try:
+        # an object about to be referenced again is young for the garbage collection
+        os.utime(path)
+        return sha256
+    except FileNotFoundError:
+        pass
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with gzip.open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return sha256
+
+
+def retained(refs: list[BackupRef]) -> list[BackupRef]:
+    # `refs` in chronological order
+    by_day: dict[datetime.date, list[BackupRef]] = {}
+    for ref in refs:
+        by_day.setdefault(ref.time.date(), []).append(ref)
+    kept = []
+    for day in sorted(by_day)[-KEEP_DAYS:]:
+        kept.extend(by_day[day][-KEEP_PER_DAY:])
+    return kept
+
+
+def _add_refs(video_name, new_refs: list[BackupRef]):
+    # other processes may back up the same video
+    with file_lock.locked(_ref_path(video_name, make_dirs='parent')):
+        refs = []
+        for ref in sorted(set(read_refs(video_name) + new_refs)):
+            # consecutive copies of the same content are one backup
+            if not refs or refs[-1].sha256 != ref.sha256:
+                refs.append(ref)
+        _write_refs(video_name, retained(refs))
+
+
+def backup_now(json_path, data: bytes, now: datetime.datetime = None) -> bool:
+    # returns False if the content is what the latest backup already holds
+    video_name = os.path.splitext(os.path.basename(json_path))[0]
+    sha256 = hashlib.sha256(data).hexdigest()
+    refs = read_refs(video_name)
+    if refs and refs[-1].sha256 == sha256 and os.path.exists(_object_path(sha256)):
+        return False
+    _store(data)
+    _add_refs(video_name, [BackupRef(now or datetime.datetime.now(), sha256)])
+    return True
+
+
+def import_legacy():
+    # converts the dated folders of full copies written by earlier versions
+    backup_dir = resolve(Domain.MARKDATA_BACKUP)
+    if not os.path.isdir(backup_dir):
+        return
+    for dir_name in sorted(os.listdir(backup_dir)):
+        dir_path = os.path.join(backup_dir, dir_name)
+        if not _LEGACY_DIR_PATTERN.match(dir_name) or not os.path.isdir(dir_path):
+            continue
+        by_video: dict[str, list[tuple[BackupRef, str]]] = {}
+        for name in os.listdir(dir_path):
+            m = _LEGACY_FILE_PATTERN.match(name)
+            if m is None:
+                continue
+            path = os.path.join(dir_path, name)
+            with open(path, 'rb') as f:
+                sha256 = _store(f.read())
+            when = datetime.datetime.strptime(m.group(2), '%Y%m%d_%H%M%S_%f')
+            by_video.setdefault(m.group(1), []).append((BackupRef(when, sha256), path))
+        for video_name, entries in by_video.items():
+            entries.sort()
+            _add_refs(video_name, [ref for ref, _ in entries])
+            # the copies go only once their refs are written
+            for _, path in entries:
+                os.remove(path)
+        if not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+
+def collect_garbage() -> int:
+    objects_dir = resolve(Domain.MARKDATA_BACKUP, 'objects')
+    if not os.path.isdir(objects_dir):
+        return 0
+    referenced = set()
+    for video_name in list_videos():
+        with file_lock.locked(_ref_path(video_name)):
+            referenced.update(ref.sha256 for ref in read_refs(video_name))
+    deadline = time.time() - GC_GRACE_SECONDS
+    n_removed = 0
+    for sub_name in os.listdir(objects_dir):
+        sub_dir = os.path.join(objects_dir, sub_name)
+        for name in os.listdir(sub_dir):
+            path = os.path.join(sub_dir, name)
+            sha256 = name.split('.')[0]
+            if sha256 not in referenced and os.path.getmtime(path) < deadline:
+                os.remove(path)
+                n_removed += 1
+        if not os.listdir(sub_dir):
+            os.rmdir(sub_dir)
+    return n_removed
+
+
+def maintain():
+    import_legacy()
+    collect_garbage()
+
+
+class _Worker:
+    def __init__(self):
+        self.__queue = queue.Queue()
+        self.__thread: Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+        self.__maintained = False
+
+    def put(self, json_path, data: Optional[bytes]):
+        # `data` None reads the file on the worker
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name='markdata-backup', daemon=True)
+                self.__thread.start()
+        self.__queue.put((json_path, data, datetime.datetime.now()))
+
+    def join(self):
+        self.__queue.join()
+
+    def __run(self):
+        while True:
+            json_path, data, now = self.__queue.get()
+            try:
+                if data is None:
+                    with open(json_path, 'rb') as f:
+                        data = f.read()
+                backup_now(json_path, data, now)
+            except OSError as e:
+                print('backup failed', json_path, repr(e))
+            finally:
+                self.__queue.task_done()
+            if not self.__maintained and self.__queue.empty():
+                self.__maintained = True
+                try:
+                    maintain()
+                except OSError as e:
+                    print('backup maintenance failed', repr(e))
+
+
+_worker = _Worker()
+# pending backups are written before the process exits
+atexit.register(_worker.join)
+
+
+def take(src_json_path, src_json_bytes: bytes):
+    _worker.put(src_json_path, src_json_bytes)
+
+
+def take_file(src_json_path):
+    # for loads that do not read the file themselves
+    _worker.put(src_json_path, None)
+
+
+def flush():
+    _worker.join()
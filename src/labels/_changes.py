@@ -0,0 +1,42 @@
+from enum import Enum
+from typing import NamedTuple, Optional
+
+
+class LabelChangeKind(Enum):
+    FRAME_ADDED = 'frame_added'
+    FRAME_REMOVED = 'frame_removed'
+    LABEL_CHANGED = 'label_changed'
+    TAGS_CHANGED = 'tags_changed'
+
+
+class LabelChange(NamedTuple):
+    kind: LabelChangeKind
+    fi: int
+    label: Optional[str]
+    tags: tuple[str, ...]
+    prev_label: Optional[str]
+    prev_tags: tuple[str, ...]
+
+    @classmethod
+    def between(cls, fi, before, after) -> Optional['LabelChange']:
+        # `before` and `after` are (label, tags) or None for an unlabeled frame
+        if before == after:
+            return None
+        if before is None:
+            kind = LabelChangeKind.FRAME_ADDED
+        elif after is None:
+            kind = LabelChangeKind.FRAME_REMOVED
+        elif before[0] != after[0]:
+            kind = LabelChangeKind.LABEL_CHANGED
+        else:
+            kind = LabelChangeKind.TAGS_CHANGED
+        label, tags = after or (None, ())
+        prev_label, prev_tags = before or (None, ())
+        return cls(
+            kind=kind,
+            fi=fi,
+            label=label,
+            tags=tags,
+            prev_label=prev_label,
+            prev_tags=prev_tags
+        )
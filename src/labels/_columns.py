@@ -0,0 +1,457 @@
+from typing import Optional, Iterable
+
+import numpy as np
+
+from label_template import LabelTemplate, LabelDataFormatError
+from ._changes import LabelChange
+
+NO_LABEL = -1
+
+
+class LabelColumns:
+    FI_DTYPE = np.int32
+    LABEL_DTYPE = np.int16
+    TAG_MASK_DTYPE = np.uint64
+    MAX_TAGS = 64
+
+    def __init__(self, label_names: Iterable[str] = (), tag_names: Iterable[str] = ()):
+        self.__label_names: list[str] = []
+        self.__label_ids: dict[str, int] = {}
+        self.__tag_names: list[str] = []
+        self.__tag_ids: dict[str, int] = {}
+
+        for name in label_names:
+            self.intern_label(name)
+        for name in tag_names:
+            self.intern_tag(name)
+
+        self.__fi = np.zeros(0, dtype=self.FI_DTYPE)
+        self.__label = np.zeros(0, dtype=self.LABEL_DTYPE)
+        self.__tags = np.zeros(0, dtype=self.TAG_MASK_DTYPE)
+        # masks keep no order; the tags of the frames whose order on disk differs
+        # from the interned order, so that writing a file does not reorder them
+        self.__tag_order: dict[int, tuple[str, ...]] = {}
+
+        self.__rank = None
+
+    # interning
+
+    def intern_template(self, template: LabelTemplate):
+        for _, name, tags in template.iter_labels():
+            self.intern_label(name)
+            for tag in tags:
+                self.intern_tag(tag)
+
+    def intern_label(self, label_name: Optional[str]) -> int:
+        if label_name is None:
+            return NO_LABEL
+        label_id = self.__label_ids.get(label_name)
+        if label_id is None:
+            label_id = len(self.__label_names)
+            if label_id > np.iinfo(self.LABEL_DTYPE).max:
+                raise LabelDataFormatError('too many distinct labels')
+            self.__label_names.append(label_name)
+            self.__label_ids[label_name] = label_id
+        return label_id
+
+    def intern_tag(self, tag_name: str) -> int:
+        tag_id = self.__tag_ids.get(tag_name)
+        if tag_id is None:
+            tag_id = len(self.__tag_names)
+            if tag_id >= self.MAX_TAGS:
+                raise LabelDataFormatError('too many distinct tags', self.MAX_TAGS)
+            self.__tag_names.append(tag_name)
+            self.__tag_ids[tag_name] = tag_id
+        return tag_id
+
+    def label_id(self, label_name: Optional[str]) -> Optional[int]:
+        if label_name is None:
+            return NO_LABEL
+        return self.__label_ids.get(label_name)
+
+    def label_name(self, label_id: int) -> Optional[str]:
+        if label_id == NO_LABEL:
+            return None
+        return self.__label_names[label_id]
+
+    def tag_bit(self, tag_name: str) -> Optional[int]:
+        tag_id = self.__tag_ids.get(tag_name)
+        if tag_id is None:
+            return None
+        return 1 << tag_id
+
+    def mask_of_tags(self, tag_names: Iterable[str]) -> int:
+        mask = 0
+        for tag_name in tag_names:
+            mask |= 1 << self.intern_tag(tag_name)
+        return mask
+
+    def tags_of_mask(self, mask: int) -> tuple[str, ...]:
+        mask = int(mask)
+        return tuple(
+            name
+            for tag_id, name in enumerate(self.__tag_names)
+            if (mask >> tag_id) & 1
+        )
+
+    def __ordered_tags(self, fi: int, mask) -> tuple[str, ...]:
+        tags = self.tags_of_mask(mask)
+        order = self.__tag_order.get(fi)
+        if order is not None and len(order) == len(tags) and set(order) == set(tags):
+            return order
+        return tags
+
+    def __set_tag_order(self, fi: int, tags: Iterable[str]):
+        tags = tuple(tags)
+        if len(tags) > 1 and tags != self.tags_of_mask(self.mask_of_tags(tags)):
+            self.__tag_order[fi] = tags
+        else:
+            self.__tag_order.pop(fi, None)
+
+    def __drop_tag_order(self, fis: np.ndarray):
+        if self.__tag_order:
+            for fi in self.__tag_order.keys() & set(fis.tolist()):
+                del self.__tag_order[fi]
+
+    def tags_at(self, pos: int) -> tuple[str, ...]:
+        return self.__ordered_tags(int(self.__fi[pos]), self.__tags[pos])
+
+    @property
+    def tag_order(self) -> dict[int, tuple[str, ...]]:
+        return dict(self.__tag_order)
+
+    @property
+    def label_names(self) -> tuple[str, ...]:
+        return tuple(self.__label_names)
+
+    @property
+    def tag_names(self) -> tuple[str, ...]:
+        return tuple(self.__tag_names)
+
+    # columns
+
+    @property
+    def fi(self) -> np.ndarray:
+        return self.__fi
+
+    @property
+    def label_ids(self) -> np.ndarray:
+        return self.__label
+
+    @property
+    def tag_masks(self) -> np.ndarray:
+        return self.__tags
+
+    def __len__(self):
+        return len(self.__fi)
+
+    @property
+    def nbytes(self) -> int:
+        return self.__fi.nbytes + self.__label.nbytes + self.__tags.nbytes
+
+    def __invalidate(self):
+        self.__rank = None
+
+    # conversion from/to json-version 2 `frames`
+
+    def load_frames(self, frames: dict[str, dict]):
+        n = len(frames)
+        fi = np.empty(n, dtype=self.FI_DTYPE)
+        label = np.empty(n, dtype=self.LABEL_DTYPE)
+        tags = np.empty(n, dtype=self.TAG_MASK_DTYPE)
+        tag_order = {}
+        for i, frame in enumerate(frames.values()):
+            fi[i] = frame['fi']
+            label[i] = self.intern_label(frame['label'])
+            tags[i] = self.mask_of_tags(frame['tags'])
+            if len(frame['tags']) > 1:
+                order = tuple(frame['tags'])
+                if order != self.tags_of_mask(tags[i]):
+                    tag_order[frame['fi']] = order
+
+        order = np.argsort(fi, kind='stable')
+        self.__fi, self.__label, self.__tags = fi[order], label[order], tags[order]
+        self.__tag_order = tag_order
+        self.__invalidate()
+
+    @classmethod
+    def from_arrays(cls, label_names, tag_names, fi, label_ids, tag_masks, tag_order=None) -> 'LabelColumns':
+        columns = cls(label_names=label_names, tag_names=tag_names)
+        columns.__fi = np.asarray(fi, dtype=cls.FI_DTYPE)
+        columns.__label = np.asarray(label_ids, dtype=cls.LABEL_DTYPE)
+        columns.__tags = np.asarray(tag_masks, dtype=cls.TAG_MASK_DTYPE)
+        columns.__tag_order = {int(fi_): tuple(tags) for fi_, tags in (tag_order or {}).items()}
+        if not len(columns.__fi) == len(columns.__label) == len(columns.__tags):
+            raise LabelDataFormatError('column length mismatch')
+        return columns
+
+    def to_frames(self) -> dict[str, dict]:
+        return {
+            str(fi): dict(
+                fi=fi,
+                label=self.label_name(label_id),
+                tags=list(self.__ordered_tags(fi, mask))
+            )
+            for fi, label_id, mask in zip(
+                self.__fi.tolist(),
+                self.__label.tolist(),
+                self.__tags.tolist()
+            )
+        }
+
+    # change tracking
+
+    def copy_state(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.__fi.copy(), self.__label.copy(), self.__tags.copy()
+
+    def diff(self, state, fis) -> list[LabelChange]:
+        fis = np.unique(np.asarray(list(fis), dtype=self.FI_DTYPE))
+
+        def lookup(fi_array, label_array, tags_array):
+            if len(fi_array) == 0:
+                return (
+                    np.zeros(len(fis), dtype=bool),
+                    np.full(len(fis), NO_LABEL, dtype=self.LABEL_DTYPE),
+                    np.zeros(len(fis), dtype=self.TAG_MASK_DTYPE)
+                )
+            pos = np.minimum(np.searchsorted(fi_array, fis), len(fi_array) - 1)
+            exists = fi_array[pos] == fis
+            return exists, np.where(exists, label_array[pos], NO_LABEL), np.where(exists, tags_array[pos], 0)
+
+        exists_before, label_before, tags_before = lookup(*state)
+        exists_after, label_after, tags_after = lookup(self.__fi, self.__label, self.__tags)
+
+        differs = (exists_before != exists_after) \
+            | (label_before != label_after) \
+            | (tags_before != tags_after)
+
+        changes = []
+        for i in np.flatnonzero(differs).tolist():
+            before = (self.label_name(int(label_before[i])), self.tags_of_mask(tags_before[i])) \
+                if exists_before[i] else None
+            after = (self.label_name(int(label_after[i])), self.__ordered_tags(int(fis[i]), tags_after[i])) \
+                if exists_after[i] else None
+            changes.append(LabelChange.between(int(fis[i]), before=before, after=after))
+        return changes
+
+    # point access
+
+    def find(self, fi: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.__fi, fi))
+        if pos < len(self.__fi) and self.__fi[pos] == fi:
+            return pos
+        return None
+
+    def get_label(self, fi: int) -> Optional[str]:
+        pos = self.find(fi)
+        if pos is None:
+            return None
+        return self.label_name(int(self.__label[pos]))
+
+    def get_tags(self, fi: int) -> tuple[str, ...]:
+        pos = self.find(fi)
+        if pos is None:
+            return tuple()
+        return self.__ordered_tags(fi, self.__tags[pos])
+
+    def set_label(self, fi: int, label_name: Optional[str]):
+        label_id = self.intern_label(label_name)
+        pos = int(np.searchsorted(self.__fi, fi))
+        if pos < len(self.__fi) and self.__fi[pos] == fi:
+            self.__label[pos] = label_id
+            self.__tags[pos] = 0
+            self.__tag_order.pop(fi, None)
+        else:
+            self.__fi = np.insert(self.__fi, pos, fi)
+            self.__label = np.insert(self.__label, pos, label_id)
+            self.__tags = np.insert(self.__tags, pos, 0)
+        self.__invalidate()
+
+    def assign(self, fi: int, value: Optional[tuple[Optional[str], Iterable[str]]]):
+        # sets the label and the tags of a frame at once; None removes the frame
+        if value is None:
+            self.remove(fi)
+            return
+        label_name, tag_names = value
+        self.set_label(fi, label_name)
+        self.__tags[self.find(fi)] = self.mask_of_tags(tag_names)
+        self.__set_tag_order(fi, tag_names)
+
+    def remove(self, fi: int) -> bool:
+        pos = self.find(fi)
+        if pos is None:
+            return False
+        self.__fi = np.delete(self.__fi, pos)
+        self.__label = np.delete(self.__label, pos)
+        self.__tags = np.delete(self.__tags, pos)
+        self.__tag_order.pop(fi, None)
+        self.__invalidate()
+        return True
+
+    def add_tag(self, fi: int, tag_name: str) -> bool:
+        pos = self.find(fi)
+        if pos is None:
+            return False
+        bit = self.TAG_MASK_DTYPE(1 << self.intern_tag(tag_name))
+        if self.__tags[pos] & bit:
+            return False
+        # appended, as the tags of a frame always were
+        order = self.__ordered_tags(fi, self.__tags[pos]) + (tag_name,)
+        self.__tags[pos] |= bit
+        self.__set_tag_order(fi, order)
+        return True
+
+    def remove_tag(self, fi: int, tag_name: str) -> bool:
+        pos = self.find(fi)
+        bit = self.tag_bit(tag_name)
+        if pos is None or bit is None:
+            return False
+        bit = self.TAG_MASK_DTYPE(bit)
+        if not self.__tags[pos] & bit:
+            return False
+        order = tuple(tag for tag in self.__ordered_tags(fi, self.__tags[pos]) if tag != tag_name)
+        self.__tags[pos] &= ~bit
+        self.__set_tag_order(fi, order)
+        return True
+
+    # bulk edits; each returns the frame indexes it changed
+
+    def __positions(self, fis) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        fis = np.unique(np.asarray(fis, dtype=self.FI_DTYPE))
+        pos = np.searchsorted(self.__fi, fis)
+        if len(self.__fi) == 0:
+            exists = np.zeros(len(fis), dtype=bool)
+        else:
+            exists = self.__fi[np.minimum(pos, len(self.__fi) - 1)] == fis
+        return fis, pos, exists
+
+    def set_labels(self, fis, label_name: Optional[str]) -> np.ndarray:
+        label_id = self.intern_label(label_name)
+        fis, pos, exists = self.__positions(fis)
+
+        pos_existing = pos[exists]
+        self.__label[pos_existing] = label_id
+        self.__tags[pos_existing] = 0
+        self.__drop_tag_order(fis[exists])
+
+        fis_new = fis[~exists]
+        if len(fis_new):
+            fi = np.concatenate([self.__fi, fis_new])
+            order = np.argsort(fi, kind='stable')
+            self.__fi = fi[order]
+            self.__label = np.concatenate([
+                self.__label,
+                np.full(len(fis_new), label_id, dtype=self.LABEL_DTYPE)
+            ])[order]
+            self.__tags = np.concatenate([
+                self.__tags,
+                np.zeros(len(fis_new), dtype=self.TAG_MASK_DTYPE)
+            ])[order]
+
+        self.__invalidate()
+        return fis
+
+    def __remove_mask(self, mask: np.ndarray) -> np.ndarray:
+        removed = self.__fi[mask]
+        if len(removed):
+            keep = ~mask
+            self.__fi, self.__label, self.__tags \
+                = self.__fi[keep], self.__label[keep], self.__tags[keep]
+            self.__drop_tag_order(removed)
+            self.__invalidate()
+        return removed
+
+    def remove_many(self, fis) -> np.ndarray:
+        return self.__remove_mask(np.isin(self.__fi, np.asarray(fis, dtype=self.FI_DTYPE)))
+
+    def remove_range(self, fi_start: int, fi_stop: int) -> np.ndarray:
+        mask = np.zeros(len(self.__fi), dtype=bool)
+        mask[self.span(fi_start, fi_stop)] = True
+        return self.__remove_mask(mask)
+
+    def add_tag_many(self, fis, tag_name: str) -> np.ndarray:
+        bit = self.TAG_MASK_DTYPE(1 << self.intern_tag(tag_name))
+        _, pos, exists = self.__positions(fis)
+        pos = pos[exists]
+        pos = pos[(self.__label[pos] != NO_LABEL) & ((self.__tags[pos] & bit) == 0)]
+        # frames with an order of their own get the tag appended; the others take
+        # it in the interned order
+        kept_orders = self.__kept_tag_orders(pos)
+        self.__tags[pos] |= bit
+        for fi, order in kept_orders.items():
+            self.__set_tag_order(fi, order + (tag_name,))
+        return self.__fi[pos]
+
+    def remove_tag_many(self, fis, tag_name: str) -> np.ndarray:
+        bit = self.tag_bit(tag_name)
+        if bit is None:
+            return np.zeros(0, dtype=self.FI_DTYPE)
+        bit = self.TAG_MASK_DTYPE(bit)
+        _, pos, exists = self.__positions(fis)
+        pos = pos[exists]
+        pos = pos[(self.__tags[pos] & bit) != 0]
+        kept_orders = self.__kept_tag_orders(pos)
+        self.__tags[pos] &= ~bit
+        for fi, order in kept_orders.items():
+            self.__set_tag_order(fi, tuple(tag for tag in order if tag != tag_name))
+        return self.__fi[pos]
+
+    def __kept_tag_orders(self, pos: np.ndarray) -> dict[int, tuple[str, ...]]:
+        if not self.__tag_order:
+            return {}
+        masks = dict(zip(self.__fi[pos].tolist(), self.__tags[pos].tolist()))
+        return {
+            fi: self.__ordered_tags(fi, masks[fi])
+            for fi in self.__tag_order.keys() & masks.keys()
+        }
+
+    def relabel(self, src_label_name: str, dst_label_name: str) -> np.ndarray:
+        src_label_id = self.label_id(src_label_name)
+        if src_label_id is None or src_label_name == dst_label_name:
+            return np.zeros(0, dtype=self.FI_DTYPE)
+        mask = self.__label == src_label_id
+        self.__label[mask] = self.intern_label(dst_label_name)
+        self.__invalidate()
+        return self.__fi[mask]
+
+    # vectorized queries
+
+    def label_rank(self) -> np.ndarray:
+        # 1-based running count of each frame within its own label
+        if self.__rank is None:
+            rank = np.zeros(len(self.__fi), dtype=np.int64)
+            for label_id in np.unique(self.__label):
+                mask = self.__label == label_id
+                rank[mask] = np.arange(1, np.count_nonzero(mask) + 1)
+            self.__rank = rank
+        return self.__rank
+
+    def get_label_count(self, fi: int) -> Optional[int]:
+        pos = self.find(fi)
+        if pos is None or self.__label[pos] == NO_LABEL:
+            return None
+        return int(self.label_rank()[pos])
+
+    def span(self, fi_start: int, fi_stop: int) -> slice:
+        # positions of the frames in [fi_start, fi_stop)
+        start, stop = np.searchsorted(self.__fi, [fi_start, fi_stop])
+        return slice(int(start), int(stop))
+
+    def nearest(self, fi_start: int, direction: int, n: int = None) -> np.ndarray:
+        if direction > 0:
+            pos = int(np.searchsorted(self.__fi, fi_start, side='right'))
+            fi_array = self.__fi[pos:] if n is None else self.__fi[pos:pos + n]
+        else:
+            pos = int(np.searchsorted(self.__fi, fi_start, side='left'))
+            fi_array = self.__fi[:pos] if n is None else self.__fi[max(0, pos - n):pos]
+            fi_array = fi_array[::-1]
+        return fi_array
+
+    def label_counts(self) -> dict[str, int]:
+        labeled = self.__label[self.__label != NO_LABEL]
+        counts = np.bincount(labeled, minlength=len(self.__label_names))
+        return {
+            name: int(count)
+            for name, count in zip(self.__label_names, counts)
+            if count
+        }
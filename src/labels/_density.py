@@ -0,0 +1,126 @@
+from typing import Iterable, Optional
+
+import numpy as np
+
+from ._changes import LabelChange
+from ._columns import LabelColumns, NO_LABEL
+
+
+class LabelDensityPyramid:
+    # level k counts the labeled frames of each label in bins of 2 ** k frames;
+    # level 0 is one bin per frame and the top level is a single bin
+
+    def __init__(self, n_frames: int, label_names: Iterable[str] = ()):
+        self.__n_frames = max(1, int(n_frames))
+        self.__n_levels = int(self.__n_frames - 1).bit_length() + 1
+        self.__rows: dict[str, int] = {}
+        self.__levels: list[np.ndarray] = [
+            np.zeros((0, self.__n_bins(level)), dtype=self.__count_dtype(level))
+            for level in range(self.__n_levels)
+        ]
+        for label_name in label_names:
+            self.__row(label_name)
+
+    @classmethod
+    def from_columns(cls, columns: LabelColumns, n_frames: int) -> 'LabelDensityPyramid':
+        pyramid = cls(n_frames, columns.label_names)
+        fi, label_ids = columns.fi, columns.label_ids
+        valid = (label_ids != NO_LABEL) & (fi >= 0) & (fi < pyramid.n_frames)
+        # label ids of the columns are the pyramid rows as the names were added in order
+        pyramid.__levels[0][label_ids[valid], fi[valid]] = 1
+        for level in range(1, pyramid.__n_levels):
+            pyramid.__levels[level] = pyramid.__reduce(level)
+        return pyramid
+
+    @property
+    def n_frames(self) -> int:
+        return self.__n_frames
+
+    @property
+    def n_levels(self) -> int:
+        return self.__n_levels
+
+    @property
+    def label_names(self) -> tuple[str, ...]:
+        return tuple(self.__rows)
+
+    def __n_bins(self, level):
+        return -(-self.__n_frames >> level)
+
+    @staticmethod
+    def __count_dtype(level):
+        return np.min_scalar_type(1 << level)
+
+    def __reduce(self, level):
+        below = self.__levels[level - 1]
+        if below.shape[1] % 2:
+            below = np.pad(below, ((0, 0), (0, 1)))
+        n_rows = below.shape[0]
+        return below.reshape(n_rows, -1, 2).sum(axis=2, dtype=self.__count_dtype(level))
+
+    def __row(self, label_name: str) -> int:
+        row = self.__rows.get(label_name)
+        if row is None:
+            row = len(self.__rows)
+            self.__rows[label_name] = row
+            self.__levels = [
+                np.vstack([counts, np.zeros((1, counts.shape[1]), dtype=counts.dtype)])
+                for counts in self.__levels
+            ]
+        return row
+
+    # incremental updates
+
+    def apply(self, changes: Iterable[LabelChange]):
+        added, removed = [], []
+        for change in changes:
+            if change.label == change.prev_label or not 0 <= change.fi < self.__n_frames:
+                continue
+            if change.prev_label is not None:
+                removed.append((self.__row(change.prev_label), change.fi))
+            if change.label is not None:
+                added.append((self.__row(change.label), change.fi))
+
+        for entries, ufunc in ((added, np.add), (removed, np.subtract)):
+            if not entries:
+                continue
+            rows, fis = np.array(entries, dtype=np.int64).T
+            for level, counts in enumerate(self.__levels):
+                ufunc.at(counts, (rows, fis >> level), 1)
+
+    # queries
+
+    def level_for(self, frames_per_pixel: float) -> int:
+        if frames_per_pixel <= 1:
+            return 0
+        return min(int(np.log2(frames_per_pixel)), self.__n_levels - 1)
+
+    def counts(self, label_name: str, level: int = None) -> Optional[np.ndarray]:
+        row = self.__rows.get(label_name)
+        if row is None:
+            return None
+        return self.__levels[self.__n_levels - 1 if level is None else level][row]
+
+    def density(self, fi_start: float, fi_stop: float, n_pixels: int) -> np.ndarray:
+        # fraction of labeled frames per pixel and label (rows in the order of `label_names`);
+        # only the bins of a single level inside the range are touched
+        frames_per_pixel = (fi_stop - fi_start) / n_pixels
+        level = self.level_for(frames_per_pixel)
+        width = 1 << level
+        n_bins = self.__n_bins(level)
+
+        edges = fi_start + np.arange(n_pixels + 1) * frames_per_pixel
+        bins = np.clip(np.floor(edges / width).astype(np.int64), 0, n_bins)
+        lo, hi = bins[:-1], np.maximum(bins[1:], bins[:-1] + 1)
+
+        b_first = int(lo[0])
+        b_last = int(min(hi[-1], n_bins))
+        counts = self.__levels[level][:, b_first:b_last]
+        cumulative = np.zeros((counts.shape[0], counts.shape[1] + 1), dtype=np.int64)
+        np.cumsum(counts, axis=1, out=cumulative[:, 1:])
+
+        lo = np.minimum(lo - b_first, counts.shape[1])
+        hi = np.minimum(hi - b_first, counts.shape[1])
+        sums = cumulative[:, hi] - cumulative[:, lo]
+        n_frames = np.maximum((hi - lo) * width, 1)
+        return sums / n_frames
@@ -0,0 +1,55 @@
+import contextlib
+import os
+import time
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# advisory locks between processes sharing the markdata. the lock is taken on a
+# sidecar file because atomic replaces give the data file a new identity
+
+DEFAULT_TIMEOUT = 10.0
+POLL_INTERVAL = 0.05
+
+
+def lock_path_of(path):
+    return path + '.lock'
+
+
+def _try_lock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock(fd):
+    if os.name == 'nt':
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def locked(path, timeout=DEFAULT_TIMEOUT):
+    fd = os.open(lock_path_of(path), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _try_lock(fd)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError('markdata is locked by another process', path)
+                time.sleep(POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            _unlock(fd)
+    finally:
+        os.close(fd)
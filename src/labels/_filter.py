@@ -0,0 +1,79 @@
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from ._columns import LabelColumns
+
+
+class LabelFilter(NamedTuple):
+    label_names: Optional[frozenset[str]] = None  # None matches every label
+    tags_all: frozenset[str] = frozenset()  # frames must carry every one of these tags
+    tags_none: frozenset[str] = frozenset()  # frames must carry none of these tags
+    fi_start: Optional[int] = None
+    fi_stop: Optional[int] = None  # exclusive
+
+    @property
+    def is_empty(self):
+        return self == type(self)()
+
+    def __bits(self, columns: LabelColumns, tag_names) -> Optional[int]:
+        mask = 0
+        for tag_name in tag_names:
+            bit = columns.tag_bit(tag_name)
+            if bit is None:
+                return None
+            mask |= bit
+        return mask
+
+    def mask(self, columns: LabelColumns) -> np.ndarray:
+        n = len(columns)
+        mask = np.zeros(n, dtype=bool)
+
+        span = columns.span(
+            np.iinfo(columns.FI_DTYPE).min if self.fi_start is None else self.fi_start,
+            np.iinfo(columns.FI_DTYPE).max if self.fi_stop is None else self.fi_stop
+        )
+        mask[span] = True
+
+        if self.label_names is not None:
+            label_ids = [columns.label_id(name) for name in self.label_names]
+            label_ids = [label_id for label_id in label_ids if label_id is not None]
+            mask &= np.isin(columns.label_ids, label_ids)
+
+        tag_masks = columns.tag_masks
+        if self.tags_all:
+            bits = self.__bits(columns, self.tags_all)
+            if bits is None:  # a tag nobody has used cannot be carried
+                return np.zeros(n, dtype=bool)
+            bits = columns.TAG_MASK_DTYPE(bits)
+            mask &= (tag_masks & bits) == bits
+        if self.tags_none:
+            bits = 0
+            for tag_name in self.tags_none:
+                bits |= columns.tag_bit(tag_name) or 0
+            mask &= (tag_masks & columns.TAG_MASK_DTYPE(bits)) == 0
+
+        return mask
+
+    def select(self, columns: LabelColumns) -> np.ndarray:
+        if self.is_empty:
+            return columns.fi
+        return columns.fi[self.mask(columns)]
+
+    def matches(self, columns: LabelColumns, fi: int) -> bool:
+        pos = columns.find(fi)
+        if pos is None:
+            return False
+        if self.fi_start is not None and fi < self.fi_start:
+            return False
+        if self.fi_stop is not None and fi >= self.fi_stop:
+            return False
+        if self.label_names is not None \
+                and columns.label_name(int(columns.label_ids[pos])) not in self.label_names:
+            return False
+        tags = set(columns.tags_of_mask(columns.tag_masks[pos]))
+        if not self.tags_all <= tags:
+            return False
+        if self.tags_none & tags:
+            return False
+        return True
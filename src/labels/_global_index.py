@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from label_template import LabelDataFormatError
+from res import resolve, Domain
+from . import batch
+from ._columns import LabelColumns, NO_LABEL
+
+INDEX_VERSION = 1
+
+# files handed to a worker at once
+CHUNK_SIZE = 8
+
+
+class _Entry(NamedTuple):
+    size: int
+    mtime_ns: int
+    author: Optional[str]
+    columns: LabelColumns
+
+
+class IndexedFrame(NamedTuple):
+    video_name: str
+    fi: int
+    label: Optional[str]
+    tags: tuple[str, ...]
+
+
+def default_index_path(markdata_dir=None):
+    if markdata_dir is None:
+        return resolve(Domain.APPINFO, 'label-index.npz', make_dirs='parent')
+    digest = hashlib.sha1(os.path.abspath(markdata_dir).encode('utf-8')).hexdigest()[:12]
+    return resolve(Domain.APPINFO, f'label-index-{digest}.npz', make_dirs='parent')
+
+
+def _index_file(json_path) -> tuple[str, Optional[_Entry]]:
+    # runs in worker processes; the signature is taken first so that a file written
+    # while it is read is indexed again by the next refresh
+    try:
+        st = os.stat(json_path)
+        json_root = batch.load_json_root(json_path)
+        columns = LabelColumns()
+        columns.load_frames(json_root['frames'])
+    except (OSError, ValueError, KeyError, TypeError, LabelDataFormatError):
+        return json_path, None
+    author = (json_root['meta'].get('author') or {}).get('hash-digest')
+    return json_path, _Entry(st.st_size, st.st_mtime_ns, author, columns)
+
+
+class GlobalLabelIndex:
+    # labels of every markdata file, refreshed by file size and mtime and kept
+    # in appinfo so that queries do not open the files
+
+    def __init__(self, markdata_dir=None, index_path=None):
+        self.__markdata_dir = markdata_dir
+        self.__index_path = index_path or default_index_path(markdata_dir)
+        self.__entries: dict[str, _Entry] = {}
+        self.__unreadable: list[str] = []
+
+    # persistence
+
+    def load(self) -> bool:
+        if not os.path.exists(self.__index_path):
+            return False
+        try:
+            with np.load(self.__index_path, allow_pickle=False) as npz:
+                if int(npz['version']) != INDEX_VERSION:
+                    return False
+                videos = json.loads(str(npz['videos']))
+                offsets = npz['offsets']
+                fi, label_ids, tag_masks = npz['fi'], npz['label_ids'], npz['tag_masks']
+                entries = {}
+                for i, video in enumerate(videos):
+                    s = slice(int(offsets[i]), int(offsets[i + 1]))
+                    entries[video['name']] = _Entry(
+                        size=video['size'],
+                        mtime_ns=video['mtime_ns'],
+                        author=video['author'],
+                        columns=LabelColumns.from_arrays(
+                            label_names=video['label_names'],
+                            tag_names=video['tag_names'],
+                            fi=fi[s],
+                            label_ids=label_ids[s],
+                            tag_masks=tag_masks[s]
+                        )
+                    )
+        except (OSError, ValueError, KeyError, LabelDataFormatError) as e:
+            print('label index discarded', self.__index_path, repr(e))
+            return False
+        self.__entries = entries
+        return True
+
+    def save(self):
+        entries = self.__entries
+        names = sorted(entries)
+        columns = [entries[name].columns for name in names]
+        videos = [
+            dict(
+                name=name,
+                size=entries[name].size,
+                mtime_ns=entries[name].mtime_ns,
+                author=entries[name].author,
+                label_names=list(entries[name].columns.label_names),
+                tag_names=list(entries[name].columns.tag_names)
+            )
+            for name in names
+        ]
+
+        def concatenate(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtype)
+
+        tmp_path = self.__index_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                version=INDEX_VERSION,
+                videos=json.dumps(videos, ensure_ascii=False),
+                offsets=np.cumsum([0] + [len(c) for c in columns], dtype=np.int64),
+                fi=concatenate([c.fi for c in columns], LabelColumns.FI_DTYPE),
+                label_ids=concatenate([c.label_ids for c in columns], LabelColumns.LABEL_DTYPE),
+                tag_masks=concatenate([c.tag_masks for c in columns], LabelColumns.TAG_MASK_DTYPE)
+            )
+        os.replace(tmp_path, self.__index_path)
+
+    def refresh(self, jobs: int = 1) -> dict:
+        # reads only the files that were added or changed since the last refresh
+        json_paths = batch.list_json_files(self.__markdata_dir)
+        entries, pending = {}, []
+        for json_path in json_paths:
+            name = batch.video_name_of(json_path)
+            entry = self.__entries.get(name)
+            try:
+                st = os.stat(json_path)
+            except OSError:
+                continue
+            if entry is not None and (entry.size, entry.mtime_ns) == (st.st_size, st.st_mtime_ns):
+                entries[name] = entry
+            else:
+                pending.append(json_path)
+
+        if jobs <= 1 or len(pending) <= 1:
+            results = [_index_file(json_path) for json_path in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                results = list(pool.map(_index_file, pending, chunksize=CHUNK_SIZE))
+
+        unreadable = []
+        n_added = n_updated = 0
+        for json_path, entry in results:
+            name = batch.video_name_of(json_path)
+            if entry is None:
+                unreadable.append(json_path)
+                continue
+            if name in self.__entries:
+                n_updated += 1
+            else:
+                n_added += 1
+            entries[name] = entry
+
+        n_removed = len(self.__entries.keys() - entries.keys())
+        # queries running meanwhile keep the entries they started with
+        self.__entries = entries
+        self.__unreadable = unreadable
+        if n_added or n_updated or n_removed or not os.path.exists(self.__index_path):
+            self.save()
+
+        return dict(
+            n_videos=len(entries),
+            added=n_added,
+            updated=n_updated,
+            removed=n_removed,
+            unchanged=len(entries) - n_added - n_updated,
+            unreadable=unreadable
+        )
+
+    # queries
+
+    @property
+    def unreadable(self) -> list[str]:
+        return list(self.__unreadable)
+
+    def video_names(self) -> list[str]:
+        return sorted(self.__entries)
+
+    def columns(self, video_name) -> Optional[LabelColumns]:
+        entry = self.__entries.get(video_name)
+        return None if entry is None else entry.columns
+
+    def author(self, video_name) -> Optional[str]:
+        entry = self.__entries.get(video_name)
+        return None if entry is None else entry.author
+
+    def label_counts(self, video_name=None) -> dict[str, int]:
+        entries = self.__entries
+        names = sorted(entries) if video_name is None else [video_name]
+        total: dict[str, int] = {}
+        for name in names:
+            if name not in entries:
+                continue
+            for label, count in entries[name].columns.label_counts().items():
+                total[label] = total.get(label, 0) + count
+        return dict(sorted(total.items(), key=lambda item: -item[1]))
+
+    def coverage(self) -> dict[str, dict]:
+        result = {}
+        for name, entry in sorted(self.__entries.items()):
+            c = entry.columns
+            fi = c.fi[c.label_ids != NO_LABEL]
+            gaps = np.diff(fi) - 1
+            result[name] = dict(
+                n_frames=len(fi),
+                fi_min=int(fi[0]) if len(fi) else None,
+                fi_max=int(fi[-1]) if len(fi) else None,
+                largest_gap=int(gaps.max()) if len(gaps) else 0,
+                labels=c.label_counts()
+            )
+        return result
+
+    def gaps(self, min_length: int, video_name=None) -> list[tuple[str, int, int]]:
+        # unlabeled stretches [start, stop) of at least `min_length` frames between two
+        # labeled frames; the markdata does not know the length of the video, so the
+        # stretches before the first and after the last labeled frame are not reported
+        entries = self.__entries
+        names = sorted(entries) if video_name is None else [video_name]
+        result = []
+        for name in names:
+            if name not in entries:
+                continue
+            c = entries[name].columns
+            fi = c.fi[c.label_ids != NO_LABEL]
+            lengths = np.diff(fi) - 1
+            for i in np.flatnonzero(lengths >= min_length):
+                result.append((name, int(fi[i]) + 1, int(fi[i + 1])))
+        return result
+
+    def query(
+            self,
+            label: str = None,
+            tag: str = None,
+            video_name: str = None,
+            fi_start: int = None,
+            fi_stop: int = None
+    ) -> list[IndexedFrame]:
+        entries = self.__entries
+        names = sorted(entries) if video_name is None else [video_name]
+        result = []
+        for name in names:
+            if name not in entries:
+                continue
+            c = entries[name].columns
+            s = c.span(
+                np.iinfo(c.FI_DTYPE).min if fi_start is None else fi_start,
+                np.iinfo(c.FI_DTYPE).max if fi_stop is None else fi_stop
+            )
+            mask = np.ones(s.stop - s.start, dtype=bool)
+            if label is not None:
+                label_id = c.label_id(label)
+                if label_id is None:
+                    continue
+                mask &= c.label_ids[s] == label_id
+            if tag is not None:
+                bit = c.tag_bit(tag)
+                if bit is None:
+                    continue
+                mask &= (c.tag_masks[s] & np.uint64(bit)) != 0
+            for pos in np.flatnonzero(mask) + s.start:
+                result.append(IndexedFrame(
+                    video_name=name,
+                    fi=int(c.fi[pos]),
+                    label=c.label_name(int(c.label_ids[pos])),
+                    tags=c.tags_at(pos)
+                ))
+        return result
@@ -1,4 +1,6 @@
+import codecs
 import copy
+import json
 import os.path
 from typing import Callable, Union, Any
 
@@ -7,6 +9,23 @@ import machine
 DEFAULT_RAISE_ERROR = object()
 
 
+def machine_author() -> dict:
+    return {
+        'system': machine.system,
+        'node': machine.node,
+        'hash-digest': machine.platform_hash_digest
+    }
+
+
+def author_of_digest(hash_digest) -> dict:
+    # an author known only by the hash in an export name, or not at all
+    return {
+        'system': None,
+        'node': None,
+        'hash-digest': hash_digest
+    }
+
+
 class JsonPlaceholder:
     def __init__(self, param_name, *, default: Union[Callable, Any]):
         self.__param_name = param_name
@@ -35,11 +54,7 @@ JSON_STRUCTURE = {
         'frames': JsonPlaceholder('frames', default=lambda: {}),
         'meta': {
             'json-version': 2,
-            'author': {
-                'system': machine.system,
-                'node': machine.node,
-                'hash-digest': machine.platform_hash_digest
-            },
+            'author': JsonPlaceholder('author', default=machine_author),
             'video-name': JsonPlaceholder('video_name', default=DEFAULT_RAISE_ERROR),
             'converted': JsonPlaceholder('converted', default=False)
         }
@@ -69,7 +84,19 @@ def create_default(version, params):
     return json_root
 
 
-def _upgrade_1_to_2(src_json_path, src_json_root):
+def dumps(json_root) -> str:
+    return json.dumps(json_root, indent=2, sort_keys=True, ensure_ascii=False)
+
+
+def dump(json_path, json_root):
+    # readers never see a partly written file
+    tmp_path = json_path + '.tmp'
+    with codecs.open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(dumps(json_root))
+    os.replace(tmp_path, json_path)
+
+
+def _upgrade_1_to_2(src_json_path, src_json_root, author=None):
     # join markers and tags
     markers, tags = src_json_root['markers'], src_json_root['tags']
     frames = {
@@ -92,6 +119,9 @@ def _upgrade_1_to_2(src_json_path, src_json_root):
         video_name=video_name,
         converted=True
     )
+    # version 1 does not record the author; the converting machine is assumed
+    if author is not None:
+        params.update(author=author)
     dst_json_root = create_default(2, params=params)
 
     return dst_json_root
@@ -108,7 +138,9 @@ def latest_json_version():
     return max(JSON_STRUCTURE.keys())
 
 
-def convert(json_path, json_root, version_from=None, version_to=None):
+def convert(json_path, json_root, version_from=None, version_to=None, author: dict = None):
+    # `author` stands in for what older versions did not record; files of other
+    # annotators must not be converted as the work of this machine
     if version_from is None:
         version_from = inspect_version(json_root)
     if version_to is None:
@@ -123,13 +155,14 @@ def convert(json_path, json_root, version_from=None, version_to=None):
         upgrade_handler_name = f'_upgrade_{version_from}_to_{version_from + 1}'
         upgrade_handler = globals()[upgrade_handler_name]
         assert callable(upgrade_handler), upgrade_handler
-        upgraded_json_root = upgrade_handler(json_path, json_root)
+        upgraded_json_root = upgrade_handler(json_path, json_root, author=author)
 
         # retry converting
         return convert(
             json_path=json_path,
             json_root=upgraded_json_root,
-            version_to=version_to
+            version_to=version_to,
+            author=author
         )
 
 # if __name__ == '__main__':
@@ -1,19 +1,24 @@
-import codecs
-import json
-import os.path
-from typing import Optional, Union
+import contextlib
+import threading
+from typing import Optional, Union, Literal, Iterable, Iterator, Callable
 
 import numpy as np
-from PyQt5.QtCore import QMutex
 
+from common import MARKDATA_BACKEND
+from label_template import LabelTemplate
 from res import resolve, Domain
-from . import _backup as backup
 from . import _json_compat as compat
+from ._changes import LabelChange
+from ._columns import LabelColumns
+from ._rwlock import ReadWriteLock
+from ._sqlite_store import shared_database
+from ._storage import JsonFileStorage, SqliteStorage
 
 
 # When upgrade version, make sure you ...
 #  - edit LabelDataJson.VERSION = <new-version>
 #  - re-implement the default-producer LabelDataJson.__default_json()
+#  - make sure LabelColumns.load_frames()/to_frames() still match the `frames` structure
 #  - add the new entry to JSON_STRUCTURE in label_data_json_compat.py
 #  - add function `_upgrade_<previous-version>_to_<new-version>` in label_data_json_compat.py
 class LabelDataJson:
@@ -28,13 +33,39 @@ class LabelDataJson:
             )
         )
 
-    def __init__(self, video_name):
+    def __init__(
+            self,
+            video_name,
+            template: LabelTemplate = None,
+            backend: Literal['json', 'sqlite'] = None
+    ):
         self.__video_name = video_name
+        self.__template = template
+
+        backend = backend or MARKDATA_BACKEND
+        if backend == 'json':
+            self.__storage = JsonFileStorage(self.json_path)
+        elif backend == 'sqlite':
+            self.__storage = SqliteStorage(shared_database(), video_name, self.json_path)
+        else:
+            assert False, backend
 
         self.__json_root = None
-        self.__current_accessor = None
+        self.__columns: Optional[LabelColumns] = None
+
+        self.__load_lock = threading.Lock()
+        self.__lock = ReadWriteLock()
 
-        self.__lock = QMutex()
+        # edits not saved yet and the state they were made on, last in sync with the storage
+        self.__pending_fis: set[int] = set()
+        self.__pending_base = None
+        self.__save_error: Optional[OSError] = None
+
+        self.__subscribers: list[Callable[[list[LabelChange]], None]] = []
+
+    @property
+    def video_name(self):
+        return self.__video_name
 
     @property
     def json_path(self):
@@ -44,128 +75,149 @@ class LabelDataJson:
             make_dirs='parent'
         )
 
+    @property
+    def save_error(self) -> Optional[OSError]:
+        # why the latest edits are not saved; they are retried with the next write
+        return self.__save_error
+
+    @property
+    def nbytes(self) -> int:
+        # nothing is held before the first read
+        columns = self.__columns
+        return 0 if columns is None else columns.nbytes
+
+    def __new_columns(self):
+        columns = LabelColumns()
+        if self.__template is not None:
+            columns.intern_template(self.__template)
+        return columns
+
     def __load_json(self):
-        if os.path.exists(self.json_path):
-            with codecs.open(self.json_path, 'r', encoding='utf-8') as f:
-                json_root = json.load(f)
-            backup.take(self.json_path, json_root)
-            json_root = compat.convert(
-                json_path=self.json_path,
-                json_root=json_root
-            )
-            self.__json_root = json_root
+        loaded = self.__storage.load(self.__new_columns)
+        if loaded is None:
+            json_root = self.__default_json(self.__video_name)
+            columns = self.__new_columns()
+            columns.load_frames(json_root.pop('frames'))
         else:
-            self.__json_root = self.__default_json(self.__video_name)
+            json_root, columns = loaded
+
+        self.__json_root = json_root
+        self.__columns = columns
 
     @property
-    def __jr(self):
-        if self.__json_root is None:
-            self.__load_json()
+    def __cols(self) -> LabelColumns:
+        if self.__columns is None:
+            with self.__load_lock:
+                if self.__columns is None:
+                    self.__load_json()
 
-        return self.__json_root
+        return self.__columns
 
-    def dump(self):
+    def dump(self, changed_fis: Iterable[int] = None):
         if self.__json_root is None:
             return
 
-        with codecs.open(self.json_path, 'w', encoding='utf-8') as f:
-            json.dump(self.__json_root, f, indent=2, sort_keys=True, ensure_ascii=False)
-
-    class Accessor:
-        def __init__(self, jr):
-            self.__jr = jr
-            self.__modified = False
+        with self.__storage.locked():
+            self.__storage.save(self.__json_root, self.__columns, changed_fis)
+
+    @staticmethod
+    def __frame_values(frames: dict[str, dict]) -> dict[int, tuple[Optional[str], tuple[str, ...]]]:
+        return {
+            frame['fi']: (frame['label'], tuple(sorted(frame['tags'])))
+            for frame in frames.values()
+        }
+
+    def __merge_external(self, base_state, own_fis: Iterable[int]) -> set[int]:
+        # takes over what other processes wrote since `base_state` was last in sync with
+        # the disk; frames changed here in the meantime keep their value. call it with
+        # the storage locked. returns the frame indexes taken over
+        if not self.__storage.changed_externally():
+            return set()
+        try:
+            frames = self.__storage.read_frames()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print('external changes not merged', self.json_path, repr(e))
+            return set()
+        if frames is None:
+            return set()
+
+        columns = self.__columns
+        base = LabelColumns.from_arrays(columns.label_names, columns.tag_names, *base_state)
+        before, after = self.__frame_values(base.to_frames()), self.__frame_values(frames)
+        external = {fi for fi in before.keys() | after.keys() if before.get(fi) != after.get(fi)}
+        external.difference_update(own_fis)
+        for fi in external:
+            columns.assign(fi, after.get(fi))
+        return external
+
+    def __sync(self, base_state, changed_fis: set[int]) -> set[int]:
+        # merges what other processes wrote since `base_state` and saves the frames
+        # changed here. if the storage cannot be locked or written, the edits stay in
+        # memory and pending. returns the frame indexes taken over
+        if self.__pending_fis:
+            base_state = self.__pending_base
+            changed_fis = changed_fis | self.__pending_fis
+        external = set()
+        try:
+            with self.__storage.locked():
+                # another process may have written since; its frames are kept
+                external = self.__merge_external(base_state, changed_fis)
+                if changed_fis:
+                    self.__storage.save(self.__json_root, self.__columns, None if external else changed_fis)
+        except OSError as e:  # TimeoutError if another process holds the lock
+            print('markdata not saved', self.json_path, repr(e))
+            self.__pending_base = base_state
+            self.__pending_fis = changed_fis
+            self.__save_error = e
+        else:
+            self.__pending_base = None
+            self.__pending_fis = set()
+            self.__save_error = None
+        return external
+
+    def reload(self) -> list[LabelChange]:
+        # merges what other processes wrote to the storage and publishes it; pending
+        # edits are saved along
+        if self.__columns is None:
+            return []
+        if not self.__pending_fis and not self.__storage.changed_externally():
+            return []
+        columns = self.__columns
+        with self.__lock.writing():
+            state = columns.copy_state()
+            external = self.__sync(state, set())
+            changes = columns.diff(state, external)
+        self.__publish(changes)
+        return changes
+
+    def __publish(self, changes: list[LabelChange]):
+        # subscribers are called outside the lock so that they can read the data back
+        if changes:
+            for callback in list(self.__subscribers):
+                callback(changes)
+
+    class Reader:
+        def __init__(self, columns: LabelColumns):
+            self.__columns = columns
 
         @property
-        def modified(self):
-            return self.__modified
-
-        def __set_modified(self):
-            self.__modified = True
-
-        def __frames(self) -> dict[str, dict]:
-            return self.__jr['frames']
+        def columns(self) -> LabelColumns:
+            return self.__columns
 
         def list_labeled_frame_indexes(self) -> list[int]:
-            return sorted(
-                frame['fi']
-                for frame in self.__frames().values()
-            )
-
-        def __frame(self, fi: int, create_if_absent=False) -> dict:
-            frames = self.__frames()
-            key = str(fi)
-            if key not in frames:
-                if not create_if_absent:
-                    raise KeyError('key has not been created yet', key)
-                else:
-                    frames[key] = dict(
-                        fi=fi,
-                        label=None,
-                        tags=[]
-                    )
-            return frames[key]
-
-        def __remove_frame(self, fi: int):
-            frames = self.__jr['frames']
-            key = str(fi)
-            if key in frames:
-                del frames[key]
-            self.__set_modified()
+            return self.__columns.fi.tolist()
 
         def get_label(self, fi: int) -> Optional[str]:
-            try:
-                return self.__frame(fi)['label']
-            except KeyError:
-                return None
-
-        def set_label(self, fi: int, label_name: str):
-            self.remove_label(fi)
-            self.__frame(fi, create_if_absent=True)['label'] = label_name
-            self.__set_modified()
-
-        def remove_label(self, fi: int):
-            self.__remove_frame(fi)
-            self.__set_modified()
+            return self.__columns.get_label(fi)
 
         def get_tags(self, fi: int) -> tuple[str, ...]:
-            try:
-                return tuple(self.__frame(fi)['tags'])
-            except KeyError:
-                return tuple()
-
-        def add_tag(self, fi: int, tag_name: str):
-            if self.get_label(fi) is None:
-                return
-            tags = self.__frame(fi, create_if_absent=True)['tags']
-            if tag_name in tags:
-                return
-            tags.append(tag_name)
-            self.__set_modified()
-
-        def remove_tag(self, fi: int, tag_name: str):
-            try:
-                self.__frame(fi)['tags'].remove(tag_name)
-            except (KeyError, ValueError):
-                pass
-            finally:
-                self.__set_modified()
+            return self.__columns.get_tags(fi)
 
         def get_label_count(self, fi: int) -> Optional[int]:
-            target_label = self.get_label(fi)
-            if target_label is None:
-                return None
+            return self.__columns.get_label_count(fi)
 
-            # TODO: efficient algorithm
-            count = 0
-            for frame in self.__frames().values():
-                label, i = frame['label'], frame['fi']
-                if i > fi:
-                    continue
-                if label == target_label:
-                    count += 1
-
-            return count
+        def count_labels(self) -> dict[str, int]:
+            return self.__columns.label_counts()
 
         def find_nearest_labeled_index(
                 self,
@@ -175,28 +227,101 @@ class LabelDataJson:
         ) -> Union[list[int], Optional[int]]:
             assert direction in [+1, -1], direction
 
-            fi_array = np.array(self.list_labeled_frame_indexes())
-
-            if direction > 0:
-                fi_array = np.sort(fi_array[fi_array > fi_start])
-            else:
-                fi_array = np.sort(fi_array[fi_array < fi_start])[::-1]
+            fi_array = self.__columns.nearest(fi_start, direction, 1 if n is None else n)
 
             if n is None:
                 if len(fi_array) == 0:
                     return None
-                return fi_array[0]
+                return int(fi_array[0])
             else:
-                return list(fi_array[:n])
-
-    def __enter__(self):
-        self.__lock.lock()
-        self.__current_accessor = self.Accessor(self.__jr)
-        return self.__current_accessor
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is None:
-            if self.__current_accessor.modified:
-                self.dump()
-        self.__lock.unlock()
-        return False
+                return fi_array.tolist()
+
+    class Accessor(Reader):
+        def __init__(self, columns: LabelColumns):
+            super().__init__(columns)
+            self.__changed_fis: set[int] = set()
+
+        @property
+        def modified(self):
+            return bool(self.__changed_fis)
+
+        @property
+        def changed_frame_indexes(self) -> set[int]:
+            return self.__changed_fis
+
+        def __set_modified(self, fi: int):
+            self.__changed_fis.add(fi)
+
+        def set_label(self, fi: int, label_name: str):
+            self.columns.set_label(fi, label_name)
+            self.__set_modified(fi)
+
+        def remove_label(self, fi: int):
+            if self.columns.remove(fi):
+                self.__set_modified(fi)
+
+        def add_tag(self, fi: int, tag_name: str):
+            if self.get_label(fi) is None:
+                return
+            if self.columns.add_tag(fi, tag_name):
+                self.__set_modified(fi)
+
+        def remove_tag(self, fi: int, tag_name: str):
+            if self.columns.remove_tag(fi, tag_name):
+                self.__set_modified(fi)
+
+        # bulk edits; the whole with-block is still saved once on exit
+
+        def __set_modified_many(self, fis: np.ndarray):
+            self.__changed_fis.update(fis.tolist())
+
+        def set_labels(self, fis: Iterable[int], label_name: str):
+            self.__set_modified_many(self.columns.set_labels(list(fis), label_name))
+
+        def set_label_range(self, fi_start: int, fi_stop: int, label_name: str):
+            self.set_labels(range(fi_start, fi_stop), label_name)
+
+        def remove_labels(self, fis: Iterable[int]):
+            self.__set_modified_many(self.columns.remove_many(list(fis)))
+
+        def remove_label_range(self, fi_start: int, fi_stop: int):
+            self.__set_modified_many(self.columns.remove_range(fi_start, fi_stop))
+
+        def add_tags(self, fis: Iterable[int], tag_name: str):
+            self.__set_modified_many(self.columns.add_tag_many(list(fis), tag_name))
+
+        def remove_tags(self, fis: Iterable[int], tag_name: str):
+            self.__set_modified_many(self.columns.remove_tag_many(list(fis), tag_name))
+
+        def relabel(self, src_label_name: str, dst_label_name: str):
+            self.__set_modified_many(self.columns.relabel(src_label_name, dst_label_name))
+
+    @contextlib.contextmanager
+    def read(self) -> Iterator[Reader]:
+        columns = self.__cols
+        with self.__lock.reading():
+            yield self.Reader(columns)
+
+    @contextlib.contextmanager
+    def write(self) -> Iterator[Accessor]:
+        columns = self.__cols
+        with self.__lock.writing():
+            state = columns.copy_state()
+            accessor = self.Accessor(columns)
+            yield accessor
+            if not accessor.modified:
+                return
+            changed_fis = accessor.changed_frame_indexes
+            external = self.__sync(state, changed_fis)
+            changes = columns.diff(state, changed_fis | external)
+
+        self.__publish(changes)
+
+    def subscribe(self, callback: Callable[[list[LabelChange]], None]):
+        self.__subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[list[LabelChange]], None]):
+        try:
+            self.__subscribers.remove(callback)
+        except ValueError:
+            pass
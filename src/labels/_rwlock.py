@@ -0,0 +1,55 @@
+import contextlib
+import threading
+
+
+class ReadWriteLock:
+    # many readers or one writer; waiting writers block new readers so that
+    # edits from the GUI thread are not starved by background readers
+    def __init__(self):
+        self.__cond = threading.Condition(threading.Lock())
+        self.__n_readers = 0
+        self.__n_writers_waiting = 0
+        self.__writing = False
+
+    def acquire_read(self):
+        with self.__cond:
+            while self.__writing or self.__n_writers_waiting:
+                self.__cond.wait()
+            self.__n_readers += 1
+
+    def release_read(self):
+        with self.__cond:
+            self.__n_readers -= 1
+            if self.__n_readers == 0:
+                self.__cond.notify_all()
+
+    def acquire_write(self):
+        with self.__cond:
+            self.__n_writers_waiting += 1
+            try:
+                while self.__writing or self.__n_readers:
+                    self.__cond.wait()
+            finally:
+                self.__n_writers_waiting -= 1
+            self.__writing = True
+
+    def release_write(self):
+        with self.__cond:
+            self.__writing = False
+            self.__cond.notify_all()
+
+    @contextlib.contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
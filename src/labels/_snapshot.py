@@ -0,0 +1,75 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+from label_template import LabelDataFormatError
+from res import resolve, Domain
+from ._columns import LabelColumns
+
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_path(json_path):
+    _, json_name = os.path.split(json_path)
+    return resolve(
+        Domain.MARKDATA_SNAPSHOT,
+        os.path.splitext(json_name)[0] + '.npz',
+        make_dirs='parent'
+    )
+
+
+def _json_signature(json_path):
+    st = os.stat(json_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def load(json_path) -> Optional[tuple[dict, LabelColumns]]:
+    path = snapshot_path(json_path)
+    if not os.path.exists(path) or not os.path.exists(json_path):
+        return None
+
+    mtime_ns, size = _json_signature(json_path)
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz['version']) != SNAPSHOT_VERSION:
+                return None
+            if int(npz['json_mtime_ns']) != mtime_ns or int(npz['json_size']) != size:
+                return None
+            json_root = json.loads(str(npz['meta']))
+            columns = LabelColumns.from_arrays(
+                label_names=npz['label_names'].tolist(),
+                tag_names=npz['tag_names'].tolist(),
+                fi=npz['fi'],
+                label_ids=npz['label_ids'],
+                tag_masks=npz['tag_masks'],
+                tag_order={int(fi): tags for fi, tags in json.loads(str(npz['tag_order'])).items()}
+            )
+    except (OSError, ValueError, KeyError, LabelDataFormatError) as e:
+        print('snapshot discarded', path, repr(e))
+        return None
+
+    return json_root, columns
+
+
+def save(json_path, json_root: dict, columns: LabelColumns):
+    path = snapshot_path(json_path)
+    mtime_ns, size = _json_signature(json_path)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(
+            f,
+            version=SNAPSHOT_VERSION,
+            json_mtime_ns=mtime_ns,
+            json_size=size,
+            meta=json.dumps(json_root, ensure_ascii=False),
+            label_names=np.array(columns.label_names, dtype=str),
+            tag_names=np.array(columns.tag_names, dtype=str),
+            fi=columns.fi,
+            label_ids=columns.label_ids,
+            tag_masks=columns.tag_masks,
+            tag_order=json.dumps(columns.tag_order, ensure_ascii=False)
+        )
+    os.replace(tmp_path, path)
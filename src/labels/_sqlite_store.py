@@ -0,0 +1,177 @@
+import contextlib
+import json
+import sqlite3
+import threading
+from typing import Optional, Iterable
+
+from res import resolve, Domain
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    video TEXT PRIMARY KEY,
+    meta TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frames (
+    video TEXT NOT NULL REFERENCES videos(video) ON DELETE CASCADE,
+    fi INTEGER NOT NULL,
+    label TEXT,
+    tags TEXT NOT NULL,
+    PRIMARY KEY (video, fi)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS frames_video_label_fi ON frames(video, label, fi);
+'''
+
+
+class MarkdataDatabase:
+    FILE_NAME = 'markdata.sqlite3'
+
+    def __init__(self, path=None):
+        if path is None:
+            path = resolve(Domain.MARKDATA_DB, self.FILE_NAME, make_dirs='parent')
+        self.__path = path
+
+        self.__lock = threading.RLock()
+        self.__con = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.__con.execute('PRAGMA journal_mode=WAL')
+        self.__con.execute('PRAGMA synchronous=NORMAL')
+        self.__con.execute('PRAGMA foreign_keys=ON')
+        self.__con.executescript(_SCHEMA)
+
+    @property
+    def path(self):
+        return self.__path
+
+    def close(self):
+        with self.__lock:
+            self.__con.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.__lock:
+            self.__con.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.__con
+            except BaseException:
+                self.__con.execute('ROLLBACK')
+                raise
+            else:
+                self.__con.execute('COMMIT')
+
+    def list_videos(self) -> list[str]:
+        with self.__lock:
+            rows = self.__con.execute('SELECT video FROM videos ORDER BY video').fetchall()
+        return [video for video, in rows]
+
+    def has_video(self, video_name) -> bool:
+        with self.__lock:
+            row = self.__con.execute(
+                'SELECT 1 FROM videos WHERE video = ?', (video_name,)
+            ).fetchone()
+        return row is not None
+
+    # lossless conversion from/to json-version 2 roots
+
+    def export_json_root(self, video_name) -> Optional[dict]:
+        with self.__lock:
+            row = self.__con.execute(
+                'SELECT meta FROM videos WHERE video = ?', (video_name,)
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self.__con.execute(
+                'SELECT fi, label, tags FROM frames WHERE video = ? ORDER BY fi',
+                (video_name,)
+            ).fetchall()
+
+        json_root = json.loads(row[0])
+        json_root['frames'] = {
+            str(fi): dict(
+                fi=fi,
+                label=label,
+                tags=json.loads(tags)
+            )
+            for fi, label, tags in rows
+        }
+        return json_root
+
+    def import_json_root(self, video_name, json_root: dict):
+        meta = {k: v for k, v in json_root.items() if k != 'frames'}
+        with self.transaction() as con:
+            con.execute('DELETE FROM videos WHERE video = ?', (video_name,))
+            con.execute(
+                'INSERT INTO videos (video, meta) VALUES (?, ?)',
+                (video_name, json.dumps(meta, ensure_ascii=False))
+            )
+            con.executemany(
+                'INSERT INTO frames (video, fi, label, tags) VALUES (?, ?, ?, ?)',
+                (
+                    (video_name, frame['fi'], frame['label'], json.dumps(frame['tags'], ensure_ascii=False))
+                    for frame in json_root['frames'].values()
+                )
+            )
+
+    # incremental writes
+
+    def write_frames(
+            self,
+            video_name,
+            meta: dict,
+            upserts: Iterable[tuple[int, Optional[str], list[str]]],
+            deletes: Iterable[int]
+    ):
+        with self.transaction() as con:
+            con.execute(
+                'INSERT INTO videos (video, meta) VALUES (?, ?) '
+                'ON CONFLICT(video) DO UPDATE SET meta = excluded.meta',
+                (video_name, json.dumps(meta, ensure_ascii=False))
+            )
+            con.executemany(
+                'DELETE FROM frames WHERE video = ? AND fi = ?',
+                ((video_name, fi) for fi in deletes)
+            )
+            con.executemany(
+                'INSERT INTO frames (video, fi, label, tags) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(video, fi) DO UPDATE SET label = excluded.label, tags = excluded.tags',
+                (
+                    (video_name, fi, label, json.dumps(tags, ensure_ascii=False))
+                    for fi, label, tags in upserts
+                )
+            )
+
+    # cross-video queries
+
+    def label_counts(self, video_name=None) -> dict[str, int]:
+        with self.__lock:
+            if video_name is None:
+                rows = self.__con.execute(
+                    'SELECT label, COUNT(*) FROM frames GROUP BY label'
+                ).fetchall()
+            else:
+                rows = self.__con.execute(
+                    'SELECT label, COUNT(*) FROM frames WHERE video = ? GROUP BY label',
+                    (video_name,)
+                ).fetchall()
+        return {label: count for label, count in rows}
+
+    def find_frames(self, label_name, fi_start=None, fi_stop=None) -> list[tuple[str, int]]:
+        fi_start = -1 if fi_start is None else fi_start
+        fi_stop = 2 ** 62 if fi_stop is None else fi_stop
+        with self.__lock:
+            rows = self.__con.execute(
+                'SELECT video, fi FROM frames '
+                'WHERE label = ? AND fi >= ? AND fi < ? ORDER BY video, fi',
+                (label_name, fi_start, fi_stop)
+            ).fetchall()
+        return rows
+
+
+_shared_database: Optional[MarkdataDatabase] = None
+_shared_database_lock = threading.Lock()
+
+
+def shared_database() -> MarkdataDatabase:
+    global _shared_database
+    with _shared_database_lock:
+        if _shared_database is None:
+            _shared_database = MarkdataDatabase()
+        return _shared_database
@@ -0,0 +1,130 @@
+import contextlib
+import json
+import os
+from typing import Optional, Callable, Iterable
+
+from . import _backup as backup
+from . import _file_lock as file_lock
+from . import _json_compat as compat
+from . import _snapshot as snapshot
+from ._columns import LabelColumns
+from ._sqlite_store import MarkdataDatabase
+
+ColumnsFactory = Callable[[], LabelColumns]
+
+
+def read_json(json_path) -> dict:
+    with open(json_path, 'rb') as f:
+        json_bytes = f.read()
+    backup.take(json_path, json_bytes)
+    json_root = json.loads(json_bytes.decode('utf-8'))
+    return compat.convert(
+        json_path=json_path,
+        json_root=json_root
+    )
+
+
+class JsonFileStorage:
+    def __init__(self, json_path):
+        self.__json_path = json_path
+        # size and mtime of the file as this process last read or wrote it
+        self.__signature: Optional[tuple[int, int]] = None
+
+    def __disk_signature(self) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(self.__json_path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def locked(self):
+        return file_lock.locked(self.__json_path)
+
+    def changed_externally(self) -> bool:
+        return self.__disk_signature() != self.__signature
+
+    def load(self, new_columns: ColumnsFactory) -> Optional[tuple[dict, LabelColumns]]:
+        # the signature is taken first; a write in between is seen as a change next time
+        self.__signature = self.__disk_signature()
+
+        loaded = snapshot.load(self.__json_path)
+        if loaded is not None:
+            # the json is not parsed, but still backed up
+            backup.take_file(self.__json_path)
+            return loaded
+
+        if not os.path.exists(self.__json_path):
+            return None
+
+        json_root = read_json(self.__json_path)
+        columns = new_columns()
+        columns.load_frames(json_root.pop('frames'))
+        snapshot.save(self.__json_path, json_root, columns)
+        return json_root, columns
+
+    def read_frames(self) -> Optional[dict[str, dict]]:
+        # the frames currently on disk; None if the file is gone
+        signature = self.__disk_signature()
+        if signature is None:
+            return None
+        frames = read_json(self.__json_path)['frames']
+        self.__signature = signature
+        return frames
+
+    # noinspection PyUnusedLocal
+    def save(self, json_root: dict, columns: LabelColumns, changed_fis: Optional[Iterable[int]]):
+        compat.dump(self.__json_path, dict(json_root, frames=columns.to_frames()))
+        self.__signature = self.__disk_signature()
+        snapshot.save(self.__json_path, json_root, columns)
+
+
+class SqliteStorage:
+    def __init__(self, database: MarkdataDatabase, video_name, json_path):
+        self.__database = database
+        self.__video_name = video_name
+        self.__json_path = json_path
+
+    # the database does its own locking between processes
+
+    def locked(self):
+        return contextlib.nullcontext()
+
+    def changed_externally(self) -> bool:
+        return False
+
+    def read_frames(self) -> Optional[dict[str, dict]]:
+        return None
+
+    def load(self, new_columns: ColumnsFactory) -> Optional[tuple[dict, LabelColumns]]:
+        json_root = self.__database.export_json_root(self.__video_name)
+        if json_root is None:
+            # first open with this backend: take over the json file if there is one
+            if not os.path.exists(self.__json_path):
+                return None
+            json_root = read_json(self.__json_path)
+            self.__database.import_json_root(self.__video_name, json_root)
+
+        columns = new_columns()
+        columns.load_frames(json_root.pop('frames'))
+        return json_root, columns
+
+    def save(self, json_root: dict, columns: LabelColumns, changed_fis: Optional[Iterable[int]]):
+        if changed_fis is None:
+            self.__database.import_json_root(
+                self.__video_name,
+                dict(json_root, frames=columns.to_frames())
+            )
+            return
+
+        upserts, deletes = [], []
+        for fi in changed_fis:
+            pos = columns.find(fi)
+            if pos is None:
+                deletes.append(fi)
+            else:
+                upserts.append((
+                    fi,
+                    columns.label_name(int(columns.label_ids[pos])),
+                    list(columns.tags_at(pos))
+                ))
+        self.__database.write_frames(self.__video_name, json_root, upserts, deletes)
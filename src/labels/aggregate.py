@@ -0,0 +1,189 @@
+import collections
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional, Iterable, Any
+
+from . import _json_compat as compat
+from . import batch, porting
+
+FrameValue = tuple[Optional[str], tuple[str, ...]]  # label, sorted tags
+
+
+class Submission(NamedTuple):
+    annotator: str
+    zip_path: str
+    video_name: str
+    frames: dict[int, FrameValue]
+
+
+def _annotator_of_source(source_path) -> str:
+    return porting.author_digest_of_zip(source_path) or os.path.abspath(source_path)
+
+
+def submission_of(json_root, source_path, video_name) -> Submission:
+    author = json_root['meta'].get('author') or {}
+    return Submission(
+        annotator=author.get('hash-digest') or _annotator_of_source(source_path),
+        zip_path=source_path,
+        video_name=video_name,
+        frames={
+            frame['fi']: (frame['label'], tuple(sorted(frame['tags'])))
+            for frame in json_root['frames'].values()
+        }
+    )
+
+
+def read_zip(zip_path) -> tuple[list[Submission], list[str]]:
+    # reads one member at a time; returns the submissions and problems
+    submissions, problems = [], []
+    try:
+        zf = zipfile.ZipFile(zip_path, 'r')
+    except (OSError, zipfile.BadZipFile) as e:
+        return [], [f'{zip_path}: cannot open: {e!r}']
+    with zf:
+        for info in zf.infolist():
+            name = info.filename
+            if not name.endswith('.json') or '/' in name:
+                problems.append(f'{zip_path}: {name}: not a markdata member')
+                continue
+            try:
+                with zf.open(info, 'r') as f:
+                    json_root = json.load(io.TextIOWrapper(f, encoding='utf-8'))
+                # converted members are credited to the export, not to this machine
+                json_root = compat.convert(
+                    json_path=name,
+                    json_root=json_root,
+                    author=compat.author_of_digest(porting.author_digest_of_zip(zip_path))
+                )
+                submissions.append(submission_of(json_root, zip_path, os.path.splitext(name)[0]))
+            except (ValueError, KeyError, TypeError, zipfile.BadZipFile) as e:
+                problems.append(f'{zip_path}: {name}: {e!r}')
+    return submissions, problems
+
+
+def read_source(path) -> tuple[list[Submission], list[str]]:
+    # an exported zip or a single json file
+    if zipfile.is_zipfile(path):
+        return read_zip(path)
+    try:
+        json_root = batch.load_json_root(path, author=compat.author_of_digest(None))
+        return [submission_of(json_root, path, batch.video_name_of(path))], []
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return [], [f'{path}: {e!r}']
+
+
+def _pool_map(fn, items, jobs):
+    if jobs <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(fn, items))
+
+
+def collect(paths: Iterable[str], jobs: int = 1, reader=read_source) -> tuple[dict[str, list], list[str]]:
+    # reads zips, json files and directories holding either; a later export of the same
+    # annotator replaces an earlier one. `reader` runs in the workers and returns objects
+    # with `annotator` and `video_name`, and problems. returns them by video and problems
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources.extend(batch.list_json_files(path))
+            sources.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith('.zip')
+            )
+        else:
+            sources.append(path)
+
+    latest: dict[tuple[str, str], tuple[float, Any]] = {}
+    problems = []
+    for path, (submissions, source_problems) in zip(sources, _pool_map(reader, sources, jobs)):
+        problems.extend(source_problems)
+        mtime = os.path.getmtime(path)
+        for s in submissions:
+            key = s.annotator, s.video_name
+            if key not in latest or latest[key][0] <= mtime:
+                latest[key] = mtime, s
+
+    by_video: dict[str, list] = collections.defaultdict(list)
+    for (_, video_name), (_, s) in sorted(latest.items()):
+        by_video[video_name].append(s)
+    return dict(by_video), problems
+
+
+def merge_video(video_name, submissions: list[Submission]) -> tuple[dict, list[dict]]:
+    # one submission per annotator; returns the merged json root and the conflicts
+    annotators = [s.annotator for s in submissions]
+    fis = sorted(set().union(*(s.frames.keys() for s in submissions)))
+
+    frames, conflicts = {}, []
+    for fi in fis:
+        values = {s.annotator: s.frames[fi] for s in submissions if fi in s.frames}
+        counts = collections.Counter(values.values())
+        ranked = counts.most_common()
+        if len(ranked) == 1:
+            value = ranked[0][0]
+        else:
+            top = ranked[0][1]
+            tied = {v for v, n in ranked if n == top}
+            # ties go to the first annotator, in the order of `annotators`
+            value = next(values[a] for a in annotators if a in values and values[a] in tied)
+            conflicts.append(dict(
+                video=video_name,
+                fi=fi,
+                values={a: dict(label=v[0], tags=list(v[1])) for a, v in values.items()},
+                chosen=dict(label=value[0], tags=list(value[1])),
+                resolution='majority' if len(tied) == 1 else 'tie'
+            ))
+        label, tags = value
+        frames[str(fi)] = dict(fi=fi, label=label, tags=list(tags))
+
+    json_root = compat.create_default(
+        compat.latest_json_version(),
+        params=dict(frames=frames, video_name=video_name)
+    )
+    json_root['meta']['aggregated-from'] = sorted(annotators)
+    return json_root, conflicts
+
+
+def _merge_and_write(task) -> tuple[str, int, list[dict]]:
+    video_name, submissions, out_dir = task
+    json_root, conflicts = merge_video(video_name, submissions)
+    compat.dump(os.path.join(out_dir, f'{video_name}.json'), json_root)
+    return video_name, len(json_root['frames']), conflicts
+
+
+def aggregate(zip_paths: Iterable[str], out_dir, jobs: int = 1, report_path=None) -> dict:
+    zip_paths = list(zip_paths)
+    os.makedirs(out_dir, exist_ok=True)
+
+    by_video, problems = collect(zip_paths, jobs)
+    tasks = [(video_name, submissions, out_dir) for video_name, submissions in sorted(by_video.items())]
+    merged = _pool_map(_merge_and_write, tasks, jobs)
+
+    conflicts = [c for _, _, video_conflicts in merged for c in video_conflicts]
+    report = dict(
+        zips=zip_paths,
+        annotators=sorted({s.annotator for submissions in by_video.values() for s in submissions}),
+        videos={
+            video_name: dict(
+                annotators=sorted(s.annotator for s in by_video[video_name]),
+                n_frames=n_frames,
+                n_conflicts=len(video_conflicts)
+            )
+            for video_name, n_frames, video_conflicts in merged
+        },
+        n_conflicts=len(conflicts),
+        n_ties=sum(c['resolution'] == 'tie' for c in conflicts),
+        problems=problems,
+        conflicts=conflicts
+    )
+    if report_path is None:
+        report_path = os.path.join(out_dir, 'aggregate-report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return report
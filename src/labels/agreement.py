@@ -0,0 +1,204 @@
+import itertools
+from typing import NamedTuple, Iterable, Optional
+
+import numpy as np
+
+from .aggregate import Submission, collect, read_source
+
+DEFAULT_TOLERANCE = 3
+
+# per label: events of the reference, of the candidate, matched ones of each
+_N_REF, _N_CAND, _HIT_REF, _HIT_CAND = range(4)
+
+
+class Events(NamedTuple):
+    # the labeled frames of one submission, compact enough to pass between processes
+    annotator: str
+    video_name: str
+    labels: tuple[str, ...]
+    fis: np.ndarray
+    label_codes: np.ndarray  # indices into `labels`
+
+
+def events_of(submission: Submission) -> Events:
+    labeled = [(fi, label) for fi, (label, _) in submission.frames.items() if label is not None]
+    labels = tuple(sorted({label for _, label in labeled}))
+    codes = {label: i for i, label in enumerate(labels)}
+    return Events(
+        annotator=submission.annotator,
+        video_name=submission.video_name,
+        labels=labels,
+        fis=np.array([fi for fi, _ in labeled], dtype=np.int64),
+        label_codes=np.array([codes[label] for _, label in labeled], dtype=np.int64)
+    )
+
+
+def read_events(path) -> tuple[list[Events], list[str]]:
+    submissions, problems = read_source(path)
+    return [events_of(s) for s in submissions], problems
+
+
+def _encode(events: Events, label_ids: dict[str, int], stride) -> np.ndarray:
+    # one sorted key per event; labels occupy disjoint key ranges `stride` apart
+    lut = np.array([label_ids[label] for label in events.labels], dtype=np.int64)
+    return np.sort(lut[events.label_codes] * stride + events.fis)
+
+
+def _find(keys: np.ndarray, targets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # positions of the targets found in the sorted keys, and where they were found
+    j = np.searchsorted(keys, targets)
+    found = j < len(keys)
+    found[found] = keys[j[found]] == targets[found]
+    return np.flatnonzero(found), j[found]
+
+
+def _match(ref_keys: np.ndarray, cand_keys: np.ndarray, tolerance) -> tuple[np.ndarray, np.ndarray]:
+    # pairs every event with at most one event of the other side, nearest offsets
+    # first; extra events near a matched one stay unmatched. returns indices into
+    # both key arrays
+    ref_used = np.zeros(len(ref_keys), dtype=bool)
+    cand_used = np.zeros(len(cand_keys), dtype=bool)
+    matched_ref, matched_cand = [], []
+    for distance in range(tolerance + 1):
+        found = [_find(cand_keys, ref_keys + offset) for offset in sorted({-distance, distance})]
+        r = np.concatenate([r for r, _ in found])
+        c = np.concatenate([c for _, c in found])
+        order = np.lexsort((c, r))
+        r, c = r[order], c[order]
+        # a round takes the earliest free partner of every event; what it leaves
+        # out because of a clash is tried again
+        while True:
+            free = ~ref_used[r] & ~cand_used[c]
+            r, c = r[free], c[free]
+            if not len(r):
+                break
+            _, first = np.unique(r, return_index=True)
+            rr, cc = r[first], c[first]
+            _, first = np.unique(cc, return_index=True)
+            rr, cc = rr[first], cc[first]
+            ref_used[rr] = cand_used[cc] = True
+            matched_ref.append(rr)
+            matched_cand.append(cc)
+    if not matched_ref:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(matched_ref), np.concatenate(matched_cand)
+
+
+def compare(ref: Events, cand: Events, labels: list[str], tolerance) -> tuple[np.ndarray, np.ndarray]:
+    # returns per-label counts (n_labels, 4) and a histogram of the offsets of
+    # matched candidate events (n_labels, 2 * tolerance + 1)
+    label_ids = {label: i for i, label in enumerate(labels)}
+    fi_max = max(ref.fis.max(initial=0), cand.fis.max(initial=0))
+    # a window of `tolerance` around a key never reaches the range of another label
+    stride = int(fi_max) + tolerance + 1
+    ref_keys = _encode(ref, label_ids, stride)
+    cand_keys = _encode(cand, label_ids, stride)
+
+    ref_hit, cand_hit = _match(ref_keys, cand_keys, tolerance)
+    offsets = cand_keys[cand_hit] - ref_keys[ref_hit]
+
+    n_labels = len(labels)
+    ref_label, cand_label = ref_keys // stride, cand_keys // stride
+    counts = np.stack([
+        np.bincount(ref_label, minlength=n_labels),
+        np.bincount(cand_label, minlength=n_labels),
+        np.bincount(ref_label[ref_hit], minlength=n_labels),
+        np.bincount(cand_label[cand_hit], minlength=n_labels)
+    ], axis=1)
+
+    n_bins = 2 * tolerance + 1
+    bins = cand_label[cand_hit] * n_bins + offsets + tolerance
+    hist = np.bincount(bins, minlength=n_labels * n_bins).reshape(n_labels, n_bins)
+
+    return counts, hist
+
+
+def _compare_video(submissions: list[Events], tolerance) \
+        -> tuple[list[str], dict[tuple[str, str], tuple[np.ndarray, np.ndarray]]]:
+    labels = sorted({label for s in submissions for label in s.labels})
+    by_annotator = sorted(submissions, key=lambda s: s.annotator)
+    return labels, {
+        (ref.annotator, cand.annotator): compare(ref, cand, labels, tolerance)
+        for ref, cand in itertools.combinations(by_annotator, 2)
+    }
+
+
+def _ratio(a, b) -> Optional[float]:
+    return float(a / b) if b else None
+
+
+def _label_stats(counts: np.ndarray, hist: np.ndarray, tolerance) -> dict:
+    precision = _ratio(counts[_HIT_CAND], counts[_N_CAND])
+    recall = _ratio(counts[_HIT_REF], counts[_N_REF])
+    f1 = None
+    if precision is not None and recall is not None and precision + recall:
+        f1 = 2 * precision * recall / (precision + recall)
+    offsets = np.arange(-tolerance, tolerance + 1)
+    return dict(
+        n_reference=int(counts[_N_REF]),
+        n_candidate=int(counts[_N_CAND]),
+        matched_reference=int(counts[_HIT_REF]),
+        matched_candidate=int(counts[_HIT_CAND]),
+        precision=precision,
+        recall=recall,
+        f1=f1,
+        mean_offset=_ratio((hist * offsets).sum(), hist.sum()),
+        offsets={int(offset): int(n) for offset, n in zip(offsets, hist)}
+    )
+
+
+def agreement(paths: Iterable[str], tolerance: int = DEFAULT_TOLERANCE, jobs: int = 1) -> dict:
+    # compares every pair of annotators on the videos both of them labeled; in a pair
+    # the first annotator is the reference, so precision is how many of the second
+    # annotator's events the first one confirms
+    # reading is spread over the workers; the comparisons are vectorized and cheap
+    # next to moving the events between processes, so they run here
+    by_video, problems = collect(paths, jobs, reader=read_events)
+    results = [
+        _compare_video(submissions, tolerance)
+        for _, submissions in sorted(by_video.items())
+        if len(submissions) > 1
+    ]
+
+    n_bins = 2 * tolerance + 1
+
+    def zeros():
+        return np.zeros(4, dtype=np.int64), np.zeros(n_bins, dtype=np.int64)
+
+    pair_totals: dict[tuple[str, str], dict[str, tuple[np.ndarray, np.ndarray]]] = {}
+    pair_videos: dict[tuple[str, str], int] = {}
+    label_totals: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+    for labels, pairs in results:
+        for pair, (counts, hist) in pairs.items():
+            pair_videos[pair] = pair_videos.get(pair, 0) + 1
+            totals = pair_totals.setdefault(pair, {})
+            for i, label in enumerate(labels):
+                if not counts[i, _N_REF] and not counts[i, _N_CAND]:
+                    continue
+                for total_counts, total_hist in totals.setdefault(label, zeros()), \
+                        label_totals.setdefault(label, zeros()):
+                    total_counts += counts[i]
+                    total_hist += hist[i]
+
+    return dict(
+        tolerance=tolerance,
+        annotators=sorted({s.annotator for submissions in by_video.values() for s in submissions}),
+        n_videos=len(results),
+        problems=problems,
+        pairs=[
+            dict(
+                reference=ref,
+                candidate=cand,
+                n_videos=pair_videos[ref, cand],
+                labels={
+                    label: _label_stats(counts, hist, tolerance)
+                    for label, (counts, hist) in sorted(pair_totals[ref, cand].items())
+                }
+            )
+            for ref, cand in sorted(pair_totals)
+        ],
+        labels={
+            label: _label_stats(counts, hist, tolerance)
+            for label, (counts, hist) in sorted(label_totals.items())
+        }
+    )
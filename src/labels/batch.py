@@ -0,0 +1,169 @@
+import codecs
+import collections
+import json
+import os
+from typing import Optional, Iterable
+
+from res import resolve, Domain
+from . import _json_compat as compat
+from ._changes import LabelChange
+
+
+# per-file helpers for headless batch processing; they take and return plain
+# values so that they can run in worker processes
+
+
+def list_json_files(markdata_dir=None) -> list[str]:
+    if markdata_dir is None:
+        markdata_dir = resolve(Domain.MARKDATA, make_dirs='self')
+    return [
+        os.path.join(markdata_dir, name)
+        for name in sorted(os.listdir(markdata_dir))
+        if name.endswith('.json')
+    ]
+
+
+def read_json_root(json_path) -> dict:
+    with codecs.open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_json_root(json_path, json_bytes: bytes = None, author: dict = None) -> dict:
+    # reads and upgrades to the latest json-version without touching the file;
+    # `author` is recorded in files older than the author field
+    if json_bytes is None:
+        json_root = read_json_root(json_path)
+    else:
+        json_root = json.loads(json_bytes.decode('utf-8'))
+    return compat.convert(json_path=json_path, json_root=json_root, author=author)
+
+
+def video_name_of(json_path) -> str:
+    return os.path.splitext(os.path.split(json_path)[1])[0]
+
+
+# validation
+
+def validate_json_root(json_path, json_root) -> list[str]:
+    problems = []
+
+    if not isinstance(json_root, dict):
+        return ['root is not an object']
+
+    try:
+        version = compat.inspect_version(json_root)
+    except (KeyError, TypeError):
+        return ['meta has no json-version']
+    if version not in compat.JSON_STRUCTURE:
+        return [f'unknown json-version {version!r}']
+
+    try:
+        json_root = compat.convert(json_path=json_path, json_root=json_root)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        return [f'cannot upgrade json-version {version}: {e!r}']
+
+    meta = json_root.get('meta')
+    if not isinstance(meta, dict):
+        problems.append('meta is not an object')
+    else:
+        video_name = meta.get('video-name')
+        if video_name != video_name_of(json_path):
+            problems.append(f'video-name {video_name!r} does not match the file name')
+
+    frames = json_root.get('frames')
+    if not isinstance(frames, dict):
+        problems.append('frames is not an object')
+        return problems
+
+    for key, frame in frames.items():
+        if not isinstance(frame, dict):
+            problems.append(f'frame {key}: not an object')
+            continue
+        fi = frame.get('fi')
+        if not isinstance(fi, int) or isinstance(fi, bool) or fi < 0:
+            problems.append(f'frame {key}: invalid fi {fi!r}')
+        elif str(fi) != key:
+            problems.append(f'frame {key}: fi {fi} does not match the key')
+        label = frame.get('label')
+        if label is not None and not isinstance(label, str):
+            problems.append(f'frame {key}: invalid label {label!r}')
+        tags = frame.get('tags')
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            problems.append(f'frame {key}: invalid tags {tags!r}')
+        elif len(set(tags)) != len(tags):
+            problems.append(f'frame {key}: duplicated tags {tags!r}')
+
+    return problems
+
+
+def validate_file(json_path) -> tuple[str, list[str]]:
+    try:
+        json_root = read_json_root(json_path)
+    except (OSError, ValueError) as e:
+        return json_path, [f'cannot read: {e!r}']
+    return json_path, validate_json_root(json_path, json_root)
+
+
+# statistics
+
+def stats_of_json_root(json_root) -> dict:
+    frames = json_root['frames'].values()
+    fis = [frame['fi'] for frame in frames]
+    author = json_root['meta'].get('author', {})
+    return dict(
+        video_name=json_root['meta'].get('video-name'),
+        author=author.get('hash-digest'),
+        n_frames=len(fis),
+        fi_min=min(fis, default=None),
+        fi_max=max(fis, default=None),
+        labels=dict(collections.Counter(frame['label'] for frame in frames if frame['label'] is not None)),
+        tags=dict(collections.Counter(tag for frame in frames for tag in frame['tags']))
+    )
+
+
+def stats_file(json_path) -> tuple[str, Optional[dict]]:
+    try:
+        return json_path, stats_of_json_root(load_json_root(json_path))
+    except (OSError, ValueError, KeyError, TypeError):
+        return json_path, None
+
+
+def merge_stats(stats: Iterable[dict]) -> dict:
+    total = dict(
+        n_files=0,
+        n_frames=0,
+        labels=collections.Counter(),
+        tags=collections.Counter(),
+        authors=collections.Counter()
+    )
+    for s in stats:
+        total['n_files'] += 1
+        total['n_frames'] += s['n_frames']
+        total['labels'].update(s['labels'])
+        total['tags'].update(s['tags'])
+        total['authors'][s['author']] += 1
+    return {k: dict(v) if isinstance(v, collections.Counter) else v for k, v in total.items()}
+
+
+# diff
+
+def _frame_entries(json_root) -> dict[int, tuple[Optional[str], tuple[str, ...]]]:
+    return {
+        frame['fi']: (frame['label'], tuple(frame['tags']))
+        for frame in json_root['frames'].values()
+    }
+
+
+def diff_json_roots(json_root_a, json_root_b) -> list[LabelChange]:
+    a, b = _frame_entries(json_root_a), _frame_entries(json_root_b)
+    changes = []
+    for fi in sorted(a.keys() | b.keys()):
+        change = LabelChange.between(fi, a.get(fi), b.get(fi))
+        if change is not None:
+            changes.append(change)
+    return changes
+
+
+def diff_files(json_path_a, json_path_b) -> tuple[str, str, list[LabelChange]]:
+    changes = diff_json_roots(load_json_root(json_path_a), load_json_root(json_path_b))
+    return json_path_a, json_path_b, changes
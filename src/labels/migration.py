@@ -0,0 +1,270 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from enum import Enum
+from typing import NamedTuple, Optional, Iterable
+
+from res import resolve, Domain
+from . import _file_lock as file_lock
+from . import _json_compat as compat
+from . import batch, porting
+
+
+class MigrationStatus(Enum):
+    CONVERTED = 'converted'
+    SKIPPED = 'skipped'  # already at the latest json-version, or done by an earlier run
+    FAILED = 'failed'
+
+
+class MigrationResult(NamedTuple):
+    path: str
+    member: Optional[str]  # member name for files inside a zip
+    status: MigrationStatus
+    version_from: Optional[int]
+    problems: tuple[str, ...] = ()
+
+    def to_json(self):
+        return dict(
+            path=self.path,
+            member=self.member,
+            status=self.status.value,
+            version_from=self.version_from,
+            problems=list(self.problems)
+        )
+
+
+def default_journal_path():
+    return resolve(Domain.APPINFO, 'migration-journal.jsonl', make_dirs='parent')
+
+
+def default_report_path():
+    return resolve(Domain.APPINFO, 'migration-report.json', make_dirs='parent')
+
+
+def _signature(path) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _backup_original(path, data: bytes):
+    # one copy per distinct original content, so reruns do not pile up backups
+    stem, ext = os.path.splitext(os.path.basename(path))
+    digest = hashlib.sha1(data).hexdigest()[:12]
+    dst_path = resolve(
+        Domain.MARKDATA_BACKUP,
+        'migration',
+        f'{stem}.{digest}{ext}',
+        make_dirs='parent'
+    )
+    if not os.path.exists(dst_path):
+        tmp_path = dst_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, dst_path)
+
+
+def _replace_atomically(path, data: bytes):
+    tmp_path = path + '.migrating'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _convert(json_name, json_bytes: bytes, author: dict) \
+        -> tuple[Optional[int], Optional[bytes], tuple[str, ...]]:
+    # returns the json-version found, the upgraded bytes (None if up to date) and problems.
+    # `author` is recorded in files older than the author field, which may come from
+    # any annotator rather than from the machine that migrates them
+    try:
+        json_root = json.loads(json_bytes.decode('utf-8'))
+        version_from = compat.inspect_version(json_root)
+    except (ValueError, KeyError, TypeError) as e:
+        return None, None, (f'cannot read: {e!r}',)
+
+    problems = tuple(batch.validate_json_root(json_name, json_root))
+    if version_from == compat.latest_json_version() or problems:
+        return version_from, None, problems
+
+    converted = compat.convert(json_path=json_name, json_root=json_root, author=author)
+    problems = tuple(batch.validate_json_root(json_name, converted))
+    return version_from, compat.dumps(converted).encode('utf-8'), problems
+
+
+def _status(version_from, converted, problems) -> MigrationStatus:
+    if converted is not None:
+        return MigrationStatus.FAILED if problems else MigrationStatus.CONVERTED
+    if version_from == compat.latest_json_version():
+        # up to date; problems are reported but nothing is there to migrate
+        return MigrationStatus.SKIPPED
+    return MigrationStatus.FAILED
+
+
+def migrate_json_file(json_path, dry_run=False) -> list[MigrationResult]:
+    # the application may have the file open; it merges the result when it sees it
+    with file_lock.locked(json_path):
+        with open(json_path, 'rb') as f:
+            data = f.read()
+        version_from, converted, problems = _convert(json_path, data, compat.author_of_digest(None))
+        status = _status(version_from, converted, problems)
+
+        if status == MigrationStatus.CONVERTED and not dry_run:
+            _backup_original(json_path, data)
+            _replace_atomically(json_path, converted)
+    return [MigrationResult(json_path, None, status, version_from, problems)]
+
+
+def migrate_zip_file(zip_path, dry_run=False) -> list[MigrationResult]:
+    # the zip is rewritten only if every member could be handled
+    results, members = [], []
+    author = compat.author_of_digest(porting.author_digest_of_zip(zip_path))
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        for info in zf.infolist():
+            data = zf.read(info)
+            if not info.filename.endswith('.json') or '/' in info.filename:
+                results.append(MigrationResult(
+                    zip_path, info.filename, MigrationStatus.FAILED, None, ('not a markdata member',)
+                ))
+                members.append((info, data))
+                continue
+            version_from, converted, problems = _convert(info.filename, data, author)
+            status = _status(version_from, converted, problems)
+            members.append((info, converted if status == MigrationStatus.CONVERTED else data))
+            results.append(MigrationResult(zip_path, info.filename, status, version_from, problems))
+
+    n_converted = sum(r.status == MigrationStatus.CONVERTED for r in results)
+    n_failed = sum(r.status == MigrationStatus.FAILED for r in results)
+    if n_converted and n_failed:
+        return [
+            r._replace(status=MigrationStatus.FAILED, problems=r.problems + ('zip not rewritten',))
+            if r.status == MigrationStatus.CONVERTED else r
+            for r in results
+        ]
+    if not n_converted or dry_run:
+        return results
+
+    tmp_path = zip_path + '.migrating'
+    with zipfile.ZipFile(tmp_path, 'w') as zf:
+        for info, data in members:
+            zf.writestr(info, data, compress_type=info.compress_type)
+    with open(zip_path, 'rb') as f:
+        _backup_original(zip_path, f.read())
+    shutil.copymode(zip_path, tmp_path)
+    os.replace(tmp_path, zip_path)
+    return results
+
+
+class MigrationJournal:
+    # one line per finished file; a file whose size and mtime still match is not read again
+
+    def __init__(self, path):
+        self.__path = path
+        self.__done: dict[str, tuple[int, int]] = {}
+
+    def load(self):
+        self.__done.clear()
+        if not os.path.exists(self.__path):
+            return
+        with open(self.__path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of an interrupted run
+                self.__done[entry['path']] = (entry['size'], entry['mtime_ns'])
+
+    def clear(self):
+        self.__done.clear()
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+    def is_done(self, path) -> bool:
+        signature = self.__done.get(os.path.abspath(path))
+        return signature is not None and os.path.exists(path) and signature == _signature(path)
+
+    def record(self, path):
+        path = os.path.abspath(path)
+        size, mtime_ns = _signature(path)
+        self.__done[path] = size, mtime_ns
+        with open(self.__path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(path=path, size=size, mtime_ns=mtime_ns)) + '\n')
+            f.flush()
+
+
+def _migrate_task(task) -> tuple[str, list[MigrationResult]]:
+    kind, path, dry_run = task
+    try:
+        if kind == 'zip':
+            return path, migrate_zip_file(path, dry_run)
+        return path, migrate_json_file(path, dry_run)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        return path, [MigrationResult(path, None, MigrationStatus.FAILED, None, (f'{e!r}',))]
+
+
+def migrate_all(
+        json_paths: Iterable[str] = None,
+        zip_paths: Iterable[str] = (),
+        markdata_dir=None,
+        jobs: int = 1,
+        dry_run=False,
+        journal_path=None,
+        report_path=None,
+        restart=False,
+        progress=None
+) -> dict:
+    if json_paths is None:
+        json_paths = batch.list_json_files(markdata_dir)
+    tasks = [('json', path) for path in json_paths] + [('zip', path) for path in zip_paths]
+
+    journal = MigrationJournal(journal_path or default_journal_path())
+    if restart:
+        journal.clear()
+    else:
+        journal.load()
+
+    started = datetime.datetime.now()
+    results: list[MigrationResult] = []
+    pending = []
+    for kind, path in tasks:
+        if not dry_run and journal.is_done(path):
+            results.append(MigrationResult(path, None, MigrationStatus.SKIPPED, None, ('done by an earlier run',)))
+        else:
+            pending.append((kind, path, dry_run))
+
+    def finish(path, task_results):
+        results.extend(task_results)
+        # failed files are retried on the next run
+        if not dry_run and all(r.status != MigrationStatus.FAILED for r in task_results):
+            journal.record(path)
+        if progress is not None:
+            progress(task_results)
+
+    if jobs <= 1 or len(pending) <= 1:
+        for task in pending:
+            finish(*_migrate_task(task))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(_migrate_task, task) for task in pending]
+            for future in as_completed(futures):
+                finish(*future.result())
+
+    counts = {status.value: 0 for status in MigrationStatus}
+    for r in results:
+        counts[r.status.value] += 1
+    report = dict(
+        started=started.isoformat(timespec='seconds'),
+        finished=datetime.datetime.now().isoformat(timespec='seconds'),
+        dry_run=dry_run,
+        json_version=compat.latest_json_version(),
+        counts=counts,
+        results=[r.to_json() for r in sorted(results, key=lambda r: (r.path, r.member or ''))]
+    )
+
+    with open(report_path or default_report_path(), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return report
@@ -1,28 +1,223 @@
-import codecs
+import datetime
+import hashlib
+import io
+import json
 import os.path
+import re
+import shutil
+import time
 import zipfile
+from typing import NamedTuple, Optional, Iterator, Iterable
 
 import machine
+from common import MARKDATA_BACKEND
 from res import resolve, Domain
+from . import _file_lock as file_lock
+from . import _json_compat as compat
+from ._sqlite_store import shared_database
 
+# members are streamed through the zip in chunks of this size
+CHUNK_SIZE = 1 << 20
 
-def export_all(dst_path, exists_ok=False):
-    zf_path = os.path.join(dst_path, f'iDSTTVideoMarkerData_{machine.platform_hash_digest}.zip')
+COMPRESSIONS = {
+    'deflate': zipfile.ZIP_DEFLATED,
+    'lzma': zipfile.ZIP_LZMA,
+    'store': zipfile.ZIP_STORED
+}
+DEFAULT_COMPRESSION = 'deflate'
+
+_ZIP_NAME_PREFIX = 'iDSTTVideoMarkerData_'
+
+
+def author_digest_of_zip(zip_path) -> Optional[str]:
+    # the machine hash an export was named after, for members that do not record it
+    m = re.match(re.escape(_ZIP_NAME_PREFIX) + r'([0-9a-f]+)', os.path.basename(zip_path))
+    return m.group(1) if m else None
+
+
+class _Source(NamedTuple):
+    json_name: str
+    path: Optional[str]  # file on disk; None for rows of the database
+    data: Optional[bytes] = None
+
+    def open(self):
+        if self.path is None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def signature(self) -> Optional[tuple[int, int]]:
+        if self.path is None:
+            return None
+        st = os.stat(self.path)
+        return st.st_size, st.st_mtime_ns
+
+
+def _iter_markdata(markdata_dir=None) -> Iterator[_Source]:
+    # the database only backs the default markdata directory
+    use_database = MARKDATA_BACKEND == 'sqlite' and markdata_dir is None
+    if markdata_dir is None:
+        markdata_dir = resolve(Domain.MARKDATA, make_dirs='self')
+    json_names = {name for name in os.listdir(markdata_dir) if name.endswith('.json')}
+
+    if use_database:
+        database = shared_database()
+        for video_name in database.list_videos():
+            json_name = f'{video_name}.json'
+            json_names.discard(json_name)
+            json_root = database.export_json_root(video_name)
+            yield _Source(json_name, None, compat.dumps(json_root).encode('utf-8'))
+
+    for json_name in sorted(json_names):
+        yield _Source(json_name, os.path.join(markdata_dir, json_name))
+
+
+def _exists_locally(json_name, markdata_dir=None):
+    if markdata_dir is not None:
+        return os.path.exists(os.path.join(markdata_dir, json_name))
+    if os.path.exists(resolve(Domain.MARKDATA, json_name)):
+        return True
+    if MARKDATA_BACKEND == 'sqlite':
+        return shared_database().has_video(os.path.splitext(json_name)[0])
+    return False
+
+
+# manifest of what the last export contained, per markdata directory
+
+def _manifest_path():
+    return resolve(Domain.APPINFO, 'export-manifest.json', make_dirs='parent')
+
+
+def _manifest_key(markdata_dir):
+    if markdata_dir is None:
+        return f'{resolve(Domain.MARKDATA)}#{MARKDATA_BACKEND}'
+    return os.path.abspath(markdata_dir)
+
+
+def _load_manifest(markdata_dir) -> dict[str, dict]:
+    try:
+        with open(_manifest_path(), 'r', encoding='utf-8') as f:
+            return json.load(f).get(_manifest_key(markdata_dir), {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(markdata_dir, entries: dict[str, dict]):
+    path = _manifest_path()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifests = json.load(f)
+    except (OSError, ValueError):
+        manifests = {}
+    manifests[_manifest_key(markdata_dir)] = entries
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifests, f, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _manifest_entry(sha256, signature):
+    size, mtime_ns = signature or (None, None)
+    return dict(sha256=sha256, size=size, mtime_ns=mtime_ns)
+
+
+def _hash(source: _Source) -> str:
+    h = hashlib.sha256()
+    with source.open() as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _write_zip(zf_path, sources: Iterable[_Source], compression) -> dict[str, dict]:
+    # streams every source into a temporary zip that replaces `zf_path` once complete;
+    # returns the manifest entries of what was written
+    entries = {}
+    tmp_path = zf_path + '.tmp'
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=COMPRESSIONS[compression]) as zf:
+            for source in sources:
+                signature = source.signature()
+                h = hashlib.sha256()
+                # the member keeps the time of the last change for `import_all(if_newer=True)`
+                info = zipfile.ZipInfo(
+                    source.json_name,
+                    date_time=time.localtime(time.time() if signature is None else signature[1] / 1e+9)[:6]
+                )
+                info.compress_type = zf.compression
+                with source.open() as f_src, zf.open(info, 'w') as f_dst:
+                    for chunk in iter(lambda: f_src.read(CHUNK_SIZE), b''):
+                        h.update(chunk)
+                        # noinspection PyTypeChecker
+                        f_dst.write(chunk)
+                entries[source.json_name] = _manifest_entry(h.hexdigest(), signature)
+        os.replace(tmp_path, zf_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return entries
+
+
+def export_all(dst_path, exists_ok=False, markdata_dir=None, compression=DEFAULT_COMPRESSION):
+    zf_path = os.path.join(dst_path, f'{_ZIP_NAME_PREFIX}{machine.platform_hash_digest}.zip')
     if os.path.exists(zf_path) and not exists_ok:
         return False
 
-    with zipfile.ZipFile(zf_path, 'w') as zf:
-        for json_name in os.listdir(resolve(Domain.MARKDATA, make_dirs='self')):
-            json_path = resolve(Domain.MARKDATA, json_name)
-            with codecs.open(json_path, 'rb') as f_json:
-                with zf.open(json_name, 'w') as f_zipped_file:
-                    # noinspection PyTypeChecker
-                    f_zipped_file.write(f_json.read())
+    entries = _write_zip(zf_path, _iter_markdata(markdata_dir), compression)
+    _save_manifest(markdata_dir, entries)
 
     return True
 
 
-def import_all(zip_path):
+def export_incremental(dst_path, markdata_dir=None, compression=DEFAULT_COMPRESSION) \
+        -> tuple[Optional[str], list[str]]:
+    # packs only the files whose content changed since the last export;
+    # returns the zip path (None if nothing changed) and the packed file names.
+    # the receiving side applies it with `import_all(..., if_newer=True)`
+    manifest = _load_manifest(markdata_dir)
+    entries, changed = {}, []
+    for source in _iter_markdata(markdata_dir):
+        previous = manifest.get(source.json_name)
+        signature = source.signature()
+        if previous is not None and signature is not None \
+                and (previous['size'], previous['mtime_ns']) == signature:
+            entries[source.json_name] = previous
+            continue
+        sha256 = _hash(source)
+        if previous is not None and previous['sha256'] == sha256:
+            # touched but identical
+            entries[source.json_name] = _manifest_entry(sha256, signature)
+            continue
+        changed.append(source)
+
+    if not changed:
+        _save_manifest(markdata_dir, entries)
+        return None, []
+
+    now = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    zf_path = os.path.join(dst_path, f'{_ZIP_NAME_PREFIX}{machine.platform_hash_digest}_{now}.zip')
+    entries.update(_write_zip(zf_path, changed, compression))
+    _save_manifest(markdata_dir, entries)
+
+    return zf_path, [source.json_name for source in changed]
+
+
+def _member_is_newer(info: zipfile.ZipInfo, json_path) -> bool:
+    # members carry the time the exported file was last changed, in local time to two
+    # seconds; files that only the database holds have no time to compare and are kept
+    if not os.path.exists(json_path):
+        return False
+    exported = time.mktime(info.date_time + (0, 0, -1))
+    return exported > os.path.getmtime(json_path)
+
+
+def import_all(zip_path, markdata_dir=None, if_newer=False):
+    # files that exist locally are canceled; with `if_newer` they are replaced when they
+    # were changed on the exporting side after the last local change, which applies
+    # incremental exports. the database keeps no change times to compare with, so
+    # `if_newer` needs json markdata
+    if if_newer and markdata_dir is None and MARKDATA_BACKEND == 'sqlite':
+        raise ValueError('overwriting if newer is not supported with the sqlite backend')
+
     with zipfile.ZipFile(zip_path, 'r') as zf:
         for name in zf.namelist():
             if not name.endswith('.json'):
@@ -32,19 +227,30 @@ def import_all(zip_path):
 
     canceled = []
     with zipfile.ZipFile(zip_path, 'r') as zf:
-        for name in zf.namelist():
+        for info in zf.infolist():
+            name = info.filename
             if not name.endswith('.json'):
                 return None
             if '/' in name:
                 return None
-            dst_json_path = resolve(Domain.MARKDATA, name, make_dirs='parent')
-            if os.path.exists(dst_json_path):
-                canceled.append(dst_json_path)
-                print(zip_path, name, '->', '<canceled>')
-                continue
+            if markdata_dir is None:
+                dst_json_path = resolve(Domain.MARKDATA, name, make_dirs='parent')
             else:
-                print(zip_path, name, '->', dst_json_path)
-            with zf.open(name, 'r') as f_src:
-                with open(dst_json_path, 'wb') as f_dst:
-                    f_dst.write(f_src.read())
+                dst_json_path = os.path.join(markdata_dir, name)
+            with file_lock.locked(dst_json_path):
+                if _exists_locally(name, markdata_dir) \
+                        and not (if_newer and _member_is_newer(info, dst_json_path)):
+                    canceled.append(dst_json_path)
+                    print(zip_path, name, '->', '<canceled>')
+                    continue
+                else:
+                    print(zip_path, name, '->', dst_json_path)
+                tmp_path = dst_json_path + '.tmp'
+                with zf.open(name, 'r') as f_src:
+                    with open(tmp_path, 'wb') as f_dst:
+                        shutil.copyfileobj(f_src, f_dst, CHUNK_SIZE)
+                os.replace(tmp_path, dst_json_path)
+                # the next incremental import compares with the exported change time
+                exported = time.mktime(info.date_time + (0, 0, -1))
+                os.utime(dst_json_path, (exported, exported))
     return canceled
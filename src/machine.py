@@ -1,6 +1,8 @@
 import hashlib
 import platform
 
+from common import DEBUG
+
 system = platform.system()
 node = platform.node()
 
@@ -8,4 +10,5 @@ total = str(dict(system=system, node=node))
 
 platform_hash_digest = hashlib.md5(total.encode('utf-8')).hexdigest()
 
-print(repr(platform_hash_digest))
+if DEBUG:
+    print(repr(platform_hash_digest))
@@ -1,19 +1,28 @@
 import os.path
+import threading
 import webbrowser
-from typing import Optional, Literal
+from typing import Optional, Literal, Union, TYPE_CHECKING
 
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
 import labels.porting
+import startup
 import version
 from common import DEBUG, FrameAction
-from video import Video
+from frame_presenter import FramePresenter
+from session import Session
+from labels import LabelChange, LabelDataJson, GlobalLabelIndex
+from video_pool import VideoPool
 from widgets.frame_image_view import FrameViewWidget
 from widgets.label_template_view import LabelTemplateWidget
 from widgets.label_timeline_view import LabelTimelineWidget
 from widgets.labeled_frame_list_view import LabeledFrameListWidget
+from widgets.overview_strip import OverviewStrip
+
+if TYPE_CHECKING:
+    from video import Video
 
 
 class HorizontalSplitter(QSplitter):
@@ -49,11 +58,30 @@ class HorizontalSplitter(QSplitter):
 
 
 class MainWidget(HorizontalSplitter):
+    # noinspection PyArgumentList
+    save_error_changed = pyqtSignal(object)  # Optional[OSError]
+
+    # the session of the open video is written at most this often
+    SESSION_SAVE_INTERVAL_MS = 5000
 
     def __init__(self, parent: QWidget):
         super().__init__(parent)
 
-        self.__video: Optional[Video] = None
+        self.__video: Optional['Video'] = None
+        self.__presenter = FramePresenter(self)
+        self.__pending_list_changes: list[LabelChange] = []
+
+        self.__pool = VideoPool()
+
+        self.__session: Optional[Session] = None
+        self.__session_timer = QTimer(self)
+        self.__session_timer.setInterval(self.SESSION_SAVE_INTERVAL_MS)
+        # noinspection PyUnresolvedReferences
+        self.__session_timer.timeout.connect(self.__save_session)
+        # noinspection PyUnresolvedReferences
+        QApplication.instance().aboutToQuit.connect(self.__save_session)
+        # noinspection PyUnresolvedReferences
+        QApplication.instance().aboutToQuit.connect(self.__close_videos)
 
         self.__init_ui()
         self.__init_signals()
@@ -82,14 +110,49 @@ class MainWidget(HorizontalSplitter):
         self.__w_marker = LabelTimelineWidget(self)
         self.left.addWidget(self.__w_marker)
 
+        # whole-video overview
+        self.__w_overview = OverviewStrip(self)
+        self.left.addWidget(self.__w_overview)
+
         self.left.addStretch(1)
 
     def __init_signals(self):
         self.__w_frame.control_clicked.connect(self.perform_frame_action)
         self.__w_label_template.control_clicked.connect(self.perform_marker_action)
-        self.__w_marker.view_updated.connect(self.__w_marker_list.update_view)
+        self.__w_marker.data_changed.connect(self.__w_marker_list.set_data)
+        self.__w_marker.labels_changed.connect(self.__defer_list_changes)
+        self.__w_marker.data_changed.connect(self.__w_overview.set_data)
+        self.__w_marker.labels_changed.connect(self.__w_overview.apply_changes)
+        self.__w_marker.save_error_changed.connect(self.save_error_changed)
         self.__w_marker_list.seek_requested.connect(self.__video_seek)
+        self.__w_overview.seek_requested.connect(self.__video_seek)
         self.__w_label_template.template_changed.connect(self.__w_marker.update_template)
+        self.__w_label_template.template_changed.connect(self.__w_marker_list.update_template)
+        self.__w_label_template.template_changed.connect(self.__w_overview.update_template)
+        self.__presenter.frame_presented.connect(self.__w_frame.setup_frame)
+        self.__presenter.frame_presented.connect(self.__w_marker.setup_frame)
+        self.__presenter.frame_presented.connect(self.__w_overview.setup_frame)
+        self.__presenter.frame_settled.connect(self.__notice_cache)
+        self.__presenter.frame_settled.connect(self.__record_session)
+        self.__presenter.frame_presented.connect(self.__mark_first_frame)
+
+    # noinspection PyUnusedLocal,PyArgumentList
+    @pyqtSlot(QImage, int, float)
+    def __mark_first_frame(self, img, idx, ts):
+        startup.mark('first frame presented')
+        # noinspection PyUnresolvedReferences
+        self.__presenter.frame_presented.disconnect(self.__mark_first_frame)
+
+    # noinspection PyArgumentList
+    @pyqtSlot(object)
+    def __defer_list_changes(self, changes: list[LabelChange]):
+        # the list catches up once input settles
+        self.__pending_list_changes.extend(changes)
+        self.__presenter.defer('list', self.__flush_list_changes)
+
+    def __flush_list_changes(self):
+        changes, self.__pending_list_changes = self.__pending_list_changes, []
+        self.__w_marker_list.apply_changes(changes)
 
     # noinspection PyArgumentList
     @pyqtSlot(int)
@@ -184,6 +247,8 @@ class MainWidget(HorizontalSplitter):
     # noinspection PyArgumentList
     @pyqtSlot(QKeyEvent)
     def perform_key(self, e):
+        self.__presenter.input_received()
+
         key = e.key()
         mod = e.modifiers()
 
@@ -218,32 +283,103 @@ class MainWidget(HorizontalSplitter):
         ]
         self.__video.request_cache([*marker_cache, *neighbour_cache])
 
+    # noinspection PyUnusedLocal,PyArgumentList
+    @pyqtSlot(QImage, int, float)
+    def __record_session(self, img, idx, ts):
+        if self.__session is not None:
+            self.__session.visit(idx)
+
+    # noinspection PyArgumentList
+    @pyqtSlot()
+    def __save_session(self):
+        if self.__session is None:
+            return
+        try:
+            self.__session.save()
+        except OSError as e:
+            print('session not saved', repr(e))
+
     def __init_video_signals(self, v):
-        v.seek_finished.connect(self.__w_frame.setup_frame)
-        v.seek_finished.connect(self.__w_marker.setup_frame)
-        v.seek_finished.connect(self.__notice_cache)
+        v.seek_finished.connect(self.__presenter.submit)
+        v.frame_count_corrected.connect(self.__video_frame_count_corrected)
 
-    def __set_video_instance(self, v: Video):
+    def __release_video_signals(self, v):
+        v.seek_finished.disconnect(self.__presenter.submit)
+        v.frame_count_corrected.disconnect(self.__video_frame_count_corrected)
+
+    # noinspection PyUnusedLocal,PyArgumentList
+    @pyqtSlot(int)
+    def __video_frame_count_corrected(self, frame_count):
+        v = self.__video
+        if v is None:
+            return
+        self.__w_frame.setup_meta(v.path, v.frame_rate, v.frame_count)
+        self.__w_overview.setup_meta(v.path, v.frame_rate, v.frame_count)
+        self.__w_overview.set_data(self.__w_marker.data)
+        if v.frame_index is not None:
+            self.__w_overview.set_position(v.frame_index)
+
+    def __set_video_instance(self, v: 'Video', data: Optional[LabelDataJson]):
         self.__init_video_signals(v)
         self.__w_frame.setup_meta(v.path, v.frame_rate, v.frame_count)
-        self.__w_marker.setup_meta(v.path, v.frame_rate, v.frame_count)
+        self.__w_overview.setup_meta(v.path, v.frame_rate, v.frame_count)
+        self.__w_marker.setup_meta(v.path, v.frame_rate, v.frame_count, data)
+        self.__w_marker_list.setup_meta(v.path, v.frame_rate, v.frame_count)
         self.__video = v
 
-    def __remove_video_instance_if_exists(self):
+    def __put_video_instance_away(self):
+        # the video stays open in the pool until it is evicted
         if self.__video is not None:
+            self.__presenter.reset()
+            self.__pending_list_changes.clear()
+            self.__session_timer.stop()
+            self.__save_session()
+            self.__session = None
             v = self.__video
             self.__video = None
-            v.release()
-            v.deleteLater()
+            self.__release_video_signals(v)
+
+    # noinspection PyArgumentList
+    @pyqtSlot()
+    def __close_videos(self):
+        self.__put_video_instance_away()
+        self.__pool.clear()
 
     # noinspection PyArgumentList
     @pyqtSlot(str)
     def update_path(self, path):
-        self.__remove_video_instance_if_exists()
-        # noinspection PyTypeChecker
-        v = Video(self, path)
-        self.__set_video_instance(v)
-        v.seek(0)
+        # cv2 is imported with the first video rather than at startup
+        from video import Video
+
+        pooled = self.__pool.get(path)
+        if pooled is not None and pooled.video is self.__video:
+            return
+        self.__put_video_instance_away()
+        with startup.phase('open video'):
+            if pooled is None:
+                # noinspection PyTypeChecker
+                v = Video(self, path)
+                self.__set_video_instance(v, None)
+            else:
+                v = pooled.video
+                self.__set_video_instance(v, pooled.data)
+        self.__pool.put(path, v, self.__w_marker.data)
+        for evicted_path in self.__pool.trim(keep=path):
+            print('video closed', evicted_path)
+        # continue where the last session on this video ended
+        session = Session.load(path)
+        self.__session = session
+        self.__session_timer.start()
+        v.seek(session.position if 0 <= session.position < v.frame_count else 0)
+        if pooled is None:
+            v.warm(session.hot_frames(v.frame_count))
+
+    def relabel(self, src_label_name: str, dst_label_name: str):
+        if self.__video is None:
+            return False
+        self.__w_marker.relabel(src_label_name, dst_label_name)
+        self.__w_marker.update_view()
+        return True
 
     # noinspection PyArgumentList
     @pyqtSlot()
@@ -304,10 +440,22 @@ class MainWindow(QMainWindow, MainWindowStubs):
     file_dropped = pyqtSignal(str)  # video_path: str
     # noinspection PyArgumentList
     key_entered = pyqtSignal(QKeyEvent)
+    # noinspection PyArgumentList
+    update_checked = pyqtSignal(object)  # version.UpdateInfo
+    # noinspection PyArgumentList
+    label_index_refreshed = pyqtSignal(object)  # GlobalLabelIndex.refresh result or the error
+
+    # unlabeled stretches at least this long are listed in the statistics
+    STATISTICS_GAP_FRAMES = 1800
 
     def __init__(self):
         super().__init__()
 
+        self.__update_info: Optional[version.UpdateInfo] = None
+        self.__shown = False
+        self.__label_index: Optional[GlobalLabelIndex] = None
+        self.__label_index_busy = False
+
         self.__init_ui()
         self.__init_menu_bar()
 
@@ -377,6 +525,30 @@ class MainWindow(QMainWindow, MainWindowStubs):
         msg.setStandardButtons(QMessageBox.Ok)
         msg.exec()
 
+    def __menu_action_label_export_incremental(self):
+        # noinspection PyTypeChecker
+        zip_folder_path = QFileDialog.getExistingDirectory(
+            self,
+            "前回のエクスポートから変更されたデータのzipファイルを書き出すフォルダを選択"
+        ).strip()
+
+        if not zip_folder_path:
+            return
+
+        zip_path, json_names = labels.porting.export_incremental(zip_folder_path)
+
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Information)
+        if zip_path is None:
+            msg.setText('前回のエクスポートから変更されたデータはありません')
+        else:
+            print('Exported!')
+            msg.setText(f'変更された{len(json_names)}個のファイルをエクスポートしてzipファイルを生成しました')
+            msg.setInformativeText(zip_path)
+        msg.setWindowTitle(self.windowTitle())
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec()
+
     def __menu_action_label_import(self):
         # noinspection PyTypeChecker
         zip_path, check = QFileDialog.getOpenFileName(
@@ -422,6 +594,105 @@ class MainWindow(QMainWindow, MainWindowStubs):
         msg.setStandardButtons(QMessageBox.Ok)
         msg.exec()
 
+    def __menu_action_label_relabel(self):
+        src_label_name, check = QInputDialog.getText(self, self.windowTitle(), '置き換えるラベル名')
+        if not check or not src_label_name:
+            return
+        dst_label_name, check = QInputDialog.getText(self, self.windowTitle(), '新しいラベル名')
+        if not check or not dst_label_name:
+            return
+
+        w = self.centralWidget()
+        assert isinstance(w, MainWidget), type(w)
+        if not w.relabel(src_label_name, dst_label_name):
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Warning)
+            msg.setText('動画を開いてから実行してください')
+            msg.setWindowTitle(self.windowTitle())
+            msg.setStandardButtons(QMessageBox.Ok)
+            msg.exec()
+
+    def __menu_action_label_statistics(self):
+        if self.__label_index_busy:
+            return
+        self.__label_index_busy = True
+        self.statusBar().showMessage('ラベルの索引を更新しています...', color='white')
+
+        first = self.__label_index is None
+        if first:
+            self.__label_index = GlobalLabelIndex()
+        index = self.__label_index
+
+        def worker():
+            # the result comes back in any case, or the menu would stay busy
+            result = None
+            try:
+                if first:
+                    index.load()
+                result = index.refresh()
+            except Exception as e:
+                print('label index not refreshed', repr(e))
+                result = e
+            finally:
+                # noinspection PyUnresolvedReferences
+                self.label_index_refreshed.emit(result)
+
+        threading.Thread(target=worker, name='label-index', daemon=True).start()
+
+    # noinspection PyArgumentList
+    @pyqtSlot(object)
+    def __show_save_error(self, save_error: Optional[OSError]):
+        if save_error is None:
+            self.statusBar().showMessage('ラベルを保存しました', color='white')
+        elif isinstance(save_error, TimeoutError):
+            self.statusBar().showMessage('他のプロセスが使用中のためラベルを保存できません。次の編集で再試行します', color='pink')
+        else:
+            self.statusBar().showMessage(f'ラベルを保存できません。次の編集で再試行します: {save_error!r}', color='pink')
+
+    # noinspection PyArgumentList
+    @pyqtSlot(object)
+    def __show_label_statistics(self, refreshed: Union[dict, Exception]):
+        self.__label_index_busy = False
+        if isinstance(refreshed, Exception):
+            self.statusBar().showMessage('ラベルの索引を更新できませんでした', color='pink')
+            msg = QMessageBox()
+            msg.setIcon(QMessageBox.Warning)
+            msg.setText('ラベルの索引を更新できませんでした')
+            msg.setInformativeText(repr(refreshed))
+            msg.setWindowTitle(self.windowTitle())
+            msg.setStandardButtons(QMessageBox.Ok)
+            msg.exec()
+            return
+        self.statusBar().showMessage(f'{refreshed["n_videos"]}本の動画のラベルを集計しました', color='white')
+
+        index = self.__label_index
+        counts = index.label_counts()
+        coverage = index.coverage()
+        gaps = index.gaps(self.STATISTICS_GAP_FRAMES)
+
+        details = []
+        for video_name, c in coverage.items():
+            if c['n_frames']:
+                details.append(f'{video_name}: {c["n_frames"]}フレーム ({c["fi_min"]}-{c["fi_max"]})')
+            else:
+                details.append(f'{video_name}: ラベルなし')
+        if gaps:
+            details.append('')
+            details.append(f'{self.STATISTICS_GAP_FRAMES}フレーム以上ラベルのない区間')
+            for video_name, start, stop in gaps:
+                details.append(f'{video_name}: {start}-{stop}')
+        for json_path in refreshed['unreadable']:
+            details.append(f'読み込めないファイル: {json_path}')
+
+        msg = QMessageBox()
+        msg.setIcon(QMessageBox.Information)
+        msg.setText(f'{len(coverage)}本の動画, {sum(counts.values())}個のラベル')
+        msg.setInformativeText('\n'.join(f'{label}: {count}' for label, count in counts.items()))
+        msg.setDetailedText('\n'.join(details))
+        msg.setWindowTitle(self.windowTitle())
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec()
+
     # noinspection PyArgumentList
     def __init_menu_bar(self):
         mb = self.menuBar()
@@ -456,6 +727,14 @@ class MainWindow(QMainWindow, MainWindowStubs):
             )
         )
 
+        menu.addAction(
+            QAction(
+                'Export &Changes',
+                self,
+                triggered=self.__menu_action_label_export_incremental
+            )
+        )
+
         menu.addAction(
             QAction(
                 '&Import',
@@ -464,11 +743,32 @@ class MainWindow(QMainWindow, MainWindowStubs):
             )
         )
 
+        menu.addSeparator()
+
+        menu.addAction(
+            QAction(
+                '&Relabel',
+                self,
+                triggered=self.__menu_action_label_relabel
+            )
+        )
+
+        menu.addAction(
+            QAction(
+                '&Statistics',
+                self,
+                triggered=self.__menu_action_label_statistics
+            )
+        )
+
     def __init_signals(self):
         w = self.centralWidget()
         assert isinstance(w, MainWidget), type(w)
         self.file_dropped.connect(w.update_path)
         self.key_entered.connect(w.perform_key)
+        self.update_checked.connect(self.__show_update_info)
+        self.label_index_refreshed.connect(self.__show_label_statistics)
+        w.save_error_changed.connect(self.__show_save_error)
 
     @staticmethod
     def __extract_dnd_event_path(e):
@@ -538,29 +838,62 @@ class MainWindow(QMainWindow, MainWindowStubs):
     @pyqtSlot(str)
     def __statusbar_clicked(self, msg):
         if msg.startswith('アップデートが利用可能です'):
-            webbrowser.open(version.latest_version_info['url'])
+            webbrowser.open(self.__update_info.latest_version_info['url'])
 
-    # noinspection PyPep8Naming
-    def showEvent(self, _):
-        # noinspection PyUnresolvedReferences
-        self.centralWidget().update_label_templates()
+    def __start_update_check(self):
+        # a fresh cache answers without the network
+        info = version.check_update(cache_only=True)
+        if info is not None:
+            self.update_checked.emit(info)
+            return
 
-        self.__load_mp4_for_debug()
+        self.statusBar().showMessage('アップデートを確認しています...', color='white')
+
+        def worker():
+            # noinspection PyUnresolvedReferences
+            self.update_checked.emit(version.check_update())
+
+        threading.Thread(target=worker, name='update-check', daemon=True).start()
+
+    # noinspection PyArgumentList
+    @pyqtSlot(object)
+    def __show_update_info(self, info: version.UpdateInfo):
+        self.__update_info = info
 
         sb = self.statusBar()
         assert isinstance(sb, MainStatusBar), type(sb)
 
-        if version.update_available is None:
+        if info.update_available is None:
             sb.showMessage(
                 f'アップデートを確認していません',
                 color='pink',
                 font_weight='bold'
             )
-        elif version.update_available:
+        elif info.update_available:
             sb.clicked.connect(self.__statusbar_clicked)
             sb.showMessage(
-                f'アップデートが利用可能です（ver {version.app_version_str}->ver {version.latest_version}）'
+                f'アップデートが利用可能です（ver {version.app_version_str}->ver {info.latest_version}）'
                 f'ここをクリックするとGitHubが開くので　Code -> Download ZIP から最新版をダウンロードしてmarkdataを移行してください',
                 color='cyan',
                 font_weight='bold'
             )
+        else:
+            sb.showMessage(f'最新バージョンです: {version.app_version_str}', color='white')
+
+    def __after_shown(self):
+        with startup.phase('load label templates'):
+            # noinspection PyUnresolvedReferences
+            self.centralWidget().update_label_templates()
+
+        self.__load_mp4_for_debug()
+
+        self.__start_update_check()
+
+    # noinspection PyPep8Naming
+    def showEvent(self, _):
+        if self.__shown:
+            return
+        self.__shown = True
+        startup.mark('window shown')
+        # let the window paint before scanning templates and opening videos
+        QTimer.singleShot(0, self.__after_shown)
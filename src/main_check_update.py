@@ -38,8 +38,9 @@ class MainWidget(QWidget):
 
     def show_update(self):
         version_name = version.app_version_str
-        if version.update_available:
-            url = version.latest_version_info['url']
+        info = version.check_update()
+        if info.update_available:
+            url = info.latest_version_info['url']
             print(url)
             self.__url = url
             text = f'アップデートが利用可能です（現在のバージョン: {version_name}）'
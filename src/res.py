@@ -2,13 +2,16 @@ import os
 from enum import Enum
 from typing import Literal
 
+from common import DEBUG
+
 _FILE_ABSOLUTE = os.path.abspath(__file__)
 _SOURCES_ROOT = os.path.dirname(_FILE_ABSOLUTE)
 _PROJECT_ROOT = os.path.dirname(_SOURCES_ROOT)
 
 assert 'run.bat' in os.listdir(_PROJECT_ROOT), _PROJECT_ROOT
 
-print(f'{_PROJECT_ROOT=}')
+if DEBUG:
+    print(f'{_PROJECT_ROOT=}')
 
 
 class Domain(Enum):
@@ -16,6 +19,8 @@ class Domain(Enum):
     RESOURCES = 'resources'
     MARKDATA = 'markdata'
     MARKDATA_BACKUP = 'markdata-backup'
+    MARKDATA_SNAPSHOT = 'markdata-snapshot'
+    MARKDATA_DB = 'markdata-db'
     APPINFO = 'appinfo'
     TEMPLATE = 'label-template'
 
@@ -1,3 +1,5 @@
+import startup  # first, so that the imports below are timed
+
 import codecs
 import datetime
 import os
@@ -6,12 +8,15 @@ import sys
 import traceback
 from pprint import pformat
 
+from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import *
 
 from common import DEBUG
-from main import MainWindow
 from res import resolve, Domain
 
+with startup.phase('import main'):
+    from main import MainWindow
+
 
 def get_sys_info():
     import platform
@@ -61,11 +66,15 @@ def excepthook(exc_type, exc_value, exc_tb):
 sys.excepthook = excepthook
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    if os.name == 'nt':
-        app.setStyleSheet("*{font-size: 11pt; font-family: Consolas;}")
-    else:
-        app.setStyleSheet("*{font-size: 11pt; font-family: Courier;}")
-    ew = MainWindow()
+    with startup.phase('create application'):
+        app = QApplication(sys.argv)
+        if os.name == 'nt':
+            app.setStyleSheet("*{font-size: 11pt; font-family: Consolas;}")
+        else:
+            app.setStyleSheet("*{font-size: 11pt; font-family: Courier;}")
+    with startup.phase('create main window'):
+        ew = MainWindow()
     ew.show()
+    if startup.PROFILE_IMPORTS:
+        QTimer.singleShot(0, lambda: print(startup.report()))
     sys.exit(app.exec_())
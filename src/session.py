@@ -0,0 +1,88 @@
+import json
+import os
+from typing import Optional
+
+from res import resolve, Domain
+
+# where the annotator was in each video, so that reopening continues there
+
+# frames remembered per video, most recent first
+RECENT_LIMIT = 64
+
+
+def _session_path(video_name):
+    return resolve(Domain.APPINFO, 'sessions', f'{video_name}.json', make_dirs='parent')
+
+
+class Session:
+    def __init__(self, video_path, position=0, recent=()):
+        self.__video_path = video_path
+        self.__video_name = os.path.splitext(os.path.basename(video_path))[0]
+        self.__position = position
+        self.__recent: list[int] = list(recent)[:RECENT_LIMIT]
+        self.__modified = False
+
+    @classmethod
+    def load(cls, video_path) -> 'Session':
+        session = cls(video_path)
+        try:
+            with open(_session_path(session.video_name), 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            # a different file of the same name starts over
+            if record.get('video_size') != os.path.getsize(video_path):
+                return session
+            return cls(video_path, int(record['position']), [int(fi) for fi in record['recent']])
+        except (OSError, ValueError, KeyError, TypeError):
+            return session
+
+    def save(self):
+        if not self.__modified:
+            return
+        path = _session_path(self.__video_name)
+        record = dict(
+            video_path=self.__video_path,
+            video_size=os.path.getsize(self.__video_path),
+            position=self.__position,
+            recent=self.__recent
+        )
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.__modified = False
+
+    @property
+    def video_name(self):
+        return self.__video_name
+
+    @property
+    def position(self) -> int:
+        return self.__position
+
+    @property
+    def recent(self) -> list[int]:
+        return list(self.__recent)
+
+    @property
+    def modified(self):
+        return self.__modified
+
+    def visit(self, fi: int):
+        if fi == self.__position and self.__recent[:1] == [fi]:
+            return
+        self.__position = fi
+        if fi in self.__recent:
+            self.__recent.remove(fi)
+        self.__recent.insert(0, fi)
+        del self.__recent[RECENT_LIMIT:]
+        self.__modified = True
+
+    def hot_frames(self, n_frames: Optional[int] = None, neighbours=10) -> list[int]:
+        # the frames to decode ahead on reopen: the surroundings of the position in
+        # file order, then the other recent frames nearest first
+        near = list(range(self.__position - neighbours, self.__position + neighbours))
+        far = sorted(set(self.__recent) - set(near), key=lambda fi: (abs(fi - self.__position), fi))
+        fis = near + far
+        if n_frames is not None:
+            fis = [fi for fi in fis if 0 <= fi < n_frames]
+        return fis
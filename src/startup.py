@@ -0,0 +1,122 @@
+import contextlib
+import importlib.abc
+import sys
+import time
+from typing import Optional
+
+# import this module first so that the origin is close to the process start
+T0 = time.perf_counter()
+
+PROFILE_IMPORTS = 'profile_startup' in sys.argv
+
+_phases: list[tuple[str, float, float]] = []  # name, start, end (seconds since T0)
+_marks: list[tuple[str, float]] = []
+_imports: dict[str, list[float]] = {}  # module name -> [cumulative, self]
+
+
+def elapsed() -> float:
+    return time.perf_counter() - T0
+
+
+def mark(name: str):
+    _marks.append((name, elapsed()))
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    start = elapsed()
+    try:
+        yield
+    finally:
+        _phases.append((name, start, elapsed()))
+
+
+class _TimedLoader(importlib.abc.Loader):
+    # delegates to the real loader and times module execution
+    _stack: list[list[float]] = []
+
+    def __init__(self, loader, fullname):
+        self.__loader = loader
+        self.__fullname = fullname
+
+    def __getattr__(self, name):
+        return getattr(self.__loader, name)
+
+    def create_module(self, spec):
+        return self.__loader.create_module(spec)
+
+    def exec_module(self, module):
+        # children accumulate into the entry on top of the stack to get self time
+        entry = [0.0, 0.0]
+        self._stack.append(entry)
+        start = time.perf_counter()
+        try:
+            self.__loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - start
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][1] += total
+            _imports[self.__fullname] = [total, total - entry[1]]
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            loader = spec.loader
+            if loader is not None and not isinstance(loader, type) and hasattr(loader, 'exec_module'):
+                spec.loader = _TimedLoader(loader, fullname)
+            return spec
+        return None
+
+
+_finder: Optional[_TimingFinder] = None
+
+
+def install_import_timer():
+    global _finder
+    if _finder is None:
+        _finder = _TimingFinder()
+        sys.meta_path.insert(0, _finder)
+
+
+def uninstall_import_timer():
+    global _finder
+    if _finder is not None:
+        sys.meta_path.remove(_finder)
+        _finder = None
+
+
+if PROFILE_IMPORTS:
+    install_import_timer()
+
+
+def summary(n_imports: int = 20) -> dict:
+    imports = sorted(_imports.items(), key=lambda item: item[1][1], reverse=True)
+    return dict(
+        marks={name: round(t * 1e3, 1) for name, t in _marks},
+        phases={name: round((end - start) * 1e3, 1) for name, start, end in _phases},
+        imports={
+            name: dict(cumulative=round(total * 1e3, 1), self=round(self_ * 1e3, 1))
+            for name, (total, self_) in imports[:n_imports]
+        }
+    )
+
+
+def report(n_imports: int = 20) -> str:
+    s = summary(n_imports)
+    lines = ['startup (ms since launch)']
+    for name, t in s['marks'].items():
+        lines.append(f'  @{t:8.1f}  {name}')
+    for name, t in s['phases'].items():
+        lines.append(f'  {t:9.1f}  {name}')
+    if s['imports']:
+        lines.append('imports (self / cumulative ms)')
+        for name, d in s['imports'].items():
+            lines.append(f'  {d["self"]:8.1f} / {d["cumulative"]:8.1f}  {name}')
+    return '\n'.join(lines)
@@ -4,14 +4,16 @@ import json
 import os.path
 import re
 import time
-import urllib.request
 from pprint import pprint
+from typing import NamedTuple, Optional
 
+from common import DEBUG
 from res import resolve, Domain
 
 CHECK_UPDATE = True
 
 _APP_INFO_JSON_PATH = resolve(Domain.APPINFO, 'appinfo.json', make_dirs='parent')
+_BRANCHES_CACHE_PATH = resolve(Domain.APPINFO, 'branches_cache.json', make_dirs='parent')
 _GITHUB_VERSIONS_URL = 'https://api.github.com/repos/yasu-a/ids-tt-video-marker/branches'
 _GITHUB_BRANCH_URL_FORMAT = 'https://github.com/yasu-a/ids-tt-video-marker/tree/{branch_name}'
 
@@ -19,33 +21,61 @@ with open(_APP_INFO_JSON_PATH, 'r') as f:
     app_info = json.load(f)
 
 _RETRIEVE_TIME_SPAN = datetime.timedelta(hours=1)
+DEFAULT_TIMEOUT = 3.0
 
 
-def retrieve_branches_json():
-    cache_path = resolve(Domain.APPINFO, 'branches_cache.json', make_dirs='parent')
-    cache = None
-    if os.path.exists(cache_path):
-        with codecs.open(cache_path, 'r', encoding='utf-8') as f_:
+def _load_branches_cache(fresh_only: bool):
+    if not os.path.exists(_BRANCHES_CACHE_PATH):
+        return None
+    try:
+        with codecs.open(_BRANCHES_CACHE_PATH, 'r', encoding='utf-8') as f_:
             cache_raw = json.load(f_)
-            timestamp = datetime.datetime.fromtimestamp(cache_raw['timestamp'])
-            if datetime.datetime.now() - timestamp <= _RETRIEVE_TIME_SPAN:
-                cache = cache_raw['main']
+        timestamp = datetime.datetime.fromtimestamp(cache_raw['timestamp'])
+        branches_json = cache_raw['main']
+    except (OSError, ValueError, OverflowError, KeyError, TypeError):
+        # unreadable or hand-edited; the network decides
+        return None
+    if fresh_only and datetime.datetime.now() - timestamp > _RETRIEVE_TIME_SPAN:
+        return None
+    return branches_json
+
 
+def retrieve_branches_json(timeout: float = DEFAULT_TIMEOUT, cache_only: bool = False):
+    # returns None when neither the network nor the cache has an answer
+    cache = _load_branches_cache(fresh_only=True)
     if cache is not None:
         print('Retrieved branches from cache')
         return cache
 
-    print(f'urllib.request.urlopen({_GITHUB_VERSIONS_URL})')
-    with urllib.request.urlopen(_GITHUB_VERSIONS_URL) as res:
-        branches_json = json.loads(res.read())
-    with codecs.open(cache_path, 'w', encoding='utf-8') as f_:
-        json.dump(
-            dict(
-                timestamp=int(time.time()),
-                main=branches_json
-            ),
-            f_
-        )
+    if cache_only:
+        return None
+
+    # imported here as it pulls in ssl and http, which startup does not need
+    import urllib.request
+
+    print(f'urllib.request.urlopen({_GITHUB_VERSIONS_URL}, {timeout=})')
+    try:
+        with urllib.request.urlopen(_GITHUB_VERSIONS_URL, timeout=timeout) as res:
+            branches_json = json.loads(res.read())
+    except (OSError, ValueError) as e:
+        # offline or rate-limited; an outdated answer is better than none
+        print(f'Failed to retrieve branches from github: {e!r}')
+        cache = _load_branches_cache(fresh_only=False)
+        if cache is not None:
+            print('Retrieved branches from outdated cache')
+        return cache
+
+    try:
+        with codecs.open(_BRANCHES_CACHE_PATH, 'w', encoding='utf-8') as f_:
+            json.dump(
+                dict(
+                    timestamp=int(time.time()),
+                    main=branches_json
+                ),
+                f_
+            )
+    except OSError as e:
+        print(f'Failed to cache branches: {e!r}')
     print('Retrieved branches from github')
     return branches_json
 
@@ -57,13 +87,35 @@ def version_to_order(major_, minor_):
 app_version_str = f"{app_info['version']['major']}.{app_info['version']['minor']}"
 app_version_int = version_to_order(app_info['version']['major'], app_info['version']['minor'])
 
-if CHECK_UPDATE:
-    _branches_json = retrieve_branches_json()
+
+class UpdateInfo(NamedTuple):
+    versions: dict[str, dict]
+    latest_version: Optional[str]
+    latest_version_info: Optional[dict]
+    update_available: Optional[bool]  # None if unchecked
+
+
+UNCHECKED = UpdateInfo(versions={}, latest_version=None, latest_version_info=None, update_available=None)
+
+
+def check_update(timeout: float = DEFAULT_TIMEOUT, cache_only: bool = False) -> Optional[UpdateInfo]:
+    # returns None only if `cache_only` is set and the cache is not fresh
+    if not CHECK_UPDATE:
+        print('UPDATE UNCHECKED!!!!')
+        return UNCHECKED
+
+    branches_json = retrieve_branches_json(timeout=timeout, cache_only=cache_only)
+    if branches_json is None:
+        return None if cache_only else UNCHECKED
 
     versions = {}
-    for branch_dct in _branches_json:
-        branch_name = branch_dct['name']
-        m = re.fullmatch(r'release/stable/(\d+)\.(\d+)', branch_name)
+    try:
+        branch_names = [branch_dct['name'] for branch_dct in branches_json]
+    except (KeyError, TypeError):
+        # not a list of branches, e.g. an error message from the api
+        return UNCHECKED
+    for branch_name in branch_names:
+        m = re.fullmatch(r'release/stable/(\d+)\.(\d+)', str(branch_name))
         if not m:
             continue
         major, minor = map(int, m.groups())
@@ -71,18 +123,22 @@ if CHECK_UPDATE:
             url=_GITHUB_BRANCH_URL_FORMAT.format(branch_name=branch_name),
             order=version_to_order(major, minor)
         )
+    if not versions:
+        return UNCHECKED
 
     latest_version, latest_version_info \
         = sorted(versions.items(), key=lambda item: item[1]['order'])[-1]
 
-    update_available = latest_version_info['order'] > app_version_int
-else:
-    versions = {}
-    latest_version, latest_version_info = None, None
-    update_available = None
+    info = UpdateInfo(
+        versions=versions,
+        latest_version=latest_version,
+        latest_version_info=latest_version_info,
+        update_available=latest_version_info['order'] > app_version_int
+    )
 
-    print('UPDATE UNCHECKED!!!!')
+    if DEBUG:
+        pprint(versions)
+        print(f'{latest_version=}')
+        print(f'{latest_version_info=}')
 
-pprint(versions)
-print(f'{latest_version=}')
-print(f'{latest_version_info=}')
+    return info
@@ -1,17 +1,61 @@
 import os.path
+import threading
+from typing import Iterable, Optional
 
 import cv2
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
+import video_probe
 from cache import lru_cache
 
+# decoded frames kept per open video
+CACHE_MAX_BYTES = 256 * 1000 * 1000
+
+
+def _frame_index(cap) -> int:
+    return int(cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
+
+
+def _frame_timestamp(cap) -> float:
+    return float(cap.get(cv2.CAP_PROP_POS_MSEC)) / 1e+3
+
+
+def _read_frame(cap, i, frame_rate) -> tuple[QImage, int, float]:
+    if _frame_index(cap) > i:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+        cap.grab()
+    if _frame_index(cap) < i:
+        delta = i - _frame_index(cap)
+        if delta < frame_rate * 5:
+            for _ in range(delta):
+                cap.grab()
+        else:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+            cap.grab()
+
+    idx = _frame_index(cap)
+    ts = _frame_timestamp(cap)
+
+    if idx < i:
+        # the stream ended before the frame; the failed grab leaves nothing to retrieve
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        raise EOFError('frame beyond the end of the video', i, idx)
+    assert i == idx, (i, idx)
+
+    img = cap.retrieve()[1]
+    img = cv2.resize(img, None, fx=0.6, fy=0.6)
+    img = QImage(img.data, img.shape[1], img.shape[0], QImage.Format_RGB888).rgbSwapped()
+    return img, idx, ts
+
 
 class Video(QObject):
     # noinspection PyArgumentList
     seek_requested = pyqtSignal(int, int)  # i_current, i_next
     # noinspection PyArgumentList
     seek_finished = pyqtSignal(QImage, int, float)  # img, idx, ts
+    # noinspection PyArgumentList
+    frame_count_corrected = pyqtSignal(int)  # frame_count
 
     def __init__(self, parent: QObject, path):
         super().__init__(parent)
@@ -24,29 +68,19 @@ class Video(QObject):
         self.__path = path
 
         self.__cap = cv2.VideoCapture(path)
-        self.__grab()
-        self.__retrieve()
-        self.__cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-        self.__frame_rate = float(self.__cap.get(cv2.CAP_PROP_FPS))
-        self.__frame_count = int(self.__cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        probe = video_probe.cached(path)
+        self.__probe = probe or video_probe.from_header(self.__cap)
+
+        self.__frame_rate = self.__probe.frame_rate
+        self.__frame_count = self.__probe.frame_count
         self.__last_frame_index = None
         self.__last_frame_timestamp = None
 
-    def __grab(self):
-        self.__cap.grab()
-
-    def __retrieve(self):
-        return self.__cap.retrieve()[1]
-
-    def __seek_at(self, i):
-        self.__cap.set(cv2.CAP_PROP_POS_FRAMES, i)
-
-    def __prop_frame_index(self):
-        return int(self.__cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1
-
-    def __prop_frame_timestamp(self):
-        return float(self.__cap.get(cv2.CAP_PROP_POS_MSEC)) / 1e+3
+        self.__warming: Optional[tuple[threading.Thread, threading.Event]] = None
+        self.__verifying: Optional[tuple[threading.Thread, threading.Event]] = None
+        if probe is None:
+            self.__start_verifying()
 
     @property
     def path(self):
@@ -60,6 +94,10 @@ class Video(QObject):
     def frame_count(self):
         return self.__frame_count
 
+    @property
+    def probe(self) -> video_probe.VideoProbe:
+        return self.__probe
+
     @property
     def frame_index(self):
         return self.__last_frame_index
@@ -68,29 +106,13 @@ class Video(QObject):
     def frame_time(self):
         return self.__last_frame_timestamp
 
-    @lru_cache(maxsize=int(256e+6 / (1440 * 1040 * 3 * 1 / (2 * 2))))
+    @lru_cache(max_bytes=CACHE_MAX_BYTES, sizeof=lambda result: result[0].sizeInBytes())
     def __read(self, i):
-        if self.__prop_frame_index() > i:
-            self.__seek_at(i)
-            self.__grab()
-        if self.__prop_frame_index() < i:
-            delta = i - self.__prop_frame_index()
-            if delta < self.frame_rate * 5:
-                for _ in range(delta):
-                    self.__grab()
-            else:
-                self.__seek_at(i)
-                self.__grab()
-
-        idx = self.__prop_frame_index()
-        ts = self.__prop_frame_timestamp()
+        return _read_frame(self.__cap, i, self.frame_rate)
 
-        assert i == idx, (i, idx)
-
-        img = self.__retrieve()
-        img = cv2.resize(img, None, fx=0.6, fy=0.6)
-        img = QImage(img.data, img.shape[1], img.shape[0], QImage.Format_RGB888).rgbSwapped()
-        return img, idx, ts
+    @property
+    def cache_nbytes(self) -> int:
+        return self.__read.cache_of(self).nbytes
 
     def __len__(self):
         return self.frame_count
@@ -109,15 +131,92 @@ class Video(QObject):
         self.seek_requested.emit(i_current, i_next)
 
         i = max(self.first, min(self.last, i))
-        img, idx, ts = self.__read(i)
+        try:
+            img, idx, ts = self.__read(i)
+        except EOFError as e:
+            # the header claimed more frames than there are; the stream ended after the
+            # frame it reports, and the scan in the background settles the exact count
+            _, _, idx_last = e.args
+            self.__set_probe(self.__probe._replace(frame_count=max(1, idx_last + 1), verified=False))
+            if self.__verifying is None:
+                self.__start_verifying()
+            i = max(self.first, min(self.last, i))
+            img, idx, ts = self.__read(i)
         assert i == idx, (i, idx)
         self.__last_frame_index, self.__last_frame_timestamp = idx, ts
 
         self.seek_finished.emit(img, idx, ts)
 
     def release(self):
+        self.__stop_verifying()
+        self.__stop_warming()
         if self.__cap is not None:
             self.__cap.release()
+            self.__cap = None
+        self.__read.cache_of(self).clear()
+
+    def warm(self, frame_indexes: Iterable[int]):
+        # decodes the frames into the cache with a second capture on a background
+        # thread, so that seeking to them later does not decode
+        self.__stop_warming()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self.__warm,
+            args=(list(frame_indexes), stop),
+            name='video-warm',
+            daemon=True
+        )
+        self.__warming = thread, stop
+        thread.start()
+
+    def __stop_warming(self):
+        if self.__warming is not None:
+            thread, stop = self.__warming
+            self.__warming = None
+            stop.set()
+            thread.join()
+
+    def __warm(self, frame_indexes: list[int], stop: threading.Event):
+        cache = self.__read.cache_of(self)
+        cap = cv2.VideoCapture(self.__path)
+        try:
+            for i in frame_indexes:
+                if stop.is_set():
+                    return
+                if not self.first <= i <= self.last or cache.contains(self, i):
+                    continue
+                cache.put(_read_frame(cap, i, self.frame_rate), self, i)
+        except (AssertionError, EOFError, cv2.error) as e:
+            print('cache warming stopped', self.__path, repr(e))
+        finally:
+            cap.release()
+
+    def __set_probe(self, probe: video_probe.VideoProbe):
+        self.__probe = probe
+        if probe.frame_count != self.__frame_count:
+            print('frame count corrected', self.__path, self.__frame_count, '->', probe.frame_count)
+            self.__frame_count = probe.frame_count
+            # noinspection PyUnresolvedReferences
+            self.frame_count_corrected.emit(probe.frame_count)
+
+    def __start_verifying(self):
+        # the whole stream is scanned once per file; the result is cached
+        stop = threading.Event()
+        thread = threading.Thread(target=self.__verify, args=(stop,), name='video-probe', daemon=True)
+        self.__verifying = thread, stop
+        thread.start()
+
+    def __stop_verifying(self):
+        if self.__verifying is not None:
+            thread, stop = self.__verifying
+            self.__verifying = None
+            stop.set()
+            thread.join()
+
+    def __verify(self, stop: threading.Event):
+        probe = video_probe.scan(self.__path, stop)
+        if probe is not None and not stop.is_set():
+            self.__set_probe(probe)
 
     def request_cache(self, idx_lst):
         pass
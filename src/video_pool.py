@@ -0,0 +1,86 @@
+import os
+from collections import OrderedDict
+from typing import NamedTuple, Optional, TYPE_CHECKING
+
+from labels import LabelDataJson
+
+if TYPE_CHECKING:
+    from video import Video
+
+# videos recently switched away from stay open with their decoded frames and
+# labels, so that switching back does not start over
+
+# decoded frames and labels of all the open videos together
+POOL_MAX_BYTES = 768 * 1000 * 1000
+# open captures, whatever their caches hold
+POOL_MAX_VIDEOS = 4
+
+
+class PooledVideo(NamedTuple):
+    video: 'Video'
+    data: LabelDataJson
+
+    @property
+    def nbytes(self) -> int:
+        return self.video.cache_nbytes + self.data.nbytes
+
+
+def _pool_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class VideoPool:
+    def __init__(self, max_bytes=POOL_MAX_BYTES, max_videos=POOL_MAX_VIDEOS):
+        self.__max_bytes = max_bytes
+        self.__max_videos = max_videos
+        # least recently used first
+        self.__entries: OrderedDict[str, PooledVideo] = OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, path):
+        return _pool_key(path) in self.__entries
+
+    @property
+    def nbytes(self) -> int:
+        return sum(entry.nbytes for entry in self.__entries.values())
+
+    def get(self, path) -> Optional[PooledVideo]:
+        key = _pool_key(path)
+        entry = self.__entries.get(key)
+        if entry is not None:
+            self.__entries.move_to_end(key)
+        return entry
+
+    def put(self, path, video: 'Video', data: LabelDataJson):
+        key = _pool_key(path)
+        entry = self.__entries.get(key)
+        if entry is not None and entry.video is not video:
+            self.__evict(key)
+        self.__entries[key] = PooledVideo(video, data)
+        self.__entries.move_to_end(key)
+
+    def trim(self, keep=None):
+        # evicts whole videos, least recently used first, until the pool fits;
+        # the one being shown is never evicted
+        keep_key = None if keep is None else _pool_key(keep)
+        evicted = []
+        while True:
+            candidates = [key for key in self.__entries if key != keep_key]
+            if not candidates:
+                break
+            if len(self.__entries) <= self.__max_videos and self.nbytes <= self.__max_bytes:
+                break
+            evicted.append(self.__entries[candidates[0]].video.path)
+            self.__evict(candidates[0])
+        return evicted
+
+    def __evict(self, key):
+        entry = self.__entries.pop(key)
+        entry.video.release()
+        entry.video.deleteLater()
+
+    def clear(self):
+        for key in list(self.__entries):
+            self.__evict(key)
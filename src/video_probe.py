@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+from typing import NamedTuple, Optional
+
+import cv2
+
+from res import resolve, Domain
+
+# what opening a video needs to know about it, kept per file so that reopening
+# does not ask the decoder. the frame count in the container header is wrong for
+# some mp4s, so only counts from a scan of the whole stream are kept
+
+PROBE_VERSION = 1
+
+# raw packets instead of decoded frames, where the backend supports it
+_RAW_FORMAT = -1
+
+
+class VideoProbe(NamedTuple):
+    frame_count: int
+    frame_rate: float
+    width: int
+    height: int
+    duration: float
+    verified: bool
+
+
+_lock = threading.Lock()
+
+
+def _cache_path():
+    return resolve(Domain.APPINFO, 'video-probe.json', make_dirs='parent')
+
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _signature(path) -> tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def _load_records() -> dict:
+    try:
+        with open(_cache_path(), 'r', encoding='utf-8') as f:
+            root = json.load(f)
+        if root['version'] != PROBE_VERSION:
+            return {}
+        return dict(root['videos'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _store(path, signature, probe: VideoProbe):
+    size, mtime_ns = signature
+    with _lock:
+        videos = _load_records()
+        videos[_key(path)] = dict(size=size, mtime_ns=mtime_ns, **probe._asdict())
+        cache_path = _cache_path()
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(version=PROBE_VERSION, videos=videos), f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+
+
+def cached(path) -> Optional[VideoProbe]:
+    try:
+        signature = _signature(path)
+    except OSError:
+        return None
+    record = _load_records().get(_key(path))
+    if record is None or (record.get('size'), record.get('mtime_ns')) != signature:
+        return None
+    try:
+        return VideoProbe(**{field: record[field] for field in VideoProbe._fields})
+    except (KeyError, TypeError):
+        return None
+
+
+def from_header(cap) -> VideoProbe:
+    # what the container claims, for the time until the scan finishes
+    frame_rate = float(cap.get(cv2.CAP_PROP_FPS))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return VideoProbe(
+        frame_count=frame_count,
+        frame_rate=frame_rate,
+        width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        duration=frame_count / frame_rate if frame_rate > 0 else 0.0,
+        verified=False
+    )
+
+
+def scan(path, stop: threading.Event = None) -> Optional[VideoProbe]:
+    # counts the packets of the video stream and stores the result; backends
+    # without a raw mode decode every frame instead, which only takes longer
+    try:
+        signature = _signature(path)
+    except OSError:
+        return None
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            return None
+        header = from_header(cap)
+        cap.set(cv2.CAP_PROP_FORMAT, _RAW_FORMAT)
+        n_frames, end_msec = 0, 0.0
+        while cap.grab():
+            if stop is not None and stop.is_set():
+                return None
+            n_frames += 1
+            # packets come in decoding order
+            end_msec = max(end_msec, float(cap.get(cv2.CAP_PROP_POS_MSEC)))
+    finally:
+        cap.release()
+
+    frame_interval = 1 / header.frame_rate if header.frame_rate > 0 else 0.0
+    probe = header._replace(
+        frame_count=n_frames,
+        duration=end_msec / 1e+3 + frame_interval,
+        verified=True
+    )
+    try:
+        _store(path, signature, probe)
+    except OSError as e:
+        print('video probe not stored', path, repr(e))
+    return probe
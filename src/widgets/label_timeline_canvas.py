@@ -0,0 +1,231 @@
+from typing import Optional
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from labels import LabelDataJson
+
+
+class LabelTimelineCanvas(QWidget):
+    # a labeled frame's text may run over this many columns to its right
+    TEXT_SPAN = 64
+
+    BACKGROUND = QColor('white')
+    BLOCK_BACKGROUND = QColor('#008800')
+    BLOCK_BACKGROUND_CURRENT = QColor('#880088')
+    BLOCK_COLOR = QColor('white')
+    RULER_BACKGROUNDS = QColor('#DDDDDD'), QColor('#AAAAAA')
+    RULER_COLOR = QColor('black')
+
+    def __init__(self, parent: QWidget = None):
+        super().__init__(parent)
+
+        self.__data: Optional[LabelDataJson] = None
+        self.__label_names: list[str] = []
+
+        self.__n_side = 55
+        self.__fi_center: Optional[int] = None
+
+        # ruler and label streams for the columns starting at __cache_fi_left;
+        # the cursor, the current frame and the stream names are painted over it
+        self.__cache: Optional[QPixmap] = None
+        self.__cache_fi_left: Optional[int] = None
+
+        font = QFont(self.font())
+        font.setWeight(QFont.DemiBold)
+        self.__font = font
+
+        self.__update_geometry()
+
+    # geometry
+
+    @property
+    def __n_cols(self):
+        return 2 * self.__n_side + 1
+
+    @property
+    def __col_width(self):
+        return QFontMetrics(self.__font).horizontalAdvance('_')
+
+    @property
+    def __row_height(self):
+        return QFontMetrics(self.__font).height()
+
+    @property
+    def __x0(self):
+        return max(0, (self.width() - self.__n_cols * self.__col_width) // 2)
+
+    def __update_geometry(self):
+        self.setMinimumWidth(self.__n_cols * self.__col_width)
+        self.setFixedHeight((2 + len(self.__label_names)) * self.__row_height)
+        self.invalidate()
+
+    # noinspection PyPep8Naming
+    def changeEvent(self, e):
+        if e.type() == QEvent.FontChange:
+            self.__font = QFont(self.font())
+            self.__font.setWeight(QFont.DemiBold)
+            self.__update_geometry()
+        super().changeEvent(e)
+
+    # state
+
+    def set_data(self, data: Optional[LabelDataJson]):
+        self.__data = data
+        self.invalidate()
+
+    def set_label_names(self, label_names: list[str]):
+        self.__label_names = list(label_names)
+        self.__update_geometry()
+
+    def set_n_side(self, n_side: int):
+        if self.__n_side == n_side:
+            return
+        self.__n_side = n_side
+        self.__update_geometry()
+
+    def invalidate(self):
+        self.__cache = None
+        self.__cache_fi_left = None
+        self.update()
+
+    def set_position(self, fi_center: int):
+        self.__fi_center = fi_center
+        fi_left = fi_center - self.__n_side
+        n_cols = self.__n_cols
+
+        if self.__cache is None or self.__cache_fi_left is None:
+            self.__render_full(fi_left)
+        else:
+            delta = fi_left - self.__cache_fi_left
+            if delta == 0:
+                pass
+            elif abs(delta) < n_cols:
+                self.__render_scrolled(fi_left, delta)
+            else:
+                self.__render_full(fi_left)
+
+        self.update()
+
+    # cached layer
+
+    def __new_cache(self):
+        pixmap = QPixmap(
+            self.__n_cols * self.__col_width,
+            (1 + len(self.__label_names)) * self.__row_height
+        )
+        pixmap.fill(self.BACKGROUND)
+        return pixmap
+
+    def __render_full(self, fi_left):
+        self.__cache = self.__new_cache()
+        self.__cache_fi_left = fi_left
+        self.__render_columns(0, self.__n_cols)
+
+    def __render_scrolled(self, fi_left, delta):
+        # shift what is already drawn and render only the newly exposed columns
+        n_cols, col_w = self.__n_cols, self.__col_width
+        self.__cache.scroll(-delta * col_w, 0, self.__cache.rect())
+        self.__cache_fi_left = fi_left
+
+        if delta > 0:
+            self.__render_columns(n_cols - delta, n_cols)
+        else:
+            self.__render_columns(0, -delta)
+
+    def __render_columns(self, c_start, c_stop):
+        col_w, row_h = self.__col_width, self.__row_height
+        fi_left = self.__cache_fi_left
+
+        p = QPainter(self.__cache)
+        p.setFont(self.__font)
+        p.setClipRect(c_start * col_w, 0, (c_stop - c_start) * col_w, self.__cache.height())
+        p.fillRect(p.clipBoundingRect(), self.BACKGROUND)
+
+        # ruler
+        fi_first = fi_left + c_start - 10
+        for fi in range(fi_first - fi_first % 10, fi_left + c_stop, 10):
+            if fi < 0:
+                continue
+            rect = QRect((fi - fi_left) * col_w, 0, 10 * col_w, row_h)
+            p.fillRect(rect, self.RULER_BACKGROUNDS[(fi // 10) % 2])
+            p.setPen(self.RULER_COLOR)
+            p.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter, f'|{fi}')
+
+        # label streams
+        for fi, label_name, tags, subtotal in self.__query(
+                fi_left + c_start - self.TEXT_SPAN,
+                fi_left + c_stop
+        ):
+            self.__draw_block(p, fi - fi_left, label_name, tags, subtotal, self.BLOCK_BACKGROUND)
+
+        p.end()
+
+    def __query(self, fi_start, fi_stop):
+        if self.__data is None:
+            return []
+        with self.__data.read() as accessor:
+            columns = accessor.columns
+            span = columns.span(fi_start, fi_stop)
+            rank = columns.label_rank()[span]
+            return [
+                (fi, columns.label_name(label_id), columns.tags_at(pos), subtotal)
+                for pos, fi, label_id, subtotal in zip(
+                    range(span.start, span.stop),
+                    columns.fi[span].tolist(),
+                    columns.label_ids[span].tolist(),
+                    rank.tolist()
+                )
+            ]
+
+    def __draw_block(self, p: QPainter, col, label_name, tags, subtotal, background):
+        try:
+            row = 1 + self.__label_names.index(label_name)
+        except ValueError:
+            return
+        col_w, row_h = self.__col_width, self.__row_height
+        tags = '[' + ','.join(tags) + ']' if tags else ''
+        text = f'.[{label_name}({subtotal}){tags}]'
+        rect = QRect(col * col_w, row * row_h, p.fontMetrics().horizontalAdvance(text), row_h)
+        p.fillRect(rect, background)
+        p.setPen(self.BLOCK_COLOR)
+        p.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter, text)
+
+    # painting
+
+    # noinspection PyPep8Naming
+    def paintEvent(self, _):
+        p = QPainter(self)
+        p.fillRect(self.rect(), self.BACKGROUND)
+
+        if self.__fi_center is None:
+            p.end()
+            return
+
+        if self.__cache is None:
+            self.__render_full(self.__fi_center - self.__n_side)
+
+        col_w, row_h = self.__col_width, self.__row_height
+        p.translate(self.__x0, 0)
+        p.setFont(self.__font)
+
+        # cursor
+        p.setPen(self.RULER_COLOR)
+        p.drawText(QRect(self.__n_side * col_w, 0, col_w, row_h), Qt.AlignCenter, 'v')
+
+        p.translate(0, row_h)
+        p.drawPixmap(0, 0, self.__cache)
+
+        # current frame
+        for fi, label_name, tags, subtotal in self.__query(self.__fi_center, self.__fi_center + 1):
+            self.__draw_block(p, self.__n_side, label_name, tags, subtotal, self.BLOCK_BACKGROUND_CURRENT)
+
+        # stream names
+        p.setPen(QColor('black'))
+        for i, label_name in enumerate(self.__label_names):
+            rect = QRect(0, (1 + i) * row_h, p.fontMetrics().horizontalAdvance(label_name), row_h)
+            p.fillRect(rect, self.BACKGROUND)
+            p.drawText(rect, Qt.AlignLeft | Qt.AlignVCenter, label_name)
+
+        p.end()
@@ -1,20 +1,24 @@
+import contextlib
 import os.path
 from typing import Optional
 
-import numpy as np
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
 from label_template import LabelTemplate
-from labels import LabelDataJson
+from labels import LabelDataJson, LabelChange
 from res import resolve, Domain
-from widgets.tui_label import LayeredTUILabel
+from widgets.label_timeline_canvas import LabelTimelineCanvas
 
 
 class LabelTimelineWidget(QWidget):
     # noinspection PyArgumentList
-    view_updated = pyqtSignal(LabelDataJson)
+    data_changed = pyqtSignal(LabelDataJson)
+    # noinspection PyArgumentList
+    labels_changed = pyqtSignal(object)  # list[LabelChange]
+    # noinspection PyArgumentList
+    save_error_changed = pyqtSignal(object)  # Optional[OSError]
 
     def __init__(self, parent: QWidget = None):
         super().__init__(parent)
@@ -24,11 +28,19 @@ class LabelTimelineWidget(QWidget):
 
         self.__data: Optional[LabelDataJson] = None
 
+        self.__template: Optional[LabelTemplate] = None
         self.__label_names = []
-        self.__l_streams = []
         self.__n_side_wide = False
 
         self.__prev_frame_index = None
+        self.__save_error: Optional[OSError] = None
+
+        # other processes may write the markdata of the open video
+        self.__watcher = QFileSystemWatcher(self)
+        # noinspection PyUnresolvedReferences
+        self.__watcher.fileChanged.connect(self.__markdata_changed_on_disk)
+        # noinspection PyUnresolvedReferences
+        self.__watcher.directoryChanged.connect(self.__markdata_changed_on_disk)
 
         self.__init_ui()
 
@@ -37,21 +49,18 @@ class LabelTimelineWidget(QWidget):
         layout.setSpacing(0)
         self.setLayout(layout)
 
+        # noinspection PyUnresolvedReferences
+        self.labels_changed.connect(self.__labels_changed)
+
         cb_wide = QCheckBox('Wide', self)
         # noinspection PyUnresolvedReferences
         cb_wide.stateChanged.connect(self.__wide_changed)
         layout.addWidget(cb_wide)
         self.__cb_wide = cb_wide
 
-        label_cursor = LayeredTUILabel('C', self)
-        label_cursor.setAlignment(Qt.AlignCenter)
-        layout.addWidget(label_cursor)
-        self.__l_cursor = label_cursor
-
-        label_tl = LayeredTUILabel('TL', self)
-        label_tl.setAlignment(Qt.AlignCenter)
-        layout.addWidget(label_tl)
-        self.__l_timeline = label_tl
+        canvas = LabelTimelineCanvas(self)
+        layout.addWidget(canvas)
+        self.__canvas = canvas
 
     # noinspection PyArgumentList
     @pyqtSlot(int)
@@ -62,57 +71,61 @@ class LabelTimelineWidget(QWidget):
     # noinspection PyArgumentList
     @pyqtSlot(LabelTemplate)
     def update_template(self, template: LabelTemplate):
+        self.__template = template
         self.__label_names = [name for i, name, tags in template.iter_labels()]
-        self.__update_stream_count(len(self.__label_names))
+        self.__canvas.set_label_names(self.__label_names)
         self.update_view()
 
-    def __update_stream_count(self, n):
-        if len(self.__l_streams) == n:
-            return self.__l_streams
-
-        for w_label in self.__l_streams:
-            self.layout().removeWidget(w_label)
-
-        self.__l_streams.clear()
-        for i in range(n):
-            w_label = LayeredTUILabel(f'STREAM {i}', self)
-            w_label.setAlignment(Qt.AlignCenter)
-            self.layout().addWidget(w_label)
-            self.__l_streams.append(w_label)
-
     def get_marker(self, fi: int) -> str:
-        with self.__data as accessor:
+        with self.__data.read() as accessor:
             return accessor.get_label(fi)
 
     def get_marker_subtotal(self, fi: int) -> Optional[int]:
-        with self.__data as accessor:
+        with self.__data.read() as accessor:
             return accessor.get_label_count(fi)
 
     def get_tags(self, fi: int) -> tuple[str, ...]:
-        with self.__data as accessor:
+        with self.__data.read() as accessor:
             return accessor.get_tags(fi)
 
+    @contextlib.contextmanager
+    def __write(self):
+        with self.__data.write() as accessor:
+            yield accessor
+        self.__check_saved()
+
+    def __check_saved(self):
+        # edits that could not be saved stay pending in the data until a later write
+        save_error = self.__data.save_error
+        if save_error is not self.__save_error:
+            self.__save_error = save_error
+            self.save_error_changed.emit(save_error)
+
     def set_marker(self, fi: int, label_name: str):
-        with self.__data as accessor:
+        with self.__write() as accessor:
             if label_name is None:
                 accessor.remove_label(fi)
             else:
                 accessor.set_label(fi, label_name)
 
     def add_tag(self, fi: int, tag_name: str):
-        with self.__data as accessor:
+        with self.__write() as accessor:
             accessor.add_tag(fi, tag_name)
 
     def remove_marker(self, fi: int):
-        with self.__data as accessor:
+        with self.__write() as accessor:
             accessor.remove_label(fi)
 
     def remove_tag(self, fi: int, tag_name: str):
-        with self.__data as accessor:
+        with self.__write() as accessor:
             accessor.remove_tag(fi, tag_name)
 
+    def relabel(self, src_label_name: str, dst_label_name: str):
+        with self.__write() as accessor:
+            accessor.relabel(src_label_name, dst_label_name)
+
     def find_marker(self, fi: int, direction: int, n: int = None) -> list[int]:
-        with self.__data as accessor:
+        with self.__data.read() as accessor:
             return accessor.find_nearest_labeled_index(fi, direction, n)
 
     # noinspection PyArgumentList
@@ -123,60 +136,64 @@ class LabelTimelineWidget(QWidget):
         if current_frame_index is None:
             return False
 
-        n_side = 80 if self.__n_side_wide else 55
-        frame_indexes = np.array([
-            fi for fi in range(
-                current_frame_index - n_side,
-                current_frame_index + n_side + 1
-            )
-        ])
-
-        for il, l_stream in enumerate(self.__l_streams):
-            target_label_name = self.__label_names[il]
-            l_stream.tui_clear(len(frame_indexes))
-            for i, fi in enumerate(frame_indexes):
-                label_name = self.get_marker(fi)
-                if label_name is None or label_name != target_label_name:
-                    continue
-                tags = self.get_tags(fi)
-                tags = '[' + ','.join(tags) + ']' if tags else ''
-                subtotal = self.get_marker_subtotal(fi)
-                text = f'.[{label_name}({subtotal}){tags}]'
-                l_stream.tui_write(
-                    i,
-                    text,
-                    background='#880088' if fi == current_frame_index else '#008800',
-                    color='white'
-                )
-            # noinspection PyArgumentList
-            l_stream.tui_move_to_top(current_frame_index - frame_indexes.min())
-            l_stream.tui_write(0, target_label_name)
-            l_stream.tui_move_to_top(0)
-            l_stream.tui_commit()
-
-        self.__l_timeline.tui_clear(len(frame_indexes))
-        for i, fi in enumerate(frame_indexes):
-            if fi % 10 == 0 and fi >= 0:
-                self.__l_timeline.tui_write(
-                    i,
-                    text=f'|{fi}'.ljust(10, '_'),
-                    background='#AAAAAA' if (fi // 10) % 2 else '#DDDDDD'
-                )
-        self.__l_timeline.tui_commit()
-
-        self.__l_cursor.tui_clear(len(frame_indexes))
-        self.__l_cursor.tui_write(current_frame_index - frame_indexes.min(), text='v')
-        self.__l_cursor.tui_commit()
-
-        self.view_updated.emit(self.__data)
+        self.__canvas.set_n_side(80 if self.__n_side_wide else 55)
+        self.__canvas.set_position(current_frame_index)
 
         return True
 
     # noinspection PyUnusedLocal, PyArgumentList
     @pyqtSlot(str, float, int)
-    def setup_meta(self, video_path, fps, n_fr):
+    def setup_meta(self, video_path, fps, n_fr, data: LabelDataJson = None):
+        # `data` is the labels of the video kept from when it was open before
         video_name = os.path.splitext(os.path.split(video_path)[1])[0]
-        self.__data = LabelDataJson(video_name=video_name)
+        if self.__data is not None:
+            self.__data.unsubscribe(self.__on_labels_changed)
+        if data is None:
+            data = LabelDataJson(video_name=video_name, template=self.__template)
+        self.__data = data
+        self.__data.subscribe(self.__on_labels_changed)
+        self.__canvas.set_data(self.__data)
+        self.data_changed.emit(self.__data)
+        self.__watch(self.__data.json_path)
+        # catch up with what was written while the video was in the background
+        self.__data.reload()
+        self.__check_saved()
+
+    @property
+    def data(self) -> Optional[LabelDataJson]:
+        return self.__data
+
+    def __watch(self, json_path):
+        watched = self.__watcher.files() + self.__watcher.directories()
+        if watched:
+            self.__watcher.removePaths(watched)
+        # the directory tells about files created or replaced, which drop out of the file watch
+        self.__watcher.addPath(os.path.dirname(json_path))
+        if os.path.exists(json_path):
+            self.__watcher.addPath(json_path)
+
+    # noinspection PyUnusedLocal, PyArgumentList
+    @pyqtSlot(str)
+    def __markdata_changed_on_disk(self, path):
+        if self.__data is None:
+            return
+        json_path = self.__data.json_path
+        if os.path.exists(json_path) and json_path not in self.__watcher.files():
+            self.__watcher.addPath(json_path)
+        changes = self.__data.reload()
+        self.__check_saved()
+        if changes:
+            print('merged external changes', json_path, len(changes))
+
+    # noinspection PyUnusedLocal,PyArgumentList
+    @pyqtSlot(object)
+    def __labels_changed(self, changes: list[LabelChange]):
+        # subtotals shift along the whole stream, so the cached layer is redrawn
+        self.__canvas.invalidate()
+
+    def __on_labels_changed(self, changes: list[LabelChange]):
+        # may be called from a non-GUI thread; the signal is queued then
+        self.labels_changed.emit(changes)
 
     # noinspection PyUnusedLocal, PyArgumentList
     @pyqtSlot(QImage, int, float)
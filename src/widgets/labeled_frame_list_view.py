@@ -1,18 +1,177 @@
 import re
+from typing import Optional
 
-from PyQt5.QtCore import pyqtSignal, QObject, pyqtSlot
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListWidget, QHBoxLayout, QCheckBox
+import numpy as np
+from PyQt5.QtCore import pyqtSignal, QObject, pyqtSlot, QAbstractListModel, QModelIndex, Qt
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView, QHBoxLayout, QCheckBox, QComboBox, QLineEdit, \
+    QLabel
 
-from labels import LabelDataJson
+from label_template import LabelTemplate
+from labels import LabelDataJson, LabelChange, LabelFilter
+
+
+class LabeledFrameListModel(QAbstractListModel):
+    FrameIndexRole = Qt.UserRole
+
+    # beyond this many inserted/removed rows a reset is cheaper than row signals
+    RESET_THRESHOLD = 64
+
+    def __init__(self, parent: QObject = None):
+        super().__init__(parent)
+
+        self.__data: Optional[LabelDataJson] = None
+        self.__filter = LabelFilter()
+        self.__fi = np.zeros(0, dtype=np.int64)  # sorted frame indexes of the store that pass the filter
+        self.__n_total = 0
+        self.__reversed = False
+
+    def set_data(self, data: Optional[LabelDataJson]):
+        self.beginResetModel()
+        self.__data = data
+        self.__reload()
+        self.endResetModel()
+
+    def set_filter(self, label_filter: LabelFilter):
+        if self.__filter == label_filter:
+            return
+        self.beginResetModel()
+        self.__filter = label_filter
+        self.__reload()
+        self.endResetModel()
+
+    @property
+    def n_total(self):
+        return self.__n_total
+
+    def set_reversed(self, reversed_: bool):
+        if self.__reversed == reversed_:
+            return
+        self.beginResetModel()
+        self.__reversed = reversed_
+        self.endResetModel()
+
+    def __reload(self):
+        if self.__data is None:
+            self.__fi = np.zeros(0, dtype=np.int64)
+            self.__n_total = 0
+        else:
+            with self.__data.read() as accessor:
+                self.__fi = np.array(self.__filter.select(accessor.columns), dtype=np.int64)
+                self.__n_total = len(accessor.columns)
+
+    def __row(self, index, n=None):
+        n = len(self.__fi) if n is None else n
+        return n - 1 - index if self.__reversed else index
+
+    def __index_of_row(self, row):
+        return len(self.__fi) - 1 - row if self.__reversed else row
+
+    def row_of_frame(self, fi: int) -> Optional[int]:
+        index = int(np.searchsorted(self.__fi, fi))
+        if index < len(self.__fi) and self.__fi[index] == fi:
+            return self.__row(index)
+        return None
+
+    # noinspection PyPep8Naming,PyMethodOverriding
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.__fi)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid() or self.__data is None:
+            return None
+        fi = int(self.__fi[self.__index_of_row(index.row())])
+        if role == self.FrameIndexRole:
+            return fi
+        if role == Qt.DisplayRole:
+            with self.__data.read() as accessor:
+                label = accessor.get_label(fi)
+                tags = accessor.get_tags(fi)
+                count = accessor.get_label_count(fi)
+            if label is None:
+                return f'{fi:>7d}'
+            return f'{fi:>7d} {label!s:<10s}({count:>3d}) {"/".join(tags)!s}'
+        return None
+
+    def apply_changes(self, changes: list[LabelChange]):
+        if self.__data is None or not changes:
+            return
+
+        with self.__data.read() as accessor:
+            self.__n_total = len(accessor.columns)
+            wanted = {
+                change.fi: self.__filter.matches(accessor.columns, change.fi)
+                for change in changes
+            }
+
+        # batches joined while input was active may hold several changes of a frame;
+        # the rows follow the data as it is now, once per frame
+        structural = []
+        for fi, matches in sorted(wanted.items()):
+            present = self.row_of_frame(fi) is not None
+            if present != matches:
+                structural.append((fi, matches))
+        if len(structural) > self.RESET_THRESHOLD:
+            self.set_data(self.__data)
+            return
+
+        for fi, insert in structural:
+            index = int(np.searchsorted(self.__fi, fi))
+            if insert:
+                row = self.__row(index, n=len(self.__fi) + 1)
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.__fi = np.insert(self.__fi, index, fi)
+                self.endInsertRows()
+            else:
+                row = self.__row(index)
+                self.beginRemoveRows(QModelIndex(), row, row)
+                self.__fi = np.delete(self.__fi, index)
+                self.endRemoveRows()
+
+        # retitle the changed rows and every later row, whose subtotals may have shifted;
+        # the view only re-queries what is visible
+        if len(self.__fi) == 0:
+            return
+        fi_first = min(change.fi for change in changes)
+        index_first = int(np.searchsorted(self.__fi, fi_first))
+        if index_first >= len(self.__fi):
+            return
+        rows = self.__row(index_first), self.__row(len(self.__fi) - 1)
+        self.dataChanged.emit(
+            self.index(min(rows)),
+            self.index(max(rows)),
+            [Qt.DisplayRole]
+        )
+
+
+def _parse_frame_index(text: str, fps: float) -> Optional[int]:
+    # accepts a frame index such as `1200` or a time such as `1:30` / `90.5s`
+    text = text.strip()
+    try:
+        if ':' in text:
+            minutes, seconds = text.split(':', 1)
+            return int(round((int(minutes) * 60 + float(seconds)) * fps))
+        if text.endswith('s'):
+            return int(round(float(text[:-1]) * fps))
+        return int(text)
+    except ValueError:
+        return None
+
+
+def _parse_tags(text: str) -> frozenset[str]:
+    return frozenset(tag.strip() for tag in re.split(r'[,/ ]', text) if tag.strip())
 
 
 class LabeledFrameListWidget(QWidget):
     seek_requested = pyqtSignal(int)
 
+    ALL_LABELS = '(all labels)'
+
     def __init__(self, parent: QObject = None):
         super().__init__(parent)
 
-        self.__prev_label_data = None
+        self.__fps = 30.0
 
         self.__init_ui()
 
@@ -20,11 +179,57 @@ class LabeledFrameListWidget(QWidget):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        lw = QListWidget(self)
+        # filter
+
+        layout_filter = QHBoxLayout()
+        layout.addLayout(layout_filter)
+
+        combo_label = QComboBox(self)
+        combo_label.addItem(self.ALL_LABELS)
         # noinspection PyUnresolvedReferences
-        lw.clicked.connect(lambda: self.__button_clicked('seek'))
-        layout.addWidget(lw)
-        self.__lw = lw
+        combo_label.currentIndexChanged.connect(self.__filter_edited)
+        layout_filter.addWidget(combo_label)
+        self.__combo_label = combo_label
+
+        def add_line_edit(layout_, placeholder):
+            le = QLineEdit(self)
+            le.setPlaceholderText(placeholder)
+            # noinspection PyUnresolvedReferences
+            le.editingFinished.connect(self.__filter_edited)
+            layout_.addWidget(le)
+            return le
+
+        self.__le_tags_all = add_line_edit(layout_filter, 'with tags')
+        self.__le_tags_none = add_line_edit(layout_filter, 'without tags')
+
+        layout_range = QHBoxLayout()
+        layout.addLayout(layout_range)
+
+        self.__le_start = add_line_edit(layout_range, 'from (frame/m:ss)')
+        self.__le_stop = add_line_edit(layout_range, 'to (frame/m:ss)')
+
+        label_count = QLabel(self)
+        layout_range.addWidget(label_count)
+        self.__label_count = label_count
+
+        # list
+
+        model = LabeledFrameListModel(self)
+        # noinspection PyUnresolvedReferences
+        model.modelReset.connect(self.__update_count)
+        # noinspection PyUnresolvedReferences
+        model.rowsInserted.connect(self.__update_count)
+        # noinspection PyUnresolvedReferences
+        model.rowsRemoved.connect(self.__update_count)
+        self.__model = model
+
+        lv = QListView(self)
+        lv.setModel(model)
+        lv.setUniformItemSizes(True)
+        # noinspection PyUnresolvedReferences
+        lv.clicked.connect(self.__item_clicked)
+        layout.addWidget(lv)
+        self.__lv = lv
 
         cb_reverse_order = QCheckBox('Reverse Order', self)
         # noinspection PyUnresolvedReferences
@@ -35,42 +240,64 @@ class LabeledFrameListWidget(QWidget):
         button_layout = QHBoxLayout()
         layout.addLayout(button_layout)
 
-        # b_seek = QPushButton(self, text='Seek')
-        # b_seek.clicked.connect(lambda: self.__button_clicked('seek'))
-        # button_layout.addWidget(b_seek)
-
-    @pyqtSlot(str)
-    def __button_clicked(self, command):
-        if command == 'seek':
-            items = self.__lw.selectedItems()
-            if len(items) == 0:
-                return
-            i = int(re.match(r'\s*(\d+)', items[0].text())[1])
-            # noinspection PyUnresolvedReferences
-            self.seek_requested.emit(i)
+    # noinspection PyArgumentList
+    @pyqtSlot(QModelIndex)
+    def __item_clicked(self, index: QModelIndex):
+        fi = index.data(LabeledFrameListModel.FrameIndexRole)
+        if fi is None:
+            return
+        # noinspection PyUnresolvedReferences
+        self.seek_requested.emit(fi)
 
     @pyqtSlot(int)
     def __cb_reverse_order_updated(self, _):
-        self.update_view()
+        self.__model.set_reversed(bool(self.__cb_reverse_order.checkState()))
 
-    @pyqtSlot(LabelDataJson)
-    def update_view(self, data: LabelDataJson = None):
-        if data is None:
-            data = self.__prev_label_data
-        self.__prev_label_data = data
+    # noinspection PyArgumentList
+    @pyqtSlot()
+    def __update_count(self):
+        self.__label_count.setText(f'{self.__model.rowCount()}/{self.__model.n_total}')
 
-        self.__lw.clear()
+    # noinspection PyArgumentList
+    @pyqtSlot()
+    def __filter_edited(self):
+        label_name = self.__combo_label.currentText()
+        fi_start = _parse_frame_index(self.__le_start.text(), self.__fps)
+        fi_stop = _parse_frame_index(self.__le_stop.text(), self.__fps)
+        self.__model.set_filter(
+            LabelFilter(
+                label_names=None if label_name == self.ALL_LABELS else frozenset({label_name}),
+                tags_all=_parse_tags(self.__le_tags_all.text()),
+                tags_none=_parse_tags(self.__le_tags_none.text()),
+                fi_start=fi_start,
+                fi_stop=None if fi_stop is None else fi_stop + 1
+            )
+        )
 
-        if data is None:  # skip update if label data has not been given yet
-            return
+    # noinspection PyArgumentList
+    @pyqtSlot(LabelTemplate)
+    def update_template(self, template: LabelTemplate):
+        current = self.__combo_label.currentText()
+        self.__combo_label.blockSignals(True)
+        self.__combo_label.clear()
+        self.__combo_label.addItem(self.ALL_LABELS)
+        for _, name, _ in template.iter_labels():
+            self.__combo_label.addItem(name)
+        self.__combo_label.setCurrentText(current)
+        self.__combo_label.blockSignals(False)
+        self.__filter_edited()
 
-        with data as accessor:
-            labeled_frame_index_iter = accessor.list_labeled_frame_indexes()
-            if self.__cb_reverse_order.checkState():
-                labeled_frame_index_iter = reversed(labeled_frame_index_iter)
-            for fi in labeled_frame_index_iter:
-                label = accessor.get_label(fi)
-                tags = accessor.get_tags(fi)
-                count = accessor.get_label_count(fi)
-                text = f'{fi:>7d} {label!s:<10s}({count:>3d}) {"/".join(tags)!s}'
-                self.__lw.addItem(text)
+    # noinspection PyUnusedLocal,PyArgumentList
+    @pyqtSlot(str, float, int)
+    def setup_meta(self, path, fps, n_fr):
+        self.__fps = fps
+        self.__filter_edited()
+
+    @pyqtSlot(LabelDataJson)
+    def set_data(self, data: LabelDataJson):
+        self.__model.set_data(data)
+
+    # noinspection PyArgumentList
+    @pyqtSlot(object)
+    def apply_changes(self, changes: list[LabelChange]):
+        self.__model.apply_changes(changes)
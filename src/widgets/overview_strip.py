@@ -0,0 +1,206 @@
+from typing import Optional
+
+import numpy as np
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+from label_template import LabelTemplate
+from labels import LabelDataJson, LabelChange, LabelDensityPyramid
+
+
+class OverviewStrip(QWidget):
+    # noinspection PyArgumentList
+    seek_requested = pyqtSignal(int)
+
+    ROW_HEIGHT = 8
+    MIN_SPAN = 64  # frames shown at the deepest zoom
+    ZOOM_STEP = 2
+
+    BACKGROUND = QColor('white')
+    DENSITY_COLOR = QColor('#008800')
+    CURSOR_COLOR = QColor('#880088')
+    TEXT_COLOR = QColor('#555555')
+
+    def __init__(self, parent: QWidget = None):
+        super().__init__(parent)
+
+        self.__data: Optional[LabelDataJson] = None
+        self.__pyramid: Optional[LabelDensityPyramid] = None
+        self.__n_frames: Optional[int] = None
+        self.__label_names: list[str] = []
+
+        self.__view_start = 0.0
+        self.__view_span = 1.0
+        self.__fi_current: Optional[int] = None
+
+        self.__update_geometry()
+
+    def __update_geometry(self):
+        self.setFixedHeight(max(1, len(self.__label_names)) * self.ROW_HEIGHT + self.fontMetrics().height())
+        self.update()
+
+    # state
+
+    # noinspection PyArgumentList
+    @pyqtSlot(LabelTemplate)
+    def update_template(self, template: LabelTemplate):
+        self.__label_names = [name for i, name, tags in template.iter_labels()]
+        self.__update_geometry()
+
+    # noinspection PyUnusedLocal,PyArgumentList
+    @pyqtSlot(str, float, int)
+    def setup_meta(self, path, fps, n_fr):
+        # the data of the new video follows through `set_data`
+        self.__n_frames = max(1, n_fr)
+        self.__data = None
+        self.__pyramid = None
+        self.__view_start = 0.0
+        self.__view_span = float(self.__n_frames)
+        self.__fi_current = None
+        self.update()
+
+    @pyqtSlot(LabelDataJson)
+    def set_data(self, data: LabelDataJson):
+        self.__data = data
+        self.__pyramid = None
+        if data is not None and self.__n_frames is not None:
+            with data.read() as accessor:
+                self.__pyramid = LabelDensityPyramid.from_columns(accessor.columns, self.__n_frames)
+        self.update()
+
+    # noinspection PyArgumentList
+    @pyqtSlot(object)
+    def apply_changes(self, changes: list[LabelChange]):
+        if self.__pyramid is None:
+            return
+        self.__pyramid.apply(changes)
+        self.update()
+
+    def set_position(self, fi: int):
+        self.__fi_current = fi
+        # keep the cursor inside a zoomed view
+        if not self.__view_start <= fi < self.__view_start + self.__view_span:
+            self.__set_view(fi - self.__view_span / 2, self.__view_span)
+        self.update()
+
+    # noinspection PyUnusedLocal, PyArgumentList
+    @pyqtSlot(QImage, int, float)
+    def setup_frame(self, img, idx, ts):
+        self.set_position(idx)
+
+    # view
+
+    def __set_view(self, start: float, span: float):
+        n_frames = self.__n_frames or 1
+        span = min(max(span, min(self.MIN_SPAN, n_frames)), n_frames)
+        start = min(max(start, 0.0), n_frames - span)
+        self.__view_start, self.__view_span = start, span
+
+    def __frame_at(self, x: float) -> int:
+        return int(self.__view_start + x / max(1, self.width()) * self.__view_span)
+
+    # noinspection PyPep8Naming
+    def wheelEvent(self, e: QWheelEvent):
+        if self.__n_frames is None:
+            return
+        steps = e.angleDelta().y() / 120
+        if not steps:
+            return
+        x = e.position().x()
+        fi_anchor = self.__view_start + x / max(1, self.width()) * self.__view_span
+        span = self.__view_span / self.ZOOM_STEP ** steps
+        self.__set_view(fi_anchor - x / max(1, self.width()) * span, span)
+        self.update()
+        e.accept()
+
+    # noinspection PyPep8Naming
+    def mousePressEvent(self, e: QMouseEvent):
+        if self.__n_frames is None or e.button() != Qt.LeftButton:
+            return
+        # noinspection PyUnresolvedReferences
+        self.seek_requested.emit(self.__frame_at(e.pos().x()))
+
+    # noinspection PyPep8Naming
+    def mouseMoveEvent(self, e: QMouseEvent):
+        if self.__n_frames is None or not e.buttons() & Qt.LeftButton:
+            return
+        # noinspection PyUnresolvedReferences
+        self.seek_requested.emit(self.__frame_at(min(max(e.pos().x(), 0), self.width() - 1)))
+
+    # painting
+
+    def __density_image(self, width: int) -> Optional[QImage]:
+        pyramid = self.__pyramid
+        pyramid_rows = {name: row for row, name in enumerate(pyramid.label_names)}
+        rows = [pyramid_rows.get(name) for name in self.__label_names]
+        if not rows:
+            return None
+
+        density = pyramid.density(self.__view_start, self.__view_start + self.__view_span, width)
+        alpha = np.zeros((len(rows), width), dtype=np.float64)
+        for i, row in enumerate(rows):
+            if row is None:
+                continue
+            d = density[row]
+            peak = d.max()
+            if peak > 0:
+                # sparse marks stay visible next to dense stretches
+                alpha[i] = np.where(d > 0, 0.25 + 0.75 * d / peak, 0)
+
+        c = self.DENSITY_COLOR
+        argb = (
+                (np.round(alpha * 255).astype(np.uint32) << 24)
+                | (c.red() << 16) | (c.green() << 8) | c.blue()
+        ).astype(np.uint32)
+        buffer = np.ascontiguousarray(argb)
+        image = QImage(buffer.data, width, len(rows), 4 * width, QImage.Format_ARGB32)
+        return image.copy()
+
+    # noinspection PyPep8Naming
+    def paintEvent(self, _):
+        p = QPainter(self)
+        p.fillRect(self.rect(), self.BACKGROUND)
+
+        if self.__n_frames is None:
+            p.end()
+            return
+
+        width = self.width()
+        strip_height = max(1, len(self.__label_names)) * self.ROW_HEIGHT
+
+        if self.__pyramid is not None:
+            image = self.__density_image(width)
+            if image is not None:
+                p.drawImage(QRect(0, 0, width, strip_height), image)
+
+        # stream names
+        p.setPen(self.TEXT_COLOR)
+        font = QFont(self.font())
+        font.setPixelSize(self.ROW_HEIGHT)
+        p.setFont(font)
+        for i, label_name in enumerate(self.__label_names):
+            p.drawText(QRect(2, i * self.ROW_HEIGHT, width, self.ROW_HEIGHT), Qt.AlignLeft | Qt.AlignVCenter, label_name)
+
+        # cursor
+        if self.__fi_current is not None:
+            x = (self.__fi_current - self.__view_start) / self.__view_span * width
+            p.setPen(self.CURSOR_COLOR)
+            p.drawLine(QPointF(x, 0), QPointF(x, strip_height))
+
+        # view range
+        p.setFont(self.font())
+        p.setPen(self.TEXT_COLOR)
+        view_stop = int(self.__view_start + self.__view_span)
+        p.drawText(
+            QRect(0, strip_height, width, self.height() - strip_height),
+            Qt.AlignLeft | Qt.AlignVCenter,
+            f'|{int(self.__view_start)}'
+        )
+        p.drawText(
+            QRect(0, strip_height, width, self.height() - strip_height),
+            Qt.AlignRight | Qt.AlignVCenter,
+            f'{view_stop}|'
+        )
+
+        p.end()